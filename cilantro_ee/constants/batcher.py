@@ -1,9 +1,23 @@
 # constants for transaction batcher
+import configparser
+import os
 
 # in secs
 BATCHER_SLEEP_INTERVAL = 1
 MAX_TXN_SUBMISSION_DELAY = 5
 
-# TODO determine optimum size based on communication and storage efficiencies
-MAX_TXNS_PER_SUB_BLOCK = 100
+# Overrides for the constants below, from config/constants.ini
+_config = configparser.ConfigParser(inline_comment_prefixes=('#',))
+_config.read(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config', 'constants.ini'))
 
+# Adaptive batch size bounds and target round latency (ms). Overridden by the [BATCHER] section of config/constants.ini
+MIN_TXNS_PER_SUB_BLOCK = _config.getint('BATCHER', 'min_tx_per_batch', fallback=10)
+MAX_TXNS_PER_SUB_BLOCK = _config.getint('BATCHER', 'max_tx_per_batch', fallback=2000)
+INITIAL_TXNS_PER_SUB_BLOCK = _config.getint('BATCHER', 'initial_tx_per_batch', fallback=100)
+TARGET_BLOCK_LATENCY = _config.getint('BATCHER', 'target_block_latency', fallback=2000)
+
+# Per stage deadlines of a consensus round in ms. Overridden by the [ROUNDS] section of config/constants.ini
+WORK_COLLECTION_TIMEOUT = _config.getint('ROUNDS', 'work_collection_timeout', fallback=1000)
+EXECUTION_TIMEOUT = _config.getint('ROUNDS', 'execution_timeout', fallback=5000)
+SBC_AGGREGATION_TIMEOUT = _config.getint('ROUNDS', 'sbc_aggregation_timeout', fallback=10000)
+NBN_FANOUT_TIMEOUT = _config.getint('ROUNDS', 'nbn_fanout_timeout', fallback=1000)
@@ -14,6 +14,8 @@ BOOT_DELEGATE_IP_LIST = []
 BOOTNODES = []
 HOST_VK = None
 EPOCH_INTERVAL = 1
+CATCHUP_WINDOW = 256
+SPECULATIVE_EXECUTION = True
 DEFAULT_DIFFICULTY = 'ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff'
 SETUP = False
 
@@ -36,6 +38,8 @@ if not SETUP:
         BOOT_MASTERNODE_IP_LIST = config['boot_masternode_ips'].split(',')
         BOOT_DELEGATE_IP_LIST = config['boot_delegate_ips'].split(',')
         BOOTNODES = BOOT_MASTERNODE_IP_LIST + BOOT_DELEGATE_IP_LIST
+        CATCHUP_WINDOW = config.getint('catchup_window', CATCHUP_WINDOW)
+        SPECULATIVE_EXECUTION = config.getboolean('speculative_execution', SPECULATIVE_EXECUTION)
         HOST_IP = requests.get('https://api.ipify.org').text
 
     SETUP = True
@@ -37,6 +37,25 @@ class LinkedHashTable:
     def find(self, key):
         return True if key in self._table else False
 
+    def get(self, key, default=None):
+        node = self._table.get(key)
+        if node is None:
+            return default
+        return node.value
+
+    def peek_front(self):
+        if not self._first:
+            return None, None
+        return self._first.key, self._first.value
+
+    # Front to back. The current key can be removed while iterating
+    def items(self):
+        node = self._first
+        while node is not None:
+            next_node = node.next
+            yield node.key, node.value
+            node = next_node
+
     def insert_front(self, key, value):
         assert key not in self._table, "Attempted to insert key {} that is already in hash table keys {}".format(key, self._table)
 
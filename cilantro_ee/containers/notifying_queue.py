@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+
+class Notifier:
+    """
+    Wakes up coroutines that are waiting for data to arrive. Producers call notify() whenever they add something a
+    consumer may be waiting for. Consumers call wait_for() with a predicate and sleep until it becomes true instead of
+    spinning on the event loop with asyncio.sleep(0).
+
+    A single notifier can be shared between several queues so that a consumer can wait on any of them at once.
+    """
+
+    def __init__(self):
+        self._waiters = set()
+
+    def notify(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(True)
+
+        self._waiters.clear()
+
+    async def wait(self, timeout=None):
+        # Futures are created lazily so that the notifier can be built before the event loop is running
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.add(waiter)
+
+        try:
+            await asyncio.wait_for(waiter, timeout=timeout)
+        finally:
+            self._waiters.discard(waiter)
+
+    async def wait_for(self, predicate: callable, timeout=None):
+        # Timeout is in seconds. Returns the result of the predicate so callers can tell if the deadline was hit
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while not predicate():
+            remaining = None
+
+            if timeout is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return predicate()
+
+            try:
+                await self.wait(timeout=remaining)
+            except asyncio.TimeoutError:
+                return predicate()
+
+        return True
+
+
+class NotifyingQueue(list):
+    """
+    Plain Python list that signals a Notifier every time an item is added to it. Existing code can keep treating it as
+    a list (len, pop, clear, iteration) while waiters are woken up as soon as data arrives.
+    """
+
+    def __init__(self, iterable=(), notifier: Notifier=None):
+        super().__init__(iterable)
+        self.notifier = notifier or Notifier()
+
+    def append(self, item):
+        super().append(item)
+        self.notifier.notify()
+
+    def extend(self, items):
+        super().extend(items)
+        self.notifier.notify()
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self.notifier.notify()
+
+    async def wait_for_items(self, timeout=None):
+        return await self.notifier.wait_for(lambda: len(self) > 0, timeout=timeout)
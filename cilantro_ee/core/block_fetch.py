@@ -1,16 +1,36 @@
 from cilantro_ee.sockets.socket_book import SocketBook
 from cilantro_ee.storage import VKBook, BlockchainDriver, CilantroStorageDriver
+from cilantro_ee.storage.master import BatchWriter, WRITE_BATCH_SIZE
+from cilantro_ee.storage.async_storage import AsyncStorage
 from cilantro_ee.core.top import TopBlockManager
 from cilantro_ee.crypto.wallet import Wallet
 from cilantro_ee.messages.message import Message, MessageType
 from cilantro_ee.core.canonical import verify_block
-from cilantro_ee.sockets.services import get, defer
+from cilantro_ee.core.snapshots import restore_snapshot, verify_manifest, verify_chunk, SnapshotError
+from cilantro_ee.sockets.services import get
 from cilantro_ee.networking.parameters import ServiceType, NetworkParameters
+from cilantro_ee.logger.base import get_logger
 import zmq.asyncio
 import asyncio
 from collections import Counter
 import time
 
+# Blocks requested ahead of the next one to be stored during catchup
+CATCHUP_WINDOW = 256
+
+# Blocks asked for in one range request. Masternodes serve at most MAX_RANGE_COUNT of them
+RANGE_SIZE = 64
+
+# Milliseconds to wait for each chunk of a range before giving up on the rest of it
+RANGE_TIMEOUT = 1000
+
+# Catchup speed is logged every this many blocks
+REPORT_INTERVAL = 1000
+
+# Snapshot chunks requested at once, and milliseconds to wait for each
+SNAPSHOT_WINDOW = 8
+SNAPSHOT_TIMEOUT = 2000
+
 
 class ConfirmationCounter(Counter):
     def top_item(self):
@@ -37,7 +57,10 @@ class BlockFetcher:
                  network_parameters=NetworkParameters(),
                  top=TopBlockManager(),
                  state=BlockchainDriver(),
-                 masternode_sockets=None):
+                 masternode_sockets=None,
+                 write_batch_size=WRITE_BATCH_SIZE,
+                 window=CATCHUP_WINDOW,
+                 range_size=RANGE_SIZE):
 
         self.contacts = contacts
         self.network_parameters = network_parameters
@@ -49,14 +72,30 @@ class BlockFetcher:
         self.wallet = wallet
         self.ctx = ctx
         self.blocks = blocks
+        self.async_blocks = AsyncStorage(self.blocks) if self.blocks is not None else None
         self.state = state
 
+        # Blocks fetched during catchup are stored in batches. Flushed at the end of every fetch
+        self.writer = BatchWriter(self.blocks, batch_size=write_batch_size) if self.blocks is not None else None
+
+        # Blocks waiting in the writer. They are applied to state once they are stored, so state is never ahead of the
+        # stored blocks
+        self.unapplied = []
+
+        self.window = window
+        self.range_size = max(1, min(range_size, window))
+
+        # Blocks per second of the last catchup
+        self.catchup_rate = 0
+
         self.blocks_to_process = []
 
         self.in_catchup = False
 
+        self.log = get_logger('Catchup')
+
     # Change to max received
-    async def find_missing_block_indexes(self, confirmations=3, timeout=500):
+    async def find_missing_block_indexes(self, confirmations=3, timeout=1000):
         await self.masternodes.refresh()
         responses = ConfirmationCounter()
 
@@ -69,16 +108,19 @@ class BlockFetcher:
             f = asyncio.ensure_future(self.get_latest_block_height(master))
             futures.append(f)
 
-        # Iterate through the status of the
-        now = time.time()
-        while responses.top_count() < confirmations or time.time() - now > timeout:
-            await defer()
-            for f in futures:
-                if f.done():
-                    responses.update([f.result()])
+        # Sleep until responses come in instead of spinning on the event loop. Timeout is in milliseconds
+        pending = set(futures)
+        deadline = time.time() + (timeout / 1000)
+
+        while responses.top_count() < confirmations and len(pending) > 0:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
 
-                    # Remove future
-                    futures.remove(f)
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+
+            for f in done:
+                responses.update([f.result()])
 
         return responses.top_item() or 0
 
@@ -127,7 +169,45 @@ class BlockFetcher:
             if msg_type == MessageType.BLOCK_DATA:
                 return unpacked
 
-    async def find_valid_block(self, i, latest_hash, timeout=500):
+    async def get_block_range_from_master(self, start: int, count: int, socket, timeout=RANGE_TIMEOUT):
+        # One request, answered with a stream of multipart replies of BLOCK_DATA messages over the same connection.
+        # Returns the blocks received in order, which is fewer than count if the masternode doesn't have them all
+        request = Message.get_signed_message_packed_2(
+            wallet=self.wallet,
+            msg_type=MessageType.BLOCK_RANGE_REQUEST,
+            start=start,
+            count=count
+        )
+
+        dealer = self.ctx.socket(zmq.DEALER)
+        dealer.setsockopt(zmq.LINGER, 0)
+
+        blocks = []
+
+        try:
+            dealer.connect(str(socket))
+            await dealer.send(request)
+
+            while len(blocks) < count:
+                event = await dealer.poll(timeout=timeout, flags=zmq.POLLIN)
+                if not event:
+                    break
+
+                for frame in await dealer.recv_multipart():
+                    msg_type, unpacked, _, _, _ = Message.unpack_message_2(frame)
+
+                    if msg_type != MessageType.BLOCK_DATA:
+                        return blocks
+
+                    blocks.append(unpacked)
+        except zmq.error.ZMQError:
+            pass
+        finally:
+            dealer.close()
+
+        return blocks
+
+    async def find_valid_block(self, i, latest_hash, timeout=1000):
         await self.masternodes.refresh()
 
         block_found = False
@@ -139,20 +219,64 @@ class BlockFetcher:
             f = asyncio.ensure_future(self.get_block_from_master(i, master))
             futures.append(f)
 
-        # Iterate through the status of the
-        now = time.time()
-        while not block_found or time.time() - now > timeout:
-            await defer()
-            for f in futures:
-                if f.done():
-                    block = f.result()
-                    block_found = verify_block(subblocks=block.subBlocks,
-                                               previous_hash=latest_hash,
-                                               proposed_hash=block.blockHash)
-                    futures.remove(f)
+        # Wake up as each response arrives and stop at the first block that verifies. Timeout is in milliseconds
+        pending = set(futures)
+        deadline = time.time() + (timeout / 1000)
+
+        while not block_found and len(pending) > 0:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+
+            for f in done:
+                candidate = f.result()
+                if candidate is None:
+                    continue
+
+                if verify_block(subblocks=candidate.subBlocks,
+                                previous_hash=latest_hash,
+                                proposed_hash=candidate.blockHash,
+                                state_root=candidate.stateRoot):
+                    block = candidate
+                    block_found = True
+                    break
 
         return block
 
+    async def request_range(self, start, count, sockets):
+        # Streams the range from one masternode at a time, starting at a different one for each range so the window is
+        # spread over all of them. Whatever one of them is missing is asked of the next. Blocks are only checked against
+        # their own previous hash and against each other here, since the block before the range may not have arrived
+        # yet. fetch_blocks checks that the range links onto the chain
+        blocks = []
+
+        for k in range(len(sockets)):
+            if len(blocks) == count:
+                break
+
+            prev_hash = blocks[-1].blockHash if len(blocks) > 0 else None
+
+            for candidate in await self.get_block_range_from_master(start + len(blocks), count - len(blocks),
+                                                                    sockets[(start // count + k) % len(sockets)]):
+                if candidate.blockNum != start + len(blocks):
+                    break
+
+                if prev_hash is not None and bytes(candidate.prevBlockHash) != prev_hash:
+                    break
+
+                if not verify_block(subblocks=candidate.subBlocks,
+                                    previous_hash=candidate.prevBlockHash,
+                                    proposed_hash=candidate.blockHash,
+                                    state_root=candidate.stateRoot):
+                    break
+
+                blocks.append(candidate)
+                prev_hash = candidate.blockHash
+
+        return blocks
+
     async def fetch_blocks(self, latest_block_available=0):
         latest_block_stored = self.top.get_latest_block_number()
         latest_hash = self.top.get_latest_block_hash()
@@ -160,42 +284,254 @@ class BlockFetcher:
         if latest_block_available <= latest_block_stored:
             return
 
-        for i in range(latest_block_stored, latest_block_available + 1):
-            await self.find_and_store_block(i, latest_hash)
-            latest_hash = self.top.get_latest_block_hash()
+        await self.masternodes.refresh()
+        sockets = list(self.masternodes.sockets.values())
+
+        # Nothing applied yet means starting from the first block. Otherwise the latest block is already applied, as
+        # it is after restoring a snapshot
+        first = latest_block_stored if latest_hash == b'\x00' * 32 else latest_block_stored + 1
+
+        # Up to window blocks are requested ahead of the next one to be stored, in ranges of range_size. Ranges are
+        # streamed and verified as they arrive, in any order, and their blocks are stored strictly in order
+        requests = {}
+        received = {}
+        next_request = first
+        start = time.time()
+        stored = 0
+
+        try:
+            for i in range(first, latest_block_available + 1):
+                while next_request <= latest_block_available:
+                    count = min(self.range_size, latest_block_available + 1 - next_request)
+                    if next_request + count - i > self.window:
+                        break
+
+                    requests[next_request] = asyncio.ensure_future(self.request_range(next_request, count, sockets))
+                    next_request += count
+
+                if i in requests:
+                    for block in await requests.pop(i):
+                        received[block.blockNum] = block
+
+                block = received.pop(i, None)
+
+                # No masternode served the block, or it doesn't follow the one before it. Ask all of them for the
+                # block that does
+                if block is None or bytes(block.prevBlockHash) != latest_hash:
+                    block = await self.find_valid_block(i, latest_hash)
+
+                if block is None:
+                    self.log.error('Could not get a valid block {} from any masternode.'.format(i))
+                    break
+
+                await self.store_block(i, block, latest_hash)
+                latest_hash = block.blockHash
+
+                stored += 1
+                if stored % REPORT_INTERVAL == 0:
+                    self.report(stored, start)
+        finally:
+            for f in requests.values():
+                f.cancel()
+
+        await self.flush_blocks()
+
+        self.report(stored, start)
+
+    def report(self, stored, start):
+        elapsed = time.time() - start
+        self.catchup_rate = stored / elapsed if elapsed > 0 else 0
+        self.log.info('Caught up {} blocks at {:.1f} blocks/s.'.format(stored, self.catchup_rate))
+
+    async def flush_blocks(self):
+        if self.writer is not None:
+            await self.async_blocks.run(self.writer.flush)
+            self.apply_stored_blocks()
 
     async def find_and_store_block(self, block_num, block_hash):
         block = await self.find_valid_block(block_num, block_hash)
 
         if block is not None:
-            block_dict = {
-                'blockHash': block.blockHash,
-                'blockNum': block_num,
-                'blockOwners': [m for m in block.blockOwners],
-                'prevBlockHash': block_hash,
-                'subBlocks': [s for s in block.subBlocks]
-            }
+            await self.store_block(block_num, block, block_hash)
+
+    async def store_block(self, block_num, block, block_hash):
+        block_dict = {
+            'blockHash': block.blockHash,
+            'blockNum': block_num,
+            'blockOwners': [m for m in block.blockOwners],
+            'prevBlockHash': block_hash,
+            'subBlocks': [s.to_dict() for s in block.subBlocks]
+        }
+
+        if len(block.stateRoot) > 0:
+            block_dict['stateRoot'] = block.stateRoot
+
+        # Only store if master, update state if master or delegate
+        if self.writer is None:
+            self.apply_block(block_dict)
+            return
 
-            # Only store if master, update state if master or delegate
+        self.unapplied.append(block_dict)
 
-            if self.blocks is not None:
-                self.blocks.put(block_dict)
+        # Goes through the storage pool because a full batch is written out as part of the put
+        await self.async_blocks.run(self.writer.put, block_dict)
 
-            self.state.update_with_block(block_dict)
-            self.top.set_latest_block_hash(block.blockHash)
-            self.top.set_latest_block_number(block_num)
+        if len(self.writer) == 0:
+            self.apply_stored_blocks()
+
+    def apply_stored_blocks(self):
+        for block_dict in self.unapplied:
+            self.apply_block(block_dict)
+
+        self.unapplied = []
+
+    def apply_block(self, block_dict):
+        self.state.update_with_block(block_dict)
+        self.top.set_latest_block_hash(block_dict['blockHash'])
+        self.top.set_latest_block_number(block_dict['blockNum'])
+
+    async def get_snapshot_manifest(self, socket):
+        request = Message.get_signed_message_packed_2(
+            wallet=self.wallet,
+            msg_type=MessageType.SNAPSHOT_MANIFEST_REQUEST,
+            timestamp=int(time.time()))
+
+        response = await get(socket_id=socket, msg=request, ctx=self.ctx, timeout=500, retries=0, dealer=True)
+
+        if response is not None:
+            msg_type, unpacked, _, _, _ = Message.unpack_message_2(response)
+
+            if msg_type == MessageType.SNAPSHOT_MANIFEST:
+                return {
+                    'epoch': unpacked.epoch,
+                    'blockNum': unpacked.blockNum,
+                    'blockHash': unpacked.blockHash,
+                    'chunkHashes': [h for h in unpacked.chunkHashes],
+                    'root': unpacked.root,
+                    'entries': unpacked.entries
+                }
+
+    async def find_snapshot_manifest(self, confirmations=3):
+        # The latest snapshot the most masternodes agree on, by root. Masternodes snapshot the same blocks, so honest
+        # ones that are caught up all serve the same one
+        await self.masternodes.refresh()
+
+        confirmations = min(confirmations, len(self.masternodes.sockets.values()) - 1)
+
+        manifests = await asyncio.gather(*[self.get_snapshot_manifest(m) for m in self.masternodes.sockets.values()])
+        manifests = [m for m in manifests if m is not None and verify_manifest(m)]
+
+        roots = ConfirmationCounter(m['root'] for m in manifests)
+
+        if roots.top_count() == 0 or roots.top_count() < confirmations:
+            return None
+
+        return next(m for m in manifests if m['root'] == roots.top_item())
+
+    async def get_snapshot_chunk(self, epoch, index, socket):
+        request = Message.get_signed_message_packed_2(
+            wallet=self.wallet,
+            msg_type=MessageType.SNAPSHOT_CHUNK_REQUEST,
+            epoch=epoch,
+            index=index)
+
+        response = await get(socket_id=socket, msg=request, ctx=self.ctx, timeout=SNAPSHOT_TIMEOUT, retries=0,
+                             dealer=True)
+
+        if response is not None:
+            msg_type, unpacked, _, _, _ = Message.unpack_message_2(response)
+
+            if msg_type == MessageType.SNAPSHOT_CHUNK:
+                return unpacked.data
+
+    async def request_chunk(self, manifest, index, sockets, window):
+        # Starts at a different masternode for each chunk and moves on to the next when one doesn't match the manifest
+        async with window:
+            for k in range(len(sockets)):
+                chunk = await self.get_snapshot_chunk(manifest['epoch'], index, sockets[(index + k) % len(sockets)])
+
+                if chunk is not None and verify_chunk(manifest, index, chunk):
+                    return chunk
+
+    async def find_snapshot_block(self, manifest):
+        # The hash of the block was confirmed with the manifest, and covers the block's state root
+        for socket in self.masternodes.sockets.values():
+            block = await self.get_block_from_master(manifest['blockNum'], socket)
+
+            if block is not None and block.blockHash == manifest['blockHash'] and \
+                    verify_block(subblocks=block.subBlocks,
+                                 previous_hash=block.prevBlockHash,
+                                 proposed_hash=block.blockHash,
+                                 state_root=block.stateRoot):
+                return block
+
+    async def bootstrap_from_snapshot(self):
+        # Restores the latest state snapshot if it is ahead of this node, so only the blocks after it are replayed.
+        # Returns the block number state was restored to, or None
+        manifest = await self.find_snapshot_manifest()
+
+        if manifest is None or manifest['blockNum'] <= self.top.get_latest_block_number():
+            return None
+
+        # The restored state has to add up to the state root of the block the snapshot was taken at, or masternodes
+        # could agree on state that doesn't belong to their chain. Without that block nothing is restored
+        block = await self.find_snapshot_block(manifest)
+
+        if block is None or len(block.stateRoot) == 0:
+            self.log.error('Could not get block {} with a state root to check the snapshot against.'.format(
+                manifest['blockNum']))
+            return None
+
+        sockets = list(self.masternodes.sockets.values())
+        window = asyncio.Semaphore(SNAPSHOT_WINDOW)
+
+        start = time.time()
+        chunks = await asyncio.gather(*[self.request_chunk(manifest, i, sockets, window)
+                                        for i in range(len(manifest['chunkHashes']))])
+
+        if any(chunk is None for chunk in chunks):
+            self.log.error('Could not get every chunk of the snapshot at block {}.'.format(manifest['blockNum']))
+            return None
+
+        # Checked against the block's state root before anything is written, and the state written against it after
+        restored = restore_snapshot(self.state, manifest, chunks, state_root=bytes(block.stateRoot))
+
+        self.state.commitment.rebuild()
+
+        if self.state.commitment.root() != bytes(block.stateRoot):
+            raise SnapshotError('State restored from the snapshot at block {} does not match its state root.'.format(
+                manifest['blockNum']))
+
+        self.top.set_latest_block_hash(manifest['blockHash'])
+        self.top.set_latest_block_number(manifest['blockNum'])
+
+        self.log.info('Restored {} keys from the snapshot at block {} in {:.1f}s.'.format(
+            restored, manifest['blockNum'], time.time() - start))
+
+        return manifest['blockNum']
 
     # Main Catchup function. Called at launch of node
     async def sync(self):
         self.in_catchup = True
 
+        # Nodes that don't keep blocks don't need the history, only the state it adds up to
+        if self.blocks is None:
+            await self.bootstrap_from_snapshot()
+
         current_height = await self.find_missing_block_indexes()
         latest_block_stored = self.top.get_latest_block_number()
 
-        while current_height < latest_block_stored:
+        while latest_block_stored < current_height:
+            latest_hash = self.top.get_latest_block_hash()
 
             await self.fetch_blocks(current_height)
+
+            # No masternode had the next block. Blocks made from here on come in through intermediate_sync
+            if self.top.get_latest_block_hash() == latest_hash:
+                break
+
             current_height = await self.find_missing_block_indexes()
+            latest_block_stored = self.top.get_latest_block_number()
 
         self.in_catchup = False
 
@@ -204,6 +540,8 @@ class BlockFetcher:
             b = self.blocks_to_process.pop(0)
             await self.find_and_store_block(b.blockNum, b.blockHash)
 
+        await self.flush_blocks()
+
     # Secondary Catchup function. Called if a new block is created.
     async def intermediate_sync(self, block):
         if self.in_catchup:
@@ -211,19 +549,20 @@ class BlockFetcher:
         else:
             # store block directly
             await self.find_and_store_block(block.blockNum, block.blockHash)
+            await self.flush_blocks()
 
     # Catchup for masternodes who already have storage and state is corrupted for some reason
     async def sync_blocks_with_state(self):
         if self.blocks is None:
             return
 
-        last_block = self.blocks.get_last_n(1, CilantroStorageDriver.INDEX)[0]
+        last_block = (await self.async_blocks.get_last_n(1, CilantroStorageDriver.INDEX))[0]
         last_stored_block_num = last_block.get('blockNum')
         last_state_block_num = self.top.get_latest_block_number()
 
         while last_state_block_num < last_stored_block_num:
             last_state_block_num += 1
-            block_dict = self.blocks.get_block(last_state_block_num)
+            block_dict = await self.async_blocks.get_block(last_state_block_num)
 
             self.state.update_with_block(block_dict)
 
@@ -1,6 +1,9 @@
 from cilantro_ee.sockets.services import AsyncInbox
 
 from cilantro_ee.storage.master import CilantroStorageDriver
+from cilantro_ee.storage.async_storage import AsyncStorage
+from cilantro_ee.containers.lru import LRUCache
+from cilantro_ee.core.snapshots import SnapshotStore
 from cilantro_ee.core.top import TopBlockManager
 from cilantro_ee.messages.message import Message
 from cilantro_ee.messages.message_type import MessageType
@@ -14,6 +17,16 @@ import zmq, zmq.asyncio
 
 subblock_capnp = capnp.load(os.path.dirname(schemas.__file__) + '/subblock.capnp')
 
+# Most blocks served for one range request. Requesters ask for more ranges as they consume them, so this bounds how
+# much a single requester can have queued on the socket at once
+MAX_RANGE_COUNT = 256
+
+# Blocks per multipart reply when streaming a range
+RANGE_CHUNK_SIZE = 16
+
+# Signed BLOCK_DATA replies kept ready to send. Joining nodes all ask for the same recent blocks
+REPLY_CACHE_SIZE = 256
+
 
 # Provide a block blocks to enable data and index requests
 # Otherwise, this will just return latest num and hash, which both delegates and masters can do
@@ -21,7 +34,9 @@ subblock_capnp = capnp.load(os.path.dirname(schemas.__file__) + '/subblock.capnp
 class BlockServer(AsyncInbox):
     def __init__(self, wallet, socket_base, ctx=None, network_parameters=NetworkParameters(),
                  linger=500, poll_timeout=200,
-                 driver: CilantroStorageDriver=None, top=TopBlockManager()
+                 driver: CilantroStorageDriver=None, top=TopBlockManager(),
+                 reply_cache_size=REPLY_CACHE_SIZE,
+                 snapshots: SnapshotStore=None
                  ):
 
         self.wallet = wallet
@@ -35,8 +50,15 @@ class BlockServer(AsyncInbox):
                          poll_timeout=poll_timeout)
 
         self.driver = driver or CilantroStorageDriver(key=self.wallet.signing_key())
+        self.async_driver = AsyncStorage(self.driver)
         self.top = top
 
+        # Block number to (block hash, packed and signed BLOCK_DATA reply)
+        self.reply_cache = LRUCache(maxsize=reply_cache_size)
+
+        # State snapshots taken at epoch boundaries. Only masternodes have them
+        self.snapshots = snapshots
+
     def sync_serve(self):
         asyncio.get_event_loop().run_until_complete(
                            asyncio.ensure_future(self.serve()))
@@ -46,30 +68,44 @@ class BlockServer(AsyncInbox):
 
         if msg_type == MessageType.BLOCK_DATA_REQUEST and self.driver is not None:
 
-            block_dict = self.driver.get_block(msg.blockNum)
+            reply = await self.get_reply(msg.blockNum)
 
-            if block_dict is not None:
-                block_hash = block_dict.get('blockHash')
-                block_num = block_dict.get('blockNum')
-                prev_hash = block_dict.get('prevBlockHash')
-                subblocks = block_dict.get('subBlocks')
-                owners = block_dict.get('blockOwners')
+            if reply is not None:
+                await self.return_msg(_id, reply)
+            else:
+                await self.return_msg(_id, self.bad_request())
 
-                reply = Message.get_signed_message_packed_2(wallet=self.wallet,
-                                                            msg_type=MessageType.BLOCK_DATA,
-                                                            blockHash=block_hash,
-                                                            blockNum=block_num,
-                                                            blockOwners=[owner for owner in owners],
-                                                            prevBlockHash=prev_hash,
-                                                            subBlocks=[subblock_capnp.SubBlock.new_message(**sb) for sb in subblocks],
-                                                            )
+        elif msg_type == MessageType.BLOCK_RANGE_REQUEST and self.driver is not None:
+            await self.stream_blocks(_id, msg.start, msg.count)
 
+        elif msg_type == MessageType.SNAPSHOT_MANIFEST_REQUEST and self.snapshots is not None:
+            manifest = await self.async_driver.run(self.snapshots.latest)
+
+            if manifest is not None:
+                reply = Message.get_signed_message_packed_2(wallet=self.wallet,
+                                                            msg_type=MessageType.SNAPSHOT_MANIFEST,
+                                                            epoch=manifest['epoch'],
+                                                            blockNum=manifest['blockNum'],
+                                                            blockHash=manifest['blockHash'],
+                                                            chunkHashes=manifest['chunkHashes'],
+                                                            root=manifest['root'],
+                                                            entries=manifest['entries'])
                 await self.return_msg(_id, reply)
             else:
+                await self.return_msg(_id, self.bad_request())
+
+        elif msg_type == MessageType.SNAPSHOT_CHUNK_REQUEST and self.snapshots is not None:
+            chunk = await self.async_driver.run(self.snapshots.chunk, msg.epoch, msg.index)
+
+            if chunk is not None:
                 reply = Message.get_signed_message_packed_2(wallet=self.wallet,
-                                                            msg_type=MessageType.BAD_REQUEST,
-                                                            timestamp=int(time.time()))
+                                                            msg_type=MessageType.SNAPSHOT_CHUNK,
+                                                            epoch=msg.epoch,
+                                                            index=msg.index,
+                                                            data=chunk)
                 await self.return_msg(_id, reply)
+            else:
+                await self.return_msg(_id, self.bad_request())
 
         elif msg_type == MessageType.BLOCK_INDEX_REQUEST and self.driver is not None:
             await self.return_msg(_id, b'howdy')
@@ -88,10 +124,73 @@ class BlockServer(AsyncInbox):
 
             await self.return_msg(_id, reply)
         else:
-            reply = Message.get_signed_message_packed_2(wallet=self.wallet,
-                                                        msg_type=MessageType.BAD_REQUEST,
-                                                        timestamp=int(time.time()))
-            await self.return_msg(_id, reply)
+            await self.return_msg(_id, self.bad_request())
+
+    def block_data_reply(self, block_dict):
+        return Message.get_signed_message_packed_2(wallet=self.wallet,
+                                                   msg_type=MessageType.BLOCK_DATA,
+                                                   blockHash=block_dict.get('blockHash'),
+                                                   blockNum=block_dict.get('blockNum'),
+                                                   blockOwners=[owner for owner in block_dict.get('blockOwners')],
+                                                   prevBlockHash=block_dict.get('prevBlockHash'),
+                                                   subBlocks=[subblock_capnp.SubBlock.new_message(**sb)
+                                                              for sb in block_dict.get('subBlocks')],
+                                                   stateRoot=block_dict.get('stateRoot') or b''
+                                                   )
+
+    def cache_block(self, block_dict):
+        # Called when a block is stored, so requests for it are answered without touching storage or the wallet. A
+        # block stored again under the same number replaces the old reply
+        reply = self.block_data_reply(block_dict)
+        self.reply_cache.set(block_dict.get('blockNum'), (block_dict.get('blockHash'), reply))
+        return reply
+
+    async def get_reply(self, block_num):
+        cached = self.reply_cache.get(block_num)
+        if cached is not None:
+            return cached[1]
+
+        block_dict = await self.async_driver.get_block(block_num)
+        if block_dict is None:
+            return None
+
+        return self.cache_block(block_dict)
+
+    def bad_request(self):
+        return Message.get_signed_message_packed_2(wallet=self.wallet,
+                                                   msg_type=MessageType.BAD_REQUEST,
+                                                   timestamp=int(time.time()))
+
+    async def stream_blocks(self, _id, start, count):
+        # Sends blocks start to start + count - 1 as multipart replies of RANGE_CHUNK_SIZE BLOCK_DATA messages each,
+        # reading one chunk from storage at a time. The stream ends early with a BAD_REQUEST at the first block that
+        # isn't stored, so the requester knows not to wait for the rest. Chunks that are all cached are sent from the
+        # cache. Blocks read from storage aren't cached, so a node catching up on old blocks doesn't push out the
+        # recent ones.
+        count = min(count, MAX_RANGE_COUNT)
+        end = start + count
+
+        for chunk_start in range(start, end, RANGE_CHUNK_SIZE):
+            chunk_count = min(RANGE_CHUNK_SIZE, end - chunk_start)
+
+            cached = [self.reply_cache.get(block_num) for block_num in range(chunk_start, chunk_start + chunk_count)]
+
+            if None not in cached:
+                frames = [reply for _, reply in cached]
+            else:
+                blocks = await self.async_driver.get_blocks(chunk_start, chunk_count)
+
+                frames = []
+                for expected, block_dict in zip(range(chunk_start, chunk_start + chunk_count), blocks):
+                    if block_dict.get('blockNum') != expected:
+                        break
+                    frames.append(self.block_data_reply(block_dict))
+
+            if len(frames) < chunk_count:
+                await self.return_msgs(_id, frames + [self.bad_request()])
+                return
+
+            await self.return_msgs(_id, frames)
 
 
 class BlockServerProcess:
@@ -8,6 +8,7 @@ from cilantro_ee.messages import Message, MessageType
 
 subblock_capnp = capnp.load(os.path.dirname(schemas.__file__) + '/subblock.capnp')
 block_capnp = capnp.load(os.path.dirname(schemas.__file__) + '/blockdata.capnp')
+transaction_capnp = capnp.load(os.path.dirname(schemas.__file__) + '/transaction.capnp')
 
 GENESIS_HASH = b'\x00' * 32
 
@@ -24,7 +25,16 @@ def format_dictionary(d: dict) -> dict:
     return {k: v for k, v in sorted(d.items())}
 
 
-def block_from_subblocks(subblocks, previous_hash: bytes, block_num: int) -> dict:
+def block_deltas(subblocks):
+    # State writes of every transaction, in the order they are applied
+    for subblock in subblocks:
+        for tx in subblock['transactions']:
+            for delta in tx['state'] or []:
+                yield delta['key'], delta['value']
+
+
+def block_from_subblocks(subblocks, previous_hash: bytes, block_num: int, commitment=None) -> dict:
+    # With the state commitment of the node building the block, the block also commits to the state it results in
     block_hasher = hashlib.sha3_256()
     block_hasher.update(previous_hash)
 
@@ -43,6 +53,13 @@ def block_from_subblocks(subblocks, previous_hash: bytes, block_num: int) -> dic
         encoded_sb = bson.BSON.encode(sb)
         block_hasher.update(encoded_sb)
 
+    state_root = None
+    if commitment is not None:
+        state_root = commitment.root_after(block_deltas(deserialized_subblocks))
+
+    if state_root is not None:
+        block_hasher.update(state_root)
+
     block = {
         'blockHash': block_hasher.digest(),
         'blockNum': block_num,
@@ -50,10 +67,13 @@ def block_from_subblocks(subblocks, previous_hash: bytes, block_num: int) -> dic
         'subBlocks': deserialized_subblocks
     }
 
+    if state_root is not None:
+        block['stateRoot'] = state_root
+
     return block
 
 
-def verify_block(subblocks, previous_hash: bytes, proposed_hash: bytes):
+def verify_block(subblocks, previous_hash: bytes, proposed_hash: bytes, state_root: bytes=None):
     # Verify signatures!
     block_hasher = hashlib.sha3_256()
     block_hasher.update(previous_hash)
@@ -69,6 +89,10 @@ def verify_block(subblocks, previous_hash: bytes, proposed_hash: bytes):
         encoded_sb = bson.BSON.encode(sb)
         block_hasher.update(encoded_sb)
 
+    # Blocks made without a state commitment have an empty root
+    if state_root:
+        block_hasher.update(state_root)
+
     if block_hasher.digest() == proposed_hash:
         return True
 
@@ -86,6 +110,60 @@ def block_is_skip_block(block: dict):
     return True
 
 
+def block_senders(block: dict):
+    # Senders of every transaction in the block. Their nonces moved and their balances paid for stamps
+    senders = set()
+    for subblock in block['subBlocks']:
+        for tx in subblock['transactions']:
+            senders.add(tx['transaction']['payload']['sender'])
+    return senders
+
+
+def block_contracts(block):
+    # Names of the contracts whose state the block writes to. State keys are prefixed with their contract name
+    if type(block) != dict:
+        block = block.to_dict()
+
+    contracts = set()
+    for subblock in block['subBlocks']:
+        for tx in subblock['transactions']:
+            for delta in tx['state'] or []:
+                key = delta['key']
+                if type(key) == bytes:
+                    key = key.decode()
+                contracts.add(key.split('.', 1)[0])
+    return contracts
+
+
+def transaction_hash(tx: dict):
+    # Same hash the webserver returns when the transaction is submitted. The struct is read back before the canonical
+    # packing so the bytes don't depend on the order the dict sets the fields in
+    struct = transaction_capnp.Transaction.new_message(**tx)
+    struct = transaction_capnp.Transaction.from_bytes_packed(struct.to_bytes_packed())
+    return hashlib.sha3_256(struct.as_builder().to_bytes_packed()).digest()
+
+
+def block_tx_index(block: dict):
+    # Entries locating every transaction of the block by its hash
+    entries = []
+    for sb_idx, subblock in enumerate(block['subBlocks']):
+        txs = subblock['transactions']
+
+        # The leaves of the merkle tree are at the end of the list, after the inner nodes
+        leaves = subblock.get('merkleLeaves') or []
+        first_leaf = len(leaves) - len(txs)
+
+        for i, tx in enumerate(txs):
+            entries.append({
+                'tx_hash': transaction_hash(tx['transaction']),
+                'block': block['blockNum'],
+                'sub_block': sb_idx,
+                'tx_index': i,
+                'tx_leaf': leaves[first_leaf + i] if first_leaf >= 0 else None
+            })
+    return entries
+
+
 def get_failed_block(previous_hash: bytes, block_num: int) -> dict:
     block = {
         'blockHash': b'\x00' * 32,
@@ -9,10 +9,24 @@ class EpochManager:
     def __init__(self, driver=ContractDriver()):
         self.driver = driver
 
+    @staticmethod
+    def is_epoch_boundary(block_num):
+        return block_num % EPOCH_INTERVAL == 0
+
     def update_epoch_if_needed(self, block):
-        if block.blockNum % EPOCH_INTERVAL == 0:
-            self.set_epoch_hash(block.blockHash)
-            self.set_epoch_number(block.blockNum // EPOCH_INTERVAL)
+        # Capnp blocks or block dicts. Returns whether the block started a new epoch
+        if type(block) == dict:
+            block_num, block_hash = block['blockNum'], block['blockHash']
+        else:
+            block_num, block_hash = block.blockNum, block.blockHash
+
+        if not self.is_epoch_boundary(block_num):
+            return False
+
+        self.set_epoch_hash(block_hash)
+        self.set_epoch_number(block_num // EPOCH_INTERVAL)
+
+        return True
 
     def get_epoch_hash(self):
         return self.driver.get(EPOCH_HASH_KEY) or b'x/00' * 32
@@ -0,0 +1,105 @@
+from cilantro_ee.constants.batcher import WORK_COLLECTION_TIMEOUT, EXECUTION_TIMEOUT, SBC_AGGREGATION_TIMEOUT, \
+    NBN_FANOUT_TIMEOUT
+from cilantro_ee.logger.base import get_logger
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import asyncio
+import time
+
+
+class Stage:
+    WORK = 'work'
+    EXECUTION = 'execution'
+    AGGREGATION = 'aggregation'
+    NBN = 'nbn'
+
+    ALL = (WORK, EXECUTION, AGGREGATION, NBN)
+
+
+DEFAULT_DEADLINES = {
+    Stage.WORK: WORK_COLLECTION_TIMEOUT,
+    Stage.EXECUTION: EXECUTION_TIMEOUT,
+    Stage.AGGREGATION: SBC_AGGREGATION_TIMEOUT,
+    Stage.NBN: NBN_FANOUT_TIMEOUT
+}
+
+
+class RoundScheduler:
+    """
+    Keeps the deadlines for each stage of a consensus round and records how long each stage actually took.
+
+    Stages that wait on the network (work collection, SBC aggregation) are handed their deadline and close the round
+    with whatever they have once it passes. Fan outs are cancelled at their deadline. Execution can't be interrupted,
+    so overruns are only recorded.
+
+    All deadlines and timings are in milliseconds.
+    """
+
+    def __init__(self, deadlines: dict=None, history=100, name='ROUND'):
+        self.deadlines = dict(DEFAULT_DEADLINES)
+        if deadlines is not None:
+            self.deadlines.update(deadlines)
+
+        self.timings = defaultdict(lambda: deque(maxlen=history))
+        self.overruns = defaultdict(int)
+        self.rounds = 0
+
+        self.log = get_logger(name)
+
+    def deadline(self, stage):
+        return self.deadlines[stage]
+
+    def timeout(self, stage):
+        # In seconds for asyncio
+        return self.deadlines[stage] / 1000
+
+    def record(self, stage, elapsed):
+        self.timings[stage].append(elapsed)
+
+        if elapsed > self.deadlines[stage]:
+            self.overruns[stage] += 1
+
+    @contextmanager
+    def measure(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.time() - start) * 1000)
+
+    async def run_with_deadline(self, stage, coro, default=None):
+        # Cancels the coroutine if it does not finish before the stage deadline and returns default instead
+        with self.measure(stage):
+            try:
+                return await asyncio.wait_for(coro, timeout=self.timeout(stage))
+            except asyncio.TimeoutError:
+                self.log.error('{} stage hit its deadline of {}ms.'.format(stage, self.deadlines[stage]))
+                return default
+
+    def end_round(self):
+        self.rounds += 1
+
+        last = ', '.join('{} {:.1f}ms'.format(stage, self.timings[stage][-1])
+                         for stage in Stage.ALL if len(self.timings[stage]) > 0)
+
+        self.log.info('Round {} finished. {}'.format(self.rounds, last))
+
+    def stats(self):
+        stats = {}
+
+        for stage in Stage.ALL:
+            timings = sorted(self.timings[stage])
+
+            if len(timings) == 0:
+                continue
+
+            stats[stage] = {
+                'deadline': self.deadlines[stage],
+                'last': self.timings[stage][-1],
+                'mean': sum(timings) / len(timings),
+                'p99': timings[max(int(len(timings) * 0.99) - 1, 0)],
+                'max': timings[-1],
+                'overruns': self.overruns[stage]
+            }
+
+        return stats
@@ -0,0 +1,234 @@
+from cilantro_ee.storage.contract import PENDING_NONCE_KEY
+from cilantro_ee.storage.commitment import STATE_ROOT_KEY, state_root as root_of_state
+from cilantro_ee.core.top import BLOCK_HASH_KEY as TOP_HASH_KEY, BLOCK_NUMBER_KEY as TOP_NUMBER_KEY
+from cilantro_ee.core.epochs import EPOCH_HASH_KEY, EPOCH_NUMBER_KEY
+from cilantro_ee.logger.base import get_logger
+import bson
+import hashlib
+import shutil
+import struct
+import zlib
+import os
+
+# Raw bytes of state per chunk, before compression
+SNAPSHOT_CHUNK_BYTES = 512 * 1024
+
+# Keys read with one get_many while copying state for a snapshot, and written with one set_many while restoring one
+COPY_BATCH = 10_000
+
+# Snapshots kept on disk. Older ones are deleted as new ones are made
+SNAPSHOTS_KEPT = 2
+
+SNAPSHOT_DIRECTORY = '~/.cilantro_ee/snapshots'
+
+# Keys that only describe this node's own progress, or transactions that aren't in a block yet. The state commitment
+# is rebuilt from the restored state, so that it can be checked rather than taken from the snapshot
+EXCLUDED_PREFIXES = (PENDING_NONCE_KEY, TOP_HASH_KEY, TOP_NUMBER_KEY, EPOCH_HASH_KEY, EPOCH_NUMBER_KEY, STATE_ROOT_KEY)
+
+log = get_logger('Snapshots')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_root(block_num, block_hash, chunk_hashes):
+    # Commits to the block the snapshot was taken at as well as to every chunk, so a manifest can't be reused for a
+    # different block
+    h = hashlib.sha3_256()
+    h.update(struct.pack('<I', block_num))
+    h.update(block_hash)
+    for chunk_hash in chunk_hashes:
+        h.update(chunk_hash)
+    return h.digest()
+
+
+def chunk_hash(chunk: bytes):
+    return hashlib.sha3_256(chunk).digest()
+
+
+def state_keys(driver):
+    keys = []
+    for key in driver.iter(''):
+        if isinstance(key, bytes):
+            key = key.decode()
+        if not key.startswith(EXCLUDED_PREFIXES):
+            keys.append(key)
+    return sorted(keys)
+
+
+def encode_chunk(entries):
+    return zlib.compress(bson.BSON.encode({'entries': entries}))
+
+
+def decode_chunk(chunk):
+    return bson.BSON(zlib.decompress(chunk)).decode()['entries']
+
+
+def copy_state(driver, batch=COPY_BATCH):
+    """
+    Every key of committed state that goes into a snapshot, sorted, with its value. Values are read batch keys at a
+    time, so a copy is quick enough to take between two blocks and the snapshot can be made from it while blocks go on.
+    """
+    keys = state_keys(driver)
+    entries = []
+
+    for i in range(0, len(keys), batch):
+        part = keys[i:i + batch]
+        entries.extend([key, value] for key, value in zip(part, driver.get_many(part)) if value is not None)
+
+    return entries
+
+
+def make_snapshot(driver, epoch, block_num, block_hash, chunk_bytes=SNAPSHOT_CHUNK_BYTES):
+    # The state must not change while this runs
+    return make_snapshot_from(copy_state(driver), epoch, block_num, block_hash, chunk_bytes)
+
+
+def make_snapshot_from(entries, epoch, block_num, block_hash, chunk_bytes=SNAPSHOT_CHUNK_BYTES):
+    """
+    Splits a copy of state, sorted (key, value) pairs from copy_state, into compressed chunks of about chunk_bytes of
+    state each. Returns the manifest and the chunks.
+    """
+    chunks = []
+    chunk = []
+    size = 0
+
+    for key, value in entries:
+        chunk.append([key, value])
+        size += len(key) + len(value)
+
+        if size >= chunk_bytes:
+            chunks.append(encode_chunk(chunk))
+            chunk = []
+            size = 0
+
+    if len(chunk) > 0:
+        chunks.append(encode_chunk(chunk))
+
+    chunk_hashes = [chunk_hash(c) for c in chunks]
+
+    manifest = {
+        'epoch': epoch,
+        'blockNum': block_num,
+        'blockHash': block_hash,
+        'chunkHashes': chunk_hashes,
+        'root': snapshot_root(block_num, block_hash, chunk_hashes),
+        'entries': len(entries)
+    }
+
+    return manifest, chunks
+
+
+def verify_manifest(manifest):
+    return manifest['root'] == snapshot_root(manifest['blockNum'], manifest['blockHash'], manifest['chunkHashes'])
+
+
+def verify_chunk(manifest, index, chunk):
+    return 0 <= index < len(manifest['chunkHashes']) and chunk_hash(chunk) == manifest['chunkHashes'][index]
+
+
+def restore_snapshot(driver, manifest, chunks, state_root=None, batch=COPY_BATCH):
+    """
+    Replaces committed state with a snapshot. Every chunk is checked against the manifest, and the manifest against its
+    root, before anything is written. If a state root is given, the state in the snapshot has to add up to it as well.
+    Keys this node has that the snapshot doesn't are deleted, so the state that results is exactly the snapshot's.
+    """
+    if not verify_manifest(manifest):
+        raise SnapshotError('Snapshot root does not match its chunks.')
+
+    if len(chunks) != len(manifest['chunkHashes']):
+        raise SnapshotError('Expected {} chunks, got {}.'.format(len(manifest['chunkHashes']), len(chunks)))
+
+    for i, chunk in enumerate(chunks):
+        if not verify_chunk(manifest, i, chunk):
+            raise SnapshotError('Chunk {} does not match the snapshot.'.format(i))
+
+    entries = [entry for chunk in chunks for entry in decode_chunk(chunk)]
+
+    if state_root is not None and root_of_state(entries) != state_root:
+        raise SnapshotError('State of the snapshot does not match the state root of block {}.'.format(
+            manifest['blockNum']))
+
+    # A value of None deletes the key
+    writes = {key: None for key in state_keys(driver)}
+    writes.update((key, value) for key, value in entries)
+    writes = list(writes.items())
+
+    for i in range(0, len(writes), batch):
+        driver.set_many(dict(writes[i:i + batch]))
+
+    return len(entries)
+
+
+class SnapshotStore:
+    """
+    Snapshots on disk, one directory per epoch holding the manifest and the chunks. Only the latest SNAPSHOTS_KEPT
+    are kept.
+    """
+
+    def __init__(self, path=SNAPSHOT_DIRECTORY, kept=SNAPSHOTS_KEPT):
+        self.path = os.path.expanduser(path)
+        self.kept = kept
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def epoch_path(self, epoch):
+        return os.path.join(self.path, '{:010d}'.format(epoch))
+
+    def epochs(self):
+        return sorted(int(d) for d in os.listdir(self.path) if d.isdigit())
+
+    def save(self, manifest, chunks):
+        # Written next to the final directory and renamed into place, so a snapshot is either complete or not there
+        final = self.epoch_path(manifest['epoch'])
+        tmp = final + '.tmp'
+
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        for i, chunk in enumerate(chunks):
+            with open(os.path.join(tmp, '{}.chunk'.format(i)), 'wb') as f:
+                f.write(chunk)
+
+        with open(os.path.join(tmp, 'manifest'), 'wb') as f:
+            f.write(bson.BSON.encode(manifest))
+
+        shutil.rmtree(final, ignore_errors=True)
+        os.rename(tmp, final)
+
+        for epoch in self.epochs()[:-self.kept]:
+            shutil.rmtree(self.epoch_path(epoch), ignore_errors=True)
+
+    def manifest(self, epoch):
+        try:
+            with open(os.path.join(self.epoch_path(epoch), 'manifest'), 'rb') as f:
+                return bson.BSON(f.read()).decode()
+        except FileNotFoundError:
+            return None
+
+    def latest(self):
+        epochs = self.epochs()
+        if len(epochs) == 0:
+            return None
+        return self.manifest(epochs[-1])
+
+    def chunk(self, epoch, index):
+        try:
+            with open(os.path.join(self.epoch_path(epoch), '{}.chunk'.format(index)), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def take(self, driver, epoch, block_num, block_hash):
+        return self.take_from(copy_state(driver), epoch, block_num, block_hash)
+
+    def take_from(self, entries, epoch, block_num, block_hash):
+        # Makes and saves a snapshot from a copy of state taken at the block
+        manifest, chunks = make_snapshot_from(entries, epoch, block_num, block_hash)
+        self.save(manifest, chunks)
+
+        log.info('Snapshot of epoch {} at block {}: {} keys in {} chunks, {} bytes.'.format(
+            epoch, block_num, manifest['entries'], len(chunks), sum(len(c) for c in chunks)))
+
+        return manifest
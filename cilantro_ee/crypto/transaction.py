@@ -3,7 +3,9 @@ from cilantro_ee.crypto import wallet
 from cilantro_ee.crypto.pow import SHA3POW, SHA3POWBytes
 from contracting import config
 from cilantro_ee.storage import BlockchainDriver
+from cilantro_ee.storage.contract import NONCE_KEY, PENDING_NONCE_KEY
 from cilantro_ee.messages.capnp_impl import capnp_struct as schemas
+import hashlib
 import time
 import os
 import capnp
@@ -109,6 +111,63 @@ def verify_packed_tx(sender, tx):
         return False
 
 
+class PackedTransaction:
+    """
+    Wraps a received transaction with the packed bytes that validation and hashing need. Capnp can't hand back the
+    packed bytes of the nested payload, and clients don't have to pack the outer struct canonically, so both are
+    re-packed once here and reused by the signature check, the proof of work check, input hashes and tx hashes.
+    The raw bytes from the wire are kept as they arrived.
+    """
+
+    __slots__ = ('struct', 'raw', '_payload_bytes', '_tx_bytes', '_hash')
+
+    def __init__(self, struct, raw: bytes=None):
+        self.struct = struct
+        self.raw = raw
+
+        self._payload_bytes = None
+        self._tx_bytes = None
+        self._hash = None
+
+    @classmethod
+    def from_bytes(cls, raw: bytes):
+        return cls(transaction_capnp.Transaction.from_bytes_packed(raw), raw=raw)
+
+    @property
+    def payload(self):
+        return self.struct.payload
+
+    @property
+    def metadata(self):
+        return self.struct.metadata
+
+    @property
+    def payload_bytes(self):
+        # What the sender signed and generated the proof of work over
+        if self._payload_bytes is None:
+            self._payload_bytes = self.struct.payload.as_builder().to_bytes_packed()
+        return self._payload_bytes
+
+    @property
+    def tx_bytes(self):
+        # Canonical packing of the whole transaction. Input hashes are built from these
+        if self._tx_bytes is None:
+            self._tx_bytes = self.struct.as_builder().to_bytes_packed()
+        return self._tx_bytes
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = hashlib.sha3_256(self.tx_bytes).digest()
+        return self._hash
+
+
+def packed_transaction(tx):
+    if isinstance(tx, PackedTransaction):
+        return tx
+    return PackedTransaction(tx)
+
+
 class TransactionException(Exception):
     pass
 
@@ -141,25 +200,43 @@ class TransactionSenderTooFewStamps(TransactionException):
     pass
 
 
-def transaction_is_valid(tx: transaction_capnp.Transaction,
-                         expected_processor: bytes,
-                         driver: BlockchainDriver,
-                         strict=True,
-                         tx_per_block=15):
-    # Validate Signature
-    if not wallet._verify(tx.payload.sender,
-                          tx.payload.as_builder().to_bytes_packed(),
-                          tx.metadata.signature):
+def stamp_balance_key(sender: bytes):
+    currency_contract = 'currency'
+    balances_hash = 'balances'
+
+    return '{}{}{}{}{}'.format(currency_contract,
+                               config.INDEX_SEPARATOR,
+                               balances_hash,
+                               config.DELIMITER,
+                               sender.hex())
+
+
+def transaction_signature(tx):
+    # (vk, msg, signature) triple for batch verification
+    tx = packed_transaction(tx)
+    return tx.payload.sender, tx.payload_bytes, tx.metadata.signature
+
+
+def transaction_is_well_formed(tx, expected_processor: bytes, check_signature=True):
+    # Checks that don't need any state. Safe to run anywhere, e.g. in the webserver worker processes
+    tx = packed_transaction(tx)
+
+    # Validate Signature. Callers that already verified a whole batch of signatures at once can skip this
+    if check_signature and not wallet._verify(*transaction_signature(tx)):
         raise TransactionSignatureInvalid
 
     # Validate Proof
-    if not SHA3POWBytes.check(o=tx.payload.as_builder().to_bytes_packed(), proof=tx.metadata.proof):
+    if not SHA3POWBytes.check(o=tx.payload_bytes, proof=tx.metadata.proof):
         raise TransactionPOWProofInvalid
 
     # Check nonce processor is correct
     if tx.payload.processor != expected_processor:
         raise TransactionProcessorInvalid
 
+
+def transaction_state_is_valid(tx, driver: BlockchainDriver, strict=True, tx_per_block=15):
+    # Checks against the nonces and balances in state. Sets the pending nonce if the transaction is valid
+
     # Attempt to get the current block's pending nonce
     nonce = driver.get_nonce(tx.payload.processor, tx.payload.sender) or 0
 
@@ -185,18 +262,113 @@ def transaction_is_valid(tx: transaction_capnp.Transaction,
     if tx.payload.stampsSupplied < 0:
         raise TransactionStampsNegative
 
-    currency_contract = 'currency'
-    balances_hash = 'balances'
-
-    balances_key = '{}{}{}{}{}'.format(currency_contract,
-                                       config.INDEX_SEPARATOR,
-                                       balances_hash,
-                                       config.DELIMITER,
-                                       tx.payload.sender.hex())
-
-    balance = driver.get(balances_key) or 0
+    balance = driver.get(stamp_balance_key(tx.payload.sender)) or 0
 
     if balance < tx.payload.stampsSupplied:
         raise TransactionSenderTooFewStamps
 
     driver.set_pending_nonce(tx.payload.processor, tx.payload.sender, pending_nonce)
+
+
+def transaction_is_valid(tx,
+                         expected_processor: bytes,
+                         driver: BlockchainDriver,
+                         strict=True,
+                         tx_per_block=15,
+                         check_signature=True):
+    # Takes a capnp Transaction or a PackedTransaction. Either way the payload is only packed once
+    tx = packed_transaction(tx)
+
+    transaction_is_well_formed(tx, expected_processor, check_signature=check_signature)
+    transaction_state_is_valid(tx, driver, strict=strict, tx_per_block=tx_per_block)
+
+
+class PrefetchedState:
+    """
+    Stands in for the driver in transaction_state_is_valid while a batch of transactions is validated. prefetch() reads
+    every nonce, pending nonce and balance the batch needs with one get_many, and anything else is read once per key.
+    Pending nonces are tracked in memory, so later transactions from the same sender see the ones before them, and are
+    handed to the driver together by flush().
+    """
+
+    def __init__(self, driver: BlockchainDriver):
+        self.driver = driver
+
+        self.nonces = {}
+        self.pending_nonces = {}
+        self.values = {}
+
+        self.dirty = set()
+
+    def prefetch(self, txs):
+        pairs = {(tx.payload.processor, tx.payload.sender) for tx in txs}
+        pairs = [pair for pair in pairs if pair not in self.nonces]
+
+        senders = {sender for _, sender in pairs}
+        senders = [sender for sender in senders if stamp_balance_key(sender) not in self.values]
+
+        keys = [BlockchainDriver.n_key(NONCE_KEY, processor, sender) for processor, sender in pairs]
+        keys += [BlockchainDriver.n_key(PENDING_NONCE_KEY, processor, sender) for processor, sender in pairs]
+        keys += [stamp_balance_key(sender) for sender in senders]
+
+        if len(keys) == 0:
+            return
+
+        values = self.driver.get_many(keys)
+
+        n = len(pairs)
+        for i, pair in enumerate(pairs):
+            self.nonces[pair] = values[i]
+            self.pending_nonces[pair] = values[n + i]
+
+        for i, sender in enumerate(senders):
+            self.values[stamp_balance_key(sender)] = values[2 * n + i]
+
+    def get_nonce(self, processor, sender):
+        key = (processor, sender)
+        if key not in self.nonces:
+            self.nonces[key] = self.driver.get_nonce(processor, sender)
+        return self.nonces[key]
+
+    def get_pending_nonce(self, processor, sender):
+        key = (processor, sender)
+        if key not in self.pending_nonces:
+            self.pending_nonces[key] = self.driver.get_pending_nonce(processor, sender)
+        return self.pending_nonces[key]
+
+    def set_pending_nonce(self, processor, sender, nonce):
+        key = (processor, sender)
+        self.pending_nonces[key] = nonce
+        self.dirty.add(key)
+
+    def get(self, key):
+        if key not in self.values:
+            self.values[key] = self.driver.get(key)
+        return self.values[key]
+
+    def flush(self):
+        # Into the driver's write buffer, not straight to the database, so pending nonces of work that never makes it
+        # into a block are dropped with the next revert
+        for processor, sender in self.dirty:
+            self.driver.set_pending_nonce(processor, sender, self.pending_nonces[(processor, sender)])
+        self.dirty.clear()
+
+
+def transactions_are_well_formed(txs, expected_processor: bytes) -> list:
+    # Returns the TransactionException each transaction failed with, or None. Signatures are verified as one batch
+    txs = [packed_transaction(tx) for tx in txs]
+    signatures = wallet._verify_batch([transaction_signature(tx) for tx in txs])
+
+    errors = []
+    for tx, signed in zip(txs, signatures):
+        try:
+            if not signed:
+                raise TransactionSignatureInvalid
+
+            transaction_is_well_formed(tx, expected_processor, check_signature=False)
+            errors.append(None)
+        except TransactionException as e:
+            errors.append(e)
+
+    return errors
+
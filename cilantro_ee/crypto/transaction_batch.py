@@ -50,6 +50,29 @@ def transaction_list_to_transaction_batch(tx_list, wallet: Wallet):
     return msg[1]
 
 
+def empty_transaction_batch(sender: bytes, block_hash: bytes, block_num: int):
+    """
+    Stands in for the work of a masternode that missed the work deadline. Every delegate builds the same batch for the
+    same masternode and round, so the subblock it becomes can reach quorum and the ones after it keep their places. It
+    isn't signed, and its timestamp of 0 puts it in front of all real work.
+    """
+    h = hashlib.sha3_256()
+    h.update(sender)
+    h.update(block_hash)
+    h.update('{}'.format(block_num).encode())
+
+    msg = Message.get_message(
+        msg_type=MessageType.TRANSACTION_BATCH,
+        transactions=[],
+        timestamp=0,
+        signature=b'',
+        inputHash=h.digest(),
+        sender=sender
+    )
+
+    return msg[1]
+
+
 def tx_batch_is_valid(tx_batch, masternodes, latest_block_hash, latest_block_num, timeout=1000):
     if tx_batch.sender.hex() not in masternodes:
         raise NotMasternode
@@ -2,9 +2,22 @@ import nacl
 import nacl.encoding
 import nacl.signing
 from zmq.utils import z85
+from concurrent.futures import ThreadPoolExecutor
+from cilantro_ee.containers.lru import LRUCache
+import hashlib
+import os
 import secrets
 from . import zbase
 
+# Lists with at least this many signatures are spread over the verification pool. Smaller ones are faster inline.
+BATCH_VERIFY_THRESHOLD = 64
+VERIFY_WORKERS = os.cpu_count() or 1
+
+# Signatures that already verified on this node. The same transaction is checked by the webserver, again when it
+# is re-delivered or replayed as work, and again on catchup, so repeats only cost a lookup. Only successes are cached.
+SIGNATURE_CACHE_SIZE = 50_000
+signature_cache = LRUCache(maxsize=SIGNATURE_CACHE_SIZE)
+
 
 def generate_keys(seed=None) -> tuple:
     if seed is not None:
@@ -67,15 +80,89 @@ def _sign(sk: bytes, msg: bytes):
     return sig.signature
 
 
-def _verify(vk: bytes, msg: bytes, signature: bytes):
-    vk = nacl.signing.VerifyKey(vk)
+def _signature_cache_key(vk: bytes, msg: bytes, signature: bytes):
+    return bytes(vk), hashlib.sha3_256(msg).digest(), bytes(signature)
+
+
+def _verify(vk: bytes, msg: bytes, signature: bytes, verify_key=None):
+    key = _signature_cache_key(vk, msg, signature)
+
+    if signature_cache.get(key) is not None:
+        return True
+
+    if verify_key is None:
+        verify_key = nacl.signing.VerifyKey(vk)
+
     try:
-        vk.verify(msg, signature)
+        verify_key.verify(msg, signature)
     except nacl.exceptions.BadSignatureError:
         return False
+
+    signature_cache.set(key, True)
     return True
 
 
+def _verify_triples(triples):
+    # Most lists repeat a handful of senders, so each key is only parsed once
+    verify_keys = {}
+
+    results = []
+    for vk, msg, signature in triples:
+        try:
+            vk = bytes(vk)
+            if vk not in verify_keys:
+                verify_keys[vk] = nacl.signing.VerifyKey(vk)
+
+            results.append(_verify(vk, msg, signature, verify_key=verify_keys[vk]))
+        except (nacl.exceptions.ValueError, nacl.exceptions.TypeError):
+            # Malformed keys or signatures are just invalid signatures in a batch
+            results.append(False)
+    return results
+
+
+_verify_pool = None
+
+
+def verify_pool():
+    # libsodium releases the GIL while verifying, so threads verify in parallel without pickling anything
+    global _verify_pool
+
+    if _verify_pool is None:
+        _verify_pool = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix='verify')
+
+    return _verify_pool
+
+
+def _reset_verify_pool():
+    # Threads don't survive a fork, so a forked process has to start its own pool
+    global _verify_pool
+    _verify_pool = None
+
+
+os.register_at_fork(after_in_child=_reset_verify_pool)
+
+
+def _verify_batch(triples: list, pool=None) -> list:
+    # Verifies a list of (vk, msg, signature) triples in parallel. Returns a list of bools in the same order. Every
+    # signature is still checked on its own, so unlike ed25519 batch verification, one bad signature doesn't fail the
+    # rest and is reported in place.
+    triples = list(triples)
+
+    if len(triples) < BATCH_VERIFY_THRESHOLD:
+        return _verify_triples(triples)
+
+    pool = pool or verify_pool()
+
+    chunk_size = -(-len(triples) // VERIFY_WORKERS)
+    chunks = [triples[i:i + chunk_size] for i in range(0, len(triples), chunk_size)]
+
+    results = []
+    for chunk_results in pool.map(_verify_triples, chunks):
+        results.extend(chunk_results)
+
+    return results
+
+
 class Wallet:
     def __init__(self, seed=None):
         if isinstance(seed, str):
@@ -32,6 +32,11 @@ class CapnpImpl:
             MessageType.BLOCK_INDEX_REQUEST: self.blockdata_capnp.BlockIndexRequest,
             MessageType.BLOCK_INDEX_REPLY: self.blockdata_capnp.BlockIndexReply,
             MessageType.BLOCK_DATA_REQUEST: self.blockdata_capnp.BlockDataRequest,
+            MessageType.BLOCK_RANGE_REQUEST: self.blockdata_capnp.BlockRangeRequest,
+            MessageType.SNAPSHOT_MANIFEST_REQUEST: self.blockdata_capnp.SnapshotManifestRequest,
+            MessageType.SNAPSHOT_MANIFEST: self.blockdata_capnp.SnapshotManifest,
+            MessageType.SNAPSHOT_CHUNK_REQUEST: self.blockdata_capnp.SnapshotChunkRequest,
+            MessageType.SNAPSHOT_CHUNK: self.blockdata_capnp.SnapshotChunk,
             MessageType.BLOCK_DATA: self.blockdata_capnp.BlockData,               # ?
             MessageType.BLOCK_NOTIFICATION: self.notification_capnp.BlockNotification,  # ?
             MessageType.BURN_INPUT_HASHES: self.notification_capnp.BurnInputHashes,
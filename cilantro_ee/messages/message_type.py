@@ -51,3 +51,10 @@ class MessageType(MessageBaseType):
 
     ACKNOWLEDGED = auto()
 
+    BLOCK_RANGE_REQUEST = auto()
+
+    SNAPSHOT_MANIFEST_REQUEST = auto()
+    SNAPSHOT_MANIFEST = auto()
+    SNAPSHOT_CHUNK_REQUEST = auto()
+    SNAPSHOT_CHUNK = auto()
+
@@ -77,7 +77,7 @@ class Parameters:
 
     def get_masternode_sockets(self, service=None):
         masternodes = {}
-        vks = set(self.contacts.masternodes)
+        vks = self.contacts.masternode_set
 
         for k in self.sockets.keys():
             if k in vks:
@@ -93,13 +93,13 @@ class Parameters:
         return masternodes
 
     def get_masternode_vks(self):
-        vks = set(self.contacts.masternodes)
+        vks = self.contacts.masternode_set
         online_nodes = set(self.sockets.keys())
         return vks.intersection(online_nodes)
 
     def get_delegate_sockets(self, service=None):
         delegates = {}
-        vks = set(self.contacts.delegates)
+        vks = self.contacts.delegate_set
 
         for k in self.sockets.keys():
             if k in vks:
@@ -137,7 +137,7 @@ class Parameters:
         return self.network_parameters.resolve(socket, service)
 
     async def refresh(self):
-        pb_nodes = set(self.contacts.delegates + self.contacts.masternodes)
+        pb_nodes = set(self.contacts.core_node_set)
 
         try:
             pb_nodes.remove(self.wallet.verifying_key().hex())
@@ -105,8 +105,12 @@ class PeerServer(services.RequestReplyService):
     async def process_event_subscription_queue(self):
         self.event_queue_loop_running = True
 
+        received = self.event_service.received
+
         while self.event_queue_loop_running:
-            if len(self.event_service.received) > 0:
+            await received.notifier.wait_for(lambda: len(received) > 0 or not self.event_queue_loop_running)
+
+            if len(received) > 0:
                 message, sender = self.event_service.received.pop(0)
                 msg = json.loads(message.decode())
 
@@ -129,8 +133,6 @@ class PeerServer(services.RequestReplyService):
                     if responded_vk is None:
                         del self.table[vk]
 
-            await asyncio.sleep(0)
-
     async def start(self):
         asyncio.ensure_future(asyncio.gather(
             self.serve(),
@@ -145,3 +147,4 @@ class PeerServer(services.RequestReplyService):
         self.event_queue_loop_running = False
         self.event_service.running = False
         self.event_service.stop()
+        self.event_service.received.notifier.notify()
@@ -16,7 +16,8 @@ from cilantro_ee.storage.contract import BlockchainDriver
 
 class Node:
     def __init__(self, socket_base, ctx: zmq.asyncio.Context, wallet, constitution: dict, overwrite=False,
-                 bootnodes=conf.BOOTNODES, network_parameters=NetworkParameters(), driver=BlockchainDriver()):
+                 bootnodes=conf.BOOTNODES, network_parameters=NetworkParameters(), driver=BlockchainDriver(),
+                 blocks=None):
         # Seed state initially
         if driver.get_contract('vkbook') is None or overwrite:
             sync.extract_vk_args(constitution)
@@ -38,16 +39,21 @@ class Node:
 
         self.driver = driver
 
+        # Block storage of nodes that keep the chain. Nodes without it catch up from a state snapshot instead
+        self.blocks = blocks
+
         self.block_fetcher = BlockFetcher(
             wallet=self.wallet,
             ctx=self.ctx,
             contacts=self.contacts,
+            blocks=self.blocks,
             masternode_sockets=SocketBook(
                 socket_base=self.socket_base,
                 service_type=ServiceType.BLOCK_SERVER,
                 phonebook_function=self.contacts.contract.get_masternodes,
                 ctx=self.ctx
-            )
+            ),
+            window=conf.CATCHUP_WINDOW
         )
 
         self.network = Network(
@@ -80,15 +86,34 @@ class Node:
         # Sync contracts
         sync.submit_from_genesis_json_file(cilantro_ee.contracts.__path__[0] + '/genesis.json')
 
+        # State that was written outside of blocks, like genesis, is committed to in one pass. Blocks keep it current
+        if self.driver.commitment.root() is None:
+            self.driver.commitment.rebuild()
+
         # Catchup
         if len(self.contacts.masternodes) > 1:
             await self.block_fetcher.sync()
 
+        # Genesis and catchup write state through their own drivers. From here on this node's driver is the only
+        # writer, so it can keep committed state in memory.
+        self.driver.commitment.reset()
+        self.driver.enable_read_cache()
+        self.contacts.reload()
+
         self.running = True
 
         asyncio.ensure_future(self.nbn_inbox.serve())
 
+    def update_state(self, block):
+        self.driver.update_with_block(block)
+
+        # Only goes back to state if the block changed who the nodes are
+        self.contacts.update_with_block(block)
+
     def stop(self):
         self.network.stop()
         self.nbn_inbox.stop()
-        self.running = False
\ No newline at end of file
+        self.running = False
+
+        # Wake up anything waiting on new blocks so it can see that the node stopped
+        self.nbn_inbox.q.notifier.notify()
\ No newline at end of file
@@ -7,9 +7,11 @@ from cilantro_ee.messages.message_type import MessageType
 
 from cilantro_ee.nodes.delegate import execution
 from cilantro_ee.sockets.services import multicast
+from cilantro_ee.core.rounds import RoundScheduler, Stage
 import heapq
 
 from cilantro_ee.nodes.base import Node
+from cilantro_ee.constants import conf
 from cilantro_ee.logger.base import get_logger
 import asyncio
 
@@ -17,13 +19,18 @@ from contracting.execution.executor import Executor
 
 
 class Delegate(Node):
-    def __init__(self, parallelism=4, *args, **kwargs):
+    def __init__(self, parallelism=4, speculative=conf.SPECULATIVE_EXECUTION, *args, **kwargs):
 
         super().__init__(*args, **kwargs)
 
-        # Number of core / processes we push to
+        # Number of core / processes we push to. The pool is started with the node
         self.parallelism = parallelism
+
+        # Run the transactions inside of each batch speculatively across the pool instead of one batch per process.
+        # Set with speculative_execution in the node's config
+        self.speculative = speculative
         self.executor = Executor(driver=self.driver)
+        self.pool = None
 
         self.work_inbox = WorkInbox(
             socket_id=self.network_parameters.resolve(self.socket_base, ServiceType.INCOMING_WORK, bind=True),
@@ -35,9 +42,14 @@ class Delegate(Node):
 
         self.pending_sbcs = set()
 
+        self.rounds = RoundScheduler(name=f'DEL ROUND {self.wallet.vk_pretty[4:12]}')
+
         self.log = get_logger(f'DEL {self.wallet.vk_pretty[4:12]}')
 
     async def start(self):
+        if self.parallelism > 1:
+            self.pool = execution.make_execution_pool(self.parallelism)
+
         await super().start()
 
         asyncio.ensure_future(self.work_inbox.serve())
@@ -63,11 +75,13 @@ class Delegate(Node):
         if not self.did_sign_block(nbn):
             self.log.info('Did not sign block. Processing.')
             self.driver.revert()
-            self.driver.update_with_block(nbn)
+            self.update_state(nbn)
         elif not block_is_failed(nbn, nbn['prevBlockHash'], nbn['blockNum']):
             self.log.info('Received successful block')
-            self.driver.commit()
-            self.driver.update_with_block(nbn, commit_tx=False)
+            # The results executed here are the ones in the block. They are written from the block rather than
+            # committed from the driver, so the state commitment can take in the values they replace
+            self.driver.revert()
+            self.update_state(nbn)
         else:
             self.log.info('Skip block. Reverting')
             self.driver.revert()
@@ -82,8 +96,9 @@ class Delegate(Node):
             if tx_batch is None:
                 continue
 
-            # Add the rest to a priority queue based on their timestamp
-            heapq.heappush(filtered_work, (tx_batch.timestamp, tx_batch))
+            # Add the rest to a priority queue based on their timestamp. Ties, like the empty batches of masternodes that
+            # missed the deadline, are broken by sender so every delegate orders them the same
+            heapq.heappush(filtered_work, ((tx_batch.timestamp, tx_batch.sender), tx_batch))
 
         return filtered_work
 
@@ -94,7 +109,8 @@ class Delegate(Node):
             return
 
         work = await self.work_inbox.wait_for_next_batch_of_work(
-            current_contacts=self.parameters.get_masternode_vks()
+            current_contacts=self.parameters.get_masternode_vks(),
+            timeout=self.rounds.deadline(Stage.WORK)
         )
         self.log.info(f'Got {len(work)} batch(es) of work')
 
@@ -106,7 +122,9 @@ class Delegate(Node):
             driver=self.driver,
             work=filtered_work,
             wallet=self.wallet,
-            previous_block_hash=self.driver.latest_block_hash
+            previous_block_hash=self.driver.latest_block_hash,
+            pool=self.pool,
+            speculative=self.speculative
         )
 
         # Add merkle roots to track successful sbcs
@@ -132,15 +150,27 @@ class Delegate(Node):
 
             self.log.info(filtered_work)
 
-            sbc_msg = self.process_work(filtered_work)
+            # Execution can't be interrupted. Overruns are only recorded
+            with self.rounds.measure(Stage.EXECUTION):
+                sbc_msg = self.process_work(filtered_work)
 
-            await multicast(self.ctx, sbc_msg, self.masternode_aggregator_sockets())
+            await self.rounds.run_with_deadline(
+                Stage.AGGREGATION,
+                multicast(self.ctx, sbc_msg, self.masternode_aggregator_sockets())
+            )
+
+            with self.rounds.measure(Stage.NBN):
+                nbn = await self.nbn_inbox.wait_for_next_nbn()
 
-            nbn = await self.nbn_inbox.wait_for_next_nbn()
             self.process_nbn(nbn)
+            self.rounds.end_round()
 
     def stop(self):
         self.running = False
         self.network.stop()
         self.work_inbox.stop()
         self.nbn_inbox.stop()
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
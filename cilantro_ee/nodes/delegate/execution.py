@@ -3,17 +3,21 @@ from contracting.stdlib.bridge.decimal import ContractingDecimal
 from contracting.stdlib.bridge.time import Datetime
 
 from cilantro_ee.core.canonical import build_sbc_from_work_results
+from cilantro_ee.storage.contract import BlockchainDriver
 
 import os
 import capnp
 from datetime import datetime
 import heapq
+import re
+import math
+import multiprocessing
 import cilantro_ee.messages.capnp_impl.capnp_struct as schemas
 
 transaction_capnp = capnp.load(os.path.dirname(schemas.__file__) + '/transaction.capnp')
 
 
-def execute_tx(executor: Executor, transaction, environment: dict={}):
+def execute_tx(executor: Executor, transaction, environment: dict={}, writes: dict=None):
     # Deserialize Kwargs. Kwargs should be serialized JSON moving into the future for DX.
     kwargs = {}
     for entry in transaction.payload.kwargs.entries:
@@ -32,6 +36,10 @@ def execute_tx(executor: Executor, transaction, environment: dict={}):
         auto_commit=False
     )
 
+    # Collect the raw writes so that results executed elsewhere can be merged back into a driver
+    if writes is not None:
+        writes.update(output['writes'])
+
     # Encode deltas into a Capnp struct
     deltas = [transaction_capnp.Delta.new_message(key=k, value=v) for k, v in output['writes'].items()]
     tx_output = transaction_capnp.TransactionData.new_message(
@@ -44,32 +52,302 @@ def execute_tx(executor: Executor, transaction, environment: dict={}):
     return tx_output
 
 
-def generate_environment(driver, timestamp, input_hash):
+def build_environment(block_hash: bytes, block_num: int, timestamp, input_hash):
     now = Datetime._from_datetime(
         datetime.utcfromtimestamp(timestamp)
     )
 
     return {
-        'block_hash': driver.latest_block_hash.hex(),
-        'block_num': driver.latest_block_num + 1,
+        'block_hash': block_hash.hex(),
+        'block_num': block_num,
         '__input_hash': input_hash,  # Used for deterministic entropy for random games
         'now': now
     }
 
 
-def execute_tx_batch(executor, driver, batch, timestamp, input_hash):
+def generate_environment(driver, timestamp, input_hash):
+    return build_environment(driver.latest_block_hash, driver.latest_block_num + 1, timestamp, input_hash)
+
+
+def execute_tx_batch(executor, driver, batch, timestamp, input_hash, writes: dict=None):
     environment = generate_environment(driver, timestamp, input_hash)
 
     # Each TX Batch is basically a subblock from this point of view and probably for the near future
     tx_data = []
     for transaction in batch.transactions:
-        tx_data.append(execute_tx(executor, transaction, environment))
+        tx_data.append(execute_tx(executor, transaction, environment, writes=writes))
 
     return tx_data
 
 
-def execute_work(executor, driver, work, wallet, previous_block_hash, parallelism=4):
-    # Assume single threaded, single process for now.
+class ReadRecordingDriver(BlockchainDriver):
+    """
+    Driver that remembers every key that is read through it. Results computed against a snapshot of state can then be
+    checked against the writes of transactions that come before them in canonical order. Reads that list keys, like
+    iter and keys, are remembered by their prefix, since a key written under it would change what they return.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reset_reads()
+
+    def reset_reads(self):
+        # New sets rather than cleared ones, so the reads handed out for the last transaction stay as they were
+        self.reads = set()
+        self.prefix_reads = set()
+
+    def get(self, key, *args, **kwargs):
+        self.reads.add(key)
+        return super().get(key, *args, **kwargs)
+
+    def get_direct(self, key, *args, **kwargs):
+        self.reads.add(key)
+        return super().get_direct(key, *args, **kwargs)
+
+    def get_many(self, keys: list):
+        self.reads.update(keys)
+        return super().get_many(keys)
+
+    def iter(self, prefix, *args, **kwargs):
+        self.prefix_reads.add(prefix)
+        return super().iter(prefix, *args, **kwargs)
+
+    def keys(self, pattern='*', *args, **kwargs):
+        # Everything up to the first wildcard
+        self.prefix_reads.add(re.split(r'[*?\[\\]', pattern, maxsplit=1)[0])
+        return super().keys(pattern, *args, **kwargs)
+
+
+# Each pool process keeps its own driver and executor. They only ever see committed state plus the writes handed to
+# them with a job, so every job runs against a known snapshot of the state.
+_pool_driver = None
+_pool_executor = None
+
+
+def _init_pool_process():
+    global _pool_driver, _pool_executor
+
+    _pool_driver = ReadRecordingDriver()
+    _pool_executor = Executor(driver=_pool_driver)
+
+
+def make_execution_pool(parallelism=4):
+    return multiprocessing.Pool(processes=parallelism, initializer=_init_pool_process)
+
+
+def _execute_in_pool_process(tx_bytes: list, block_hash: bytes, block_num: int, timestamp, input_hash,
+                             overlay: dict=None):
+    # Drop anything left over from the previous job and apply the writes this job has to see on top of the snapshot
+    _pool_driver.revert()
+    if overlay is not None:
+        for k, v in overlay.items():
+            _pool_driver.set(k, v)
+
+    environment = build_environment(block_hash, block_num, timestamp, input_hash)
+
+    # Transactions are executed in order so that each one sees the writes of the ones before it in the job
+    outputs = []
+    for b in tx_bytes:
+        _pool_driver.reset_reads()
+        writes = {}
+
+        transaction = transaction_capnp.Transaction.from_bytes_packed(b)
+        result = execute_tx(_pool_executor, transaction, environment, writes=writes)
+
+        outputs.append((result.to_bytes_packed(), _pool_driver.reads, _pool_driver.prefix_reads, writes))
+
+    _pool_driver.revert()
+
+    return outputs
+
+
+def conflicts_with(reads: set, written: set, prefix_reads: set=frozenset()):
+    if len(reads & written) > 0:
+        return True
+
+    return any(key.startswith(prefix) for prefix in prefix_reads for key in written)
+
+
+def unpack_results(packed_results):
+    return [transaction_capnp.TransactionData.from_bytes_packed(r).as_builder() for r in packed_results]
+
+
+def execute_work_in_pool(pool, executor, driver, work, wallet, previous_block_hash, parallelism=4):
+    # Every transaction batch (subblock) is executed in its own pool process against the same snapshot of state.
+    batches = []
+    while len(work) > 0:
+        _, tx_batch = heapq.heappop(work)
+        batches.append(tx_batch)
+
+    block_hash = driver.latest_block_hash
+    block_num = driver.latest_block_num + 1
+
+    jobs = [
+        pool.apply_async(_execute_in_pool_process, (
+            [tx.as_builder().to_bytes_packed() for tx in tx_batch.transactions],
+            block_hash,
+            block_num,
+            tx_batch.timestamp,
+            tx_batch.inputHash
+        ))
+        for tx_batch in batches
+    ]
+
+    # Merge the results back in timestamp order. A batch that read something an earlier batch wrote would have seen
+    # different state when executed serially, so it is executed again on top of the merged writes instead.
+    subblocks = []
+    written = set()
+
+    for i, (tx_batch, job) in enumerate(zip(batches, jobs)):
+        outputs = job.get()
+
+        reads = set()
+        prefix_reads = set()
+        writes = {}
+        for _, tx_reads, tx_prefix_reads, tx_writes in outputs:
+            reads.update(tx_reads)
+            prefix_reads.update(tx_prefix_reads)
+            writes.update(tx_writes)
+
+        if conflicts_with(reads, written, prefix_reads):
+            writes = {}
+            results = execute_tx_batch(
+                executor=executor,
+                driver=driver,
+                batch=tx_batch,
+                timestamp=tx_batch.timestamp,
+                input_hash=tx_batch.inputHash,
+                writes=writes
+            )
+        else:
+            for k, v in writes.items():
+                driver.set(k, v)
+
+            results = unpack_results([packed for packed, _, _, _ in outputs])
+
+        written.update(writes.keys())
+
+        sbc = build_sbc_from_work_results(
+            input_hash=tx_batch.inputHash,
+            results=results,
+            sb_num=i % parallelism,
+            wallet=wallet,
+            previous_block_hash=previous_block_hash
+        )
+
+        subblocks.append(sbc)
+
+    return subblocks
+
+
+def execute_tx_batch_speculatively(pool, executor, driver, batch, timestamp, input_hash, overlay: dict,
+                                   parallelism=4, writes: dict=None):
+    """
+    Optimistic concurrency inside of a single batch. The transactions are split into consecutive chunks which are
+    executed in parallel against the same snapshot (committed state plus the overlay of writes made earlier in the
+    round). The results are then validated in canonical order: a transaction whose read set touches a key written by an
+    earlier transaction in another chunk saw stale state, so it and the rest of its chunk are executed again in this
+    process on top of the validated writes. Independent transactions, such as transfers between disjoint accounts,
+    never conflict and run fully in parallel.
+    """
+    tx_bytes = [tx.as_builder().to_bytes_packed() for tx in batch.transactions]
+
+    if len(tx_bytes) == 0:
+        return []
+
+    block_hash = driver.latest_block_hash
+    block_num = driver.latest_block_num + 1
+
+    chunk_size = max(1, math.ceil(len(tx_bytes) / parallelism))
+    chunks = [tx_bytes[i:i + chunk_size] for i in range(0, len(tx_bytes), chunk_size)]
+
+    jobs = [
+        pool.apply_async(_execute_in_pool_process, (chunk, block_hash, block_num, timestamp, input_hash, overlay))
+        for chunk in chunks
+    ]
+
+    environment = build_environment(block_hash, block_num, timestamp, input_hash)
+
+    results = []
+    written = set()
+    tx_index = 0
+
+    for job in jobs:
+        chunk_is_valid = True
+
+        # Transactions in a chunk already saw the writes of the ones before them in it, so they are only checked
+        # against the writes of earlier chunks
+        chunk_written = set()
+
+        for packed, tx_reads, tx_prefix_reads, tx_writes in job.get():
+            # Once a transaction in the chunk is re-executed, every later one in the chunk saw its stale writes
+            if chunk_is_valid and conflicts_with(tx_reads, written, tx_prefix_reads):
+                chunk_is_valid = False
+
+            if chunk_is_valid:
+                for k, v in tx_writes.items():
+                    driver.set(k, v)
+
+                results.extend(unpack_results([packed]))
+            else:
+                tx_writes = {}
+                results.append(execute_tx(executor, batch.transactions[tx_index], environment, writes=tx_writes))
+
+            chunk_written.update(tx_writes.keys())
+
+            if writes is not None:
+                writes.update(tx_writes)
+
+            tx_index += 1
+
+        written.update(chunk_written)
+
+    return results
+
+
+def execute_work_speculatively(pool, executor, driver, work, wallet, previous_block_hash, parallelism=4):
+    # Batches are executed one after the other. Each one sees the writes of the batches before it in the round.
+    subblocks = []
+    round_writes = {}
+    i = 0
+
+    while len(work) > 0:
+        _, tx_batch = heapq.heappop(work)
+
+        results = execute_tx_batch_speculatively(
+            pool=pool,
+            executor=executor,
+            driver=driver,
+            batch=tx_batch,
+            timestamp=tx_batch.timestamp,
+            input_hash=tx_batch.inputHash,
+            overlay=dict(round_writes),
+            parallelism=parallelism,
+            writes=round_writes
+        )
+
+        sbc = build_sbc_from_work_results(
+            input_hash=tx_batch.inputHash,
+            results=results,
+            sb_num=i % parallelism,
+            wallet=wallet,
+            previous_block_hash=previous_block_hash
+        )
+
+        subblocks.append(sbc)
+        i += 1
+
+    return subblocks
+
+
+def execute_work(executor, driver, work, wallet, previous_block_hash, parallelism=4, pool=None, speculative=False):
+    if pool is not None and speculative:
+        return execute_work_speculatively(pool, executor, driver, work, wallet, previous_block_hash, parallelism)
+
+    if pool is not None and len(work) > 1:
+        return execute_work_in_pool(pool, executor, driver, work, wallet, previous_block_hash, parallelism)
+
+    # Single process
     subblocks = []
     i = 0
 
@@ -0,0 +1,49 @@
+from cilantro_ee.constants.batcher import MIN_TXNS_PER_SUB_BLOCK, MAX_TXNS_PER_SUB_BLOCK, INITIAL_TXNS_PER_SUB_BLOCK, \
+    TARGET_BLOCK_LATENCY
+
+
+class BatchSizer:
+    """
+    Picks how many transactions go into the next batch from how long the last rounds took.
+
+    A round that used up the whole batch size (the queue was at least that deep) and finished under the target latency
+    means there is more work waiting and room in the latency budget, so the size grows. A round over the target shrinks
+    the size in proportion to how far over it was. Rounds that didn't fill the batch say nothing about capacity, so they
+    only ever shrink it. The size always stays within [min_size, max_size].
+
+    Latencies are in milliseconds.
+    """
+
+    def __init__(self, min_size=MIN_TXNS_PER_SUB_BLOCK, max_size=MAX_TXNS_PER_SUB_BLOCK,
+                 initial_size=INITIAL_TXNS_PER_SUB_BLOCK, target_latency=TARGET_BLOCK_LATENCY,
+                 growth=1.25, headroom=0.8, smoothing=0.5):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+
+        self.growth = growth
+        self.headroom = headroom
+        self.smoothing = smoothing
+
+        self.size = self.clamp(initial_size)
+
+        # Exponentially weighted round latency so one slow round doesn't halve throughput
+        self.latency = None
+
+    def clamp(self, size):
+        return int(max(self.min_size, min(self.max_size, size)))
+
+    def record(self, batch_len, elapsed):
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency = self.smoothing * elapsed + (1 - self.smoothing) * self.latency
+
+        if self.latency > self.target_latency:
+            self.size = self.clamp(self.size * self.target_latency / self.latency)
+
+        elif batch_len >= self.size and self.latency < self.target_latency * self.headroom:
+            self.size = self.clamp(self.size * self.growth)
+
+    def next_size(self):
+        return self.size
@@ -7,8 +7,10 @@ import os
 
 from cilantro_ee.core import canonical
 from cilantro_ee.messages import Message, MessageType, schemas
-from cilantro_ee.crypto.wallet import _verify
+from cilantro_ee.crypto.wallet import _verify, _verify_batch
 from cilantro_ee.containers.merkle_tree import merklize
+from cilantro_ee.containers.notifying_queue import NotifyingQueue
+from cilantro_ee.constants.batcher import SBC_AGGREGATION_TIMEOUT
 
 import asyncio
 import time
@@ -48,9 +50,19 @@ class SBCIndexGreaterThanPossibleError(SBCException):
     pass
 
 
+def sbc_signature(sbc):
+    # (vk, msg, signature) triple. Empty subblocks sign their input hash instead of a merkle leaf
+    if len(sbc.transactions) == 0:
+        msg = sbc.inputHash
+    else:
+        msg = sbc.merkleTree.leaves[0]
+
+    return sbc.signer, msg, sbc.merkleTree.signature
+
+
 class SBCInbox(AsyncInbox):
     def __init__(self, driver: BlockchainDriver, expected_subblocks=4, *args, **kwargs):
-        self.q = []
+        self.q = NotifyingQueue()
         self.driver = driver
         self.expected_subblocks = expected_subblocks
         self.log = get_logger('SBC')
@@ -66,11 +78,17 @@ class SBCInbox(AsyncInbox):
         if len(msg_blob.contenders) != self.expected_subblocks:
             return
 
+        # Verify all of the contender signatures at once, then the rest of each contender
+        signatures = _verify_batch([sbc_signature(sbc) for sbc in msg_blob.contenders])
+
         # Make sure all the contenders are valid
         all_valid = True
         for i in range(len(msg_blob.contenders)):
             try:
-                self.sbc_is_valid(msg_blob.contenders[i], i)
+                if not signatures[i]:
+                    raise SBCInvalidSignatureError
+
+                self.sbc_is_valid(msg_blob.contenders[i], i, check_signature=False)
             except SBCException as e:
                 self.log.error(type(e))
                 all_valid = False
@@ -80,23 +98,12 @@ class SBCInbox(AsyncInbox):
             self.q.append(msg_blob.contenders)
             self.log.info('Added new SBC')
 
-    def sbc_is_valid(self, sbc, sb_idx=0):
+    def sbc_is_valid(self, sbc, sb_idx=0, check_signature=True):
         if sbc.subBlockNum != sb_idx:
             raise SBCIndexMismatchError
 
         # Make sure signer is in the delegates
-        if len(sbc.transactions) == 0:
-            msg = sbc.inputHash
-        else:
-            msg = sbc.merkleTree.leaves[0]
-
-        valid_sig = _verify(
-            vk=sbc.signer,
-            msg=msg,
-            signature=sbc.merkleTree.signature
-        )
-
-        if not valid_sig:
+        if check_signature and not _verify(*sbc_signature(sbc)):
             raise SBCInvalidSignatureError
 
         if sbc.prevBlockHash != self.driver.latest_block_hash:
@@ -116,12 +123,19 @@ class SBCInbox(AsyncInbox):
     def has_sbc(self):
         return len(self.q) > 0
 
-    async def receive_sbc(self):
-        while len(self.q) <= 0:
-            await asyncio.sleep(0)
+    async def receive_sbc(self, timeout=None):
+        # Returns None if nothing arrived before the timeout (in seconds)
+        if not await self.q.wait_for_items(timeout=timeout):
+            return
 
         return self.q.pop(0)
 
+    def clean(self):
+        # Drop contenders that were built on top of a block that is no longer the latest, i.e. ones that missed their
+        # round's deadline
+        latest_block_hash = self.driver.latest_block_hash
+        self.q[:] = [sbcs for sbcs in self.q if len(sbcs) > 0 and sbcs[0].prevBlockHash == latest_block_hash]
+
 
 class CurrentContenders:
     def __init__(self, total_contacts=2, quorum_ratio=0.66, expected_subblocks=4):
@@ -205,17 +219,28 @@ class Aggregator:
         self.driver = driver
         self.log = get_logger('AGG')
 
-    async def gather_subblocks(self, total_contacts, quorum_ratio=0.66, expected_subblocks=4, timeout=1000):
+    async def gather_subblocks(self, total_contacts, quorum_ratio=0.66, expected_subblocks=4,
+                               timeout=SBC_AGGREGATION_TIMEOUT):
         self.sbc_inbox.expected_subblocks = expected_subblocks
+        self.sbc_inbox.clean()
 
         contenders = CurrentContenders(total_contacts, quorum_ratio=quorum_ratio, expected_subblocks=expected_subblocks)
 
+        # Close the round when every subblock has reached quorum (or can't) or when the deadline (in ms) is hit
+        deadline = time.time() + (timeout / 1000)
+
         while len(contenders.finished) < expected_subblocks:
-            if self.sbc_inbox.has_sbc():
-                sbcs = await self.sbc_inbox.receive_sbc() # Can probably make this raw sync code
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.log.error('Aggregation deadline hit. {} of {} subblocks finished.'.format(
+                    len(contenders.finished), expected_subblocks))
+                break
+
+            sbcs = await self.sbc_inbox.receive_sbc(timeout=remaining)
+            if sbcs is not None:
                 contenders.add_sbcs(sbcs)
-            await asyncio.sleep(0)
 
+        # Subblocks that did not finish in time fail the block
         for i in range(expected_subblocks):
             if contenders.finished.get(i) is None:
                 contenders.finished[i] = None
@@ -229,7 +254,8 @@ class Aggregator:
         return canonical.block_from_subblocks(
             [v for _, v in sorted(subblocks.items())],
             previous_hash=self.driver.latest_block_hash,
-            block_num=self.driver.latest_block_num + 1
+            block_num=self.driver.latest_block_num + 1,
+            commitment=self.driver.commitment
         )
 
     async def start(self):
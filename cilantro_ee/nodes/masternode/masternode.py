@@ -1,13 +1,20 @@
 import asyncio
+import time
 from cilantro_ee.core.block_server import BlockServer
 
 from cilantro_ee.nodes.masternode.transaction_batcher import TransactionBatcher
 from cilantro_ee.storage import CilantroStorageDriver
+from cilantro_ee.storage.async_storage import AsyncStorage
+from cilantro_ee.storage.contract import BlockchainDriver
+from cilantro_ee.core.epochs import EpochManager
+from cilantro_ee.core.snapshots import SnapshotStore, copy_state
 from cilantro_ee.sockets.services import multicast
 from cilantro_ee.nodes.masternode.webserver import WebServer
 from cilantro_ee.nodes.masternode.block_contender import Aggregator
 from cilantro_ee.networking.parameters import ServiceType
 from cilantro_ee.core import canonical
+from cilantro_ee.nodes.masternode.mempool import Mempool
+from cilantro_ee.core.rounds import RoundScheduler, Stage
 
 from cilantro_ee.nodes.base import Node
 from cilantro_ee.logger.base import get_logger
@@ -15,19 +22,28 @@ from cilantro_ee.logger.base import get_logger
 
 class Masternode(Node):
     def __init__(self, webserver_port=8080, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+        # Masternodes serve the whole chain, so they replay and store every block on catchup
+        super().__init__(blocks=CilantroStorageDriver(key=kwargs['wallet'].verifying_key()), *args, **kwargs)
 
-        self.blocks = CilantroStorageDriver(key=self.wallet.verifying_key())
+        self.async_blocks = AsyncStorage(self.blocks)
+
+        self.epochs = EpochManager()
+        self.snapshots = SnapshotStore()
+        self.snapshot_task = None
 
         # Services
         self.block_server = BlockServer(
             wallet=self.wallet,
             socket_base=self.socket_base,
-            network_parameters=self.network_parameters
+            network_parameters=self.network_parameters,
+            snapshots=self.snapshots
         )
 
         self.webserver = WebServer(wallet=self.wallet, port=webserver_port, driver=self.driver)
-        self.tx_batcher = TransactionBatcher(wallet=self.wallet, queue=[])
+
+        # New transactions and new block notifications share a notifier so the run loop can sleep until either arrives
+        self.work_notifier = self.nbn_inbox.q.notifier
+        self.tx_batcher = TransactionBatcher(wallet=self.wallet, queue=Mempool(notifier=self.work_notifier))
         self.current_nbn = canonical.get_genesis_block()
 
         self.aggregator = Aggregator(
@@ -39,6 +55,8 @@ class Masternode(Node):
             driver=self.driver
         )
 
+        self.rounds = RoundScheduler(name=f'MN ROUND {self.wallet.vk_pretty[4:12]}')
+
         self.log = get_logger(f'MN {self.wallet.vk_pretty[4:12]}')
 
     async def start(self):
@@ -62,11 +80,14 @@ class Masternode(Node):
         else:
             await self.join_quorum()
 
+    def has_work_or_nbn(self):
+        return len(self.tx_batcher.queue) > 0 or len(self.nbn_inbox.q) > 0
+
     async def new_blockchain_boot(self):
-        while len(self.tx_batcher.queue) == 0 and len(self.nbn_inbox.q) == 0:
-            if not self.running:
-                return
-            await asyncio.sleep(0)
+        await self.work_notifier.wait_for(lambda: self.has_work_or_nbn() or not self.running)
+
+        if not self.running:
+            return
 
         if len(self.tx_batcher.queue) > 0:
             await self.parameters.refresh()
@@ -81,15 +102,15 @@ class Masternode(Node):
         nbn = await self.nbn_inbox.wait_for_next_nbn()
 
         # Update with state
-        self.driver.update_with_block(nbn)
-        self.blocks.put(nbn, self.blocks.BLOCK)
+        self.update_state(nbn)
+        await self.store_block(nbn)
 
         while len(self.tx_batcher.queue) == 0:
-            await asyncio.sleep(0)
+            await self.work_notifier.wait_for(self.has_work_or_nbn)
             if len(self.nbn_inbox.q) > 0:
                 nbn = self.nbn_inbox.q.pop(0)
-                self.driver.update_with_block(nbn)
-                self.blocks.put(nbn, self.blocks.BLOCK)
+                self.update_state(nbn)
+                await self.store_block(nbn)
 
         await self.process_blocks()
 
@@ -104,7 +125,12 @@ class Masternode(Node):
         if len(self.delegate_work_sockets()) == 0:
             return
 
-        return await multicast(self.ctx, tx_batch, self.delegate_work_sockets())  # Works
+        # Unreachable delegates should not hold up the round
+        return await self.rounds.run_with_deadline(
+            Stage.WORK,
+            multicast(self.ctx, tx_batch, self.delegate_work_sockets()),
+            default=[]
+        )
 
     async def wait_for_work(self, block):
         is_skip_block = canonical.block_is_skip_block(block)
@@ -115,43 +141,74 @@ class Masternode(Node):
         # If so, hang until you get a new block or some work OR NBN
         self.nbn_inbox.clean()
 
-        while is_skip_block and len(self.tx_batcher.queue) <= 0:
-            if len(self.nbn_inbox.q) > 0:
-                break
+        if is_skip_block:
+            await self.work_notifier.wait_for(self.has_work_or_nbn)
 
-            await asyncio.sleep(0)
+    async def store_block(self, block):
+        await self.async_blocks.put(block, self.blocks.BLOCK)
 
-    def process_block(self, block):
+        # Other nodes ask for the newest blocks the most, so their signed replies are made now, off the event loop
+        await self.async_blocks.run(self.block_server.cache_block, block)
+
+        if self.epochs.update_epoch_if_needed(block) and block['blockNum'] > 0:
+            await self.take_snapshot(block)
+
+    async def take_snapshot(self, block):
+        # Blocks are applied one at a time and the copy is awaited before the next, so state holds still while it is
+        # read. Read in batches through a driver of its own so the whole state doesn't go through the read cache
+        entries = await self.async_blocks.run(copy_state, BlockchainDriver())
+
+        # Chunks are made and written from the copy while blocks go on
+        self.snapshot_task = asyncio.ensure_future(self.async_blocks.run(
+            self.snapshots.take_from, entries, self.epochs.get_epoch_number(), block['blockNum'], block['blockHash']
+        ))
+
+    async def process_block(self, block):
         do_not_store = canonical.block_is_failed(block, self.driver.latest_block_hash, self.driver.latest_block_num + 1)
         do_not_store |= canonical.block_is_skip_block(block)
 
         #if not do_not_store:
         if block['blockNum'] != self.driver.latest_block_num:
-            self.driver.update_with_block(block)
-            self.blocks.put(block, self.blocks.BLOCK)
+            self.update_state(block)
+            await self.store_block(block)
             del block['_id']
 
+            # Drop waiting transactions the block made stale or underfunded
+            self.tx_batcher.queue.evict(self.driver, canonical.block_senders(block))
+
     async def process_blocks(self):
         while self.running:
+            round_start = time.time()
+
             sends = await self.send_work()
 
             if sends is None:
                 return
 
             # this really should just give us a block straight up
-            block = await self.aggregator.gather_subblocks(
-                total_contacts=len(self.contacts.delegates),
-                expected_subblocks=len(self.contacts.masternodes)
-            )
+            with self.rounds.measure(Stage.AGGREGATION):
+                block = await self.aggregator.gather_subblocks(
+                    total_contacts=len(self.contacts.delegates),
+                    expected_subblocks=len(self.contacts.masternodes),
+                    timeout=self.rounds.deadline(Stage.AGGREGATION)
+                )
+
+            await self.process_block(block)
 
-            self.process_block(block)
+            # Feed the round latency back into the batch size before waiting on new work
+            self.tx_batcher.record_round((time.time() - round_start) * 1000)
 
             await self.wait_for_work(block)
 
             # Pack current NBN into message
-            await multicast(self.ctx, canonical.dict_to_msg_block(block), self.nbn_sockets())
+            await self.rounds.run_with_deadline(
+                Stage.NBN,
+                multicast(self.ctx, canonical.dict_to_msg_block(block), self.nbn_sockets())
+            )
+
+            self.rounds.end_round()
 
     def stop(self):
         super().stop()
         self.block_server.stop()
-        self.webserver.app.stop()
+        self.webserver.stop()
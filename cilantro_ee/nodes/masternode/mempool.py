@@ -0,0 +1,137 @@
+from cilantro_ee.containers.linked_hashtable import LinkedHashTable
+from cilantro_ee.containers.notifying_queue import Notifier
+from cilantro_ee.crypto.transaction import packed_transaction, stamp_balance_key, PrefetchedState
+from cilantro_ee.storage import BlockchainDriver
+
+
+class Mempool:
+    """
+    Transactions waiting to be batched, kept in one lane per sender. The webserver only admits a sender's transactions
+    in strict nonce order, so each lane is in nonce order.
+
+    In O(1) per transaction it supports:
+        - Adding a transaction (duplicates by hash are dropped)
+        - Removing a transaction by hash
+        - Taking transactions off for a batch
+
+    Batches are filled round robin across senders, taking at most tx_per_block from each sender, so one busy sender
+    can't starve the rest.
+    """
+
+    def __init__(self, tx_per_block=15, notifier: Notifier=None):
+        self.tx_per_block = tx_per_block
+
+        # Wakes up whoever is waiting for transactions to batch
+        self.notifier = notifier or Notifier()
+
+        self.txs = {}
+        self.lanes = {}
+
+        # Senders with transactions waiting, in the order they get their next turn
+        self.senders = LinkedHashTable()
+
+    def __len__(self):
+        return len(self.txs)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.txs
+
+    def append(self, tx):
+        tx = packed_transaction(tx)
+
+        if tx.hash in self.txs:
+            return False
+
+        sender = tx.payload.sender
+
+        lane = self.lanes.get(sender)
+        if lane is None:
+            lane = LinkedHashTable()
+            self.lanes[sender] = lane
+            self.senders.append(sender, None)
+
+        lane.append(tx.hash, tx)
+        self.txs[tx.hash] = tx
+
+        self.notifier.notify()
+
+        return True
+
+    def extend(self, txs):
+        for tx in txs:
+            self.append(tx)
+
+    def remove(self, tx_hash):
+        tx = self.txs.pop(tx_hash, None)
+        if tx is None:
+            return
+
+        sender = tx.payload.sender
+        lane = self.lanes[sender]
+        lane.remove(tx_hash)
+
+        if len(lane) == 0:
+            self._drop_lane(sender)
+
+    def _drop_lane(self, sender):
+        del self.lanes[sender]
+        self.senders.remove(sender)
+
+    def clear(self):
+        self.txs.clear()
+        self.lanes.clear()
+        self.senders.clear()
+
+    def pop_batch(self, n=100):
+        batch = []
+
+        # Every sender that has transactions waiting gets at most one turn per batch
+        turns = len(self.senders)
+
+        while len(batch) < n and turns > 0:
+            turns -= 1
+
+            sender, _ = self.senders.pop_front()
+            lane = self.lanes[sender]
+
+            taken = 0
+            while taken < self.tx_per_block and len(batch) < n and len(lane) > 0:
+                tx_hash, tx = lane.pop_front()
+                del self.txs[tx_hash]
+
+                batch.append(tx)
+                taken += 1
+
+            # Back of the line for the next batch
+            if len(lane) > 0:
+                self.senders.append(sender, None)
+            else:
+                del self.lanes[sender]
+
+        return batch
+
+    def evict(self, driver: BlockchainDriver, senders):
+        # Drops transactions of the given senders that can no longer be executed: ones whose nonce was already used
+        # in a block, and ones the sender no longer has the stamps for. Returns how many were evicted.
+        senders = [sender for sender in senders if sender in self.lanes]
+
+        state = PrefetchedState(driver)
+        state.prefetch([tx for sender in senders for _, tx in self.lanes[sender].items()])
+
+        evicted = 0
+
+        for sender in senders:
+            lane = self.lanes.get(sender)
+            if lane is None:
+                continue
+
+            balance = state.get(stamp_balance_key(sender)) or 0
+
+            for tx_hash, tx in lane.items():
+                nonce = state.get_nonce(tx.payload.processor, sender) or 0
+
+                if tx.payload.nonce < nonce or tx.payload.stampsSupplied > balance:
+                    self.remove(tx_hash)
+                    evicted += 1
+
+        return evicted
@@ -1,4 +1,6 @@
 from cilantro_ee.crypto.wallet import Wallet
+from cilantro_ee.nodes.masternode.mempool import Mempool
+from cilantro_ee.nodes.masternode.batch_sizer import BatchSizer
 
 from cilantro_ee.messages.message import Message
 from cilantro_ee.messages.message_type import MessageType
@@ -8,10 +10,13 @@ import time
 
 
 class TransactionBatcher:
-    def __init__(self, wallet: Wallet, queue):
+    def __init__(self, wallet: Wallet, queue: Mempool, sizer: BatchSizer=None):
         self.wallet = wallet
         self.queue = queue
 
+        self.sizer = sizer or BatchSizer()
+        self.last_batch_len = 0
+
     def make_empty_batch(self):
         timestamp = time.time()
         h = hashlib.sha3_256()
@@ -30,21 +35,22 @@ class TransactionBatcher:
             sender=self.wallet.verifying_key()
         )
 
-    def pack_current_queue(self, tx_number=100):
+    def pack_current_queue(self, tx_number=None):
         # if len(self.queue) == 0:
         #     return self.make_empty_batch()
 
-        # Pop elements off into a list
-        tx_list = []
+        # Size the batch from how the last rounds went unless told otherwise
+        if tx_number is None:
+            tx_number = self.sizer.next_size()
 
-        while len(tx_list) < tx_number and len(self.queue) > 0:
-            tx_list.append(self.queue.pop(0))
+        # Take the next batch off of the mempool
+        tx_list = self.queue.pop_batch(tx_number)
+        self.last_batch_len = len(tx_list)
 
-        # Hash transactions to come up with the entire hash of the batch
+        # Hash transactions to come up with the entire hash of the batch. Reuses the bytes packed during validation
         h = hashlib.sha3_256()
         for tx in tx_list:
-            tx_bytes = tx.as_builder().to_bytes_packed()
-            h.update(tx_bytes)
+            h.update(tx.tx_bytes)
 
         timestamp = time.time()
         # Add a timestamp
@@ -57,7 +63,7 @@ class TransactionBatcher:
         msg = Message.get_signed_message_packed_2(
             wallet=self.wallet,
             msg_type=MessageType.TRANSACTION_BATCH,
-            transactions=[t for t in tx_list],
+            transactions=[t.struct for t in tx_list],
             timestamp=timestamp,
             signature=signature,
             inputHash=input_hash,
@@ -65,3 +71,7 @@ class TransactionBatcher:
         )
 
         return msg
+
+    def record_round(self, elapsed):
+        # Time in ms from sending the last batch until its block was processed
+        self.sizer.record(self.last_batch_len, elapsed)
@@ -6,10 +6,14 @@ import json as _json
 from contracting.client import ContractingClient
 
 from cilantro_ee.storage import MasterStorage, BlockchainDriver
+from cilantro_ee.storage.async_storage import AsyncStorage
 
-from cilantro_ee.crypto.transaction import transaction_is_valid, \
-    TransactionNonceInvalid, TransactionProcessorInvalid, TransactionTooManyPendingException, \
-    TransactionSenderTooFewStamps, TransactionPOWProofInvalid, TransactionSignatureInvalid, TransactionStampsNegative
+from cilantro_ee.crypto.transaction import transactions_are_well_formed, transaction_state_is_valid, \
+    PackedTransaction, PrefetchedState, TransactionNonceInvalid, TransactionProcessorInvalid, \
+    TransactionTooManyPendingException, TransactionSenderTooFewStamps, TransactionPOWProofInvalid, \
+    TransactionSignatureInvalid, TransactionStampsNegative
+
+from cilantro_ee.sockets.services import AsyncInbox, get, _socket
 
 from cilantro_ee.messages.capnp_impl import capnp_struct as schemas
 import os
@@ -19,16 +23,68 @@ import ast
 import ssl
 import hashlib
 import asyncio
+import multiprocessing
+import zmq.asyncio
 
 log = get_logger("MN-WebServer")
 transaction_capnp = capnp.load(os.path.dirname(schemas.__file__) + '/transaction.capnp')
 
+# These exceptions are tested to work in the transaction_is_valid tests
+TRANSACTION_ERRORS = {
+    TransactionNonceInvalid: 'Transaction nonce is invalid.',
+    TransactionProcessorInvalid: 'Transaction processor does not match expected processor.',
+    TransactionTooManyPendingException: 'Too many pending transactions currently in the block.',
+    TransactionSenderTooFewStamps: 'Transaction sender has too few stamps for this transaction.',
+    TransactionPOWProofInvalid: 'Transaction proof of work is invalid.',
+    TransactionSignatureInvalid: 'Transaction is not signed by the sender.',
+    TransactionStampsNegative: 'Transaction has negative stamps supplied.'
+}
+
+QUEUE_FULL = {'error': 'Queue full. Resubmit shortly.'}
+ADMISSION_TIMEOUT = {'error': 'Masternode is busy. Resubmit shortly.'}
+
+# Single transactions keep the old request size limit. Batches can be up to MAX_BATCH_LEN of them
+MAX_TX_SIZE = 10_000
+MAX_BATCH_LEN = 1_000
+
+# Seconds the server process gets to stop its workers before it is killed
+SERVER_STOP_TIMEOUT = 5
+
+
+def _hex_bytes(obj):
+    # Stored blocks hold raw bytes, which JSON can't carry
+    if isinstance(obj, bytes):
+        return obj.hex()
+    if isinstance(obj, dict):
+        return {k: _hex_bytes(v) for k, v in obj.items() if k != '_id'}
+    if isinstance(obj, list):
+        return [_hex_bytes(v) for v in obj]
+    return obj
+
+
+class AdmissionInbox(AsyncInbox):
+    """
+    Runs on the masternode's event loop. The webserver worker processes do all of the checks that don't need state
+    and forward well formed transactions here. This is the only place that reads and sets pending nonces, so
+    admission stays serialized no matter how many workers there are.
+    """
+
+    def __init__(self, admit, *args, **kwargs):
+        self.admit = admit
+        super().__init__(*args, **kwargs)
+
+    async def handle_msg(self, _id, msg):
+        txs = [PackedTransaction(tx) for tx in transaction_capnp.Transactions.from_bytes_packed(msg).transactions]
+        results = self.admit(txs)
+
+        await self.return_msg(_id, _json.dumps(results).encode())
+
 
 class WebServer:
     def __init__(self, wallet, queue=[], port=8080, ssl_port=443, ssl_enabled=False,
                  ssl_cert_file='~/.ssh/server.csr',
                  ssl_key_file='~/.ssh/server.key',
-                 workers=2, debug=False, access_log=False,
+                 workers=2, debug=False, access_log=False, admission_socket=None,
                  max_queue_len=10_000,
                  contracting_client=ContractingClient(),
                  driver=BlockchainDriver(),
@@ -38,7 +94,7 @@ class WebServer:
         # Setup base Sanic class and CORS
         self.app = Sanic(__name__)
         self.app.config.update({
-            'REQUEST_MAX_SIZE': 10000,
+            'REQUEST_MAX_SIZE': MAX_TX_SIZE * MAX_BATCH_LEN,
             'REQUEST_TIMEOUT': 5
         })
         self.cors = CORS(self.app, automatic_options=True)
@@ -47,6 +103,7 @@ class WebServer:
         self.client = contracting_client
         self.driver = driver
         self.blocks = blocks
+        self.async_blocks = AsyncStorage(self.blocks)
 
         self.static_headers = {}
 
@@ -70,8 +127,19 @@ class WebServer:
         self.debug = debug
         self.access_log = access_log
 
+        # With more than one worker, HTTP is served by a separate process whose Sanic workers share the listen socket.
+        # They forward well formed transactions to the admission inbox over IPC.
+        self.admission_socket = admission_socket or _socket('ipc:///tmp/cil-admission-{}'.format(port))
+        self.admission_inbox = None
+        self.server_process = None
+
+        # Only True inside of the worker processes
+        self.forward_admission = False
+        self.admission_ctx = None
+
         # Add Routes
         self.app.add_route(self.submit_transaction, '/', methods=['POST', 'OPTIONS'])
+        self.app.add_route(self.submit_transactions, '/batch', methods=['POST', 'OPTIONS'])
         self.app.add_route(self.ping, '/ping', methods=['GET', 'OPTIONS'])
         self.app.add_route(self.get_id, '/id', methods=['GET'])
         self.app.add_route(self.get_nonce, '/nonce/<vk>', methods=['GET'])
@@ -84,9 +152,25 @@ class WebServer:
 
         # Block Explorer / Blockchain Routes
         self.app.add_route(self.get_latest_block, '/latest_block', methods=['GET', 'OPTIONS', ])
+        self.app.add_route(self.get_tx, '/tx/<_hash>', methods=['GET', 'OPTIONS', ])
 #        self.app.add_route(self.get_block, '/blocks', methods=['GET', 'OPTIONS', ])
 
     async def start(self):
+        if self.workers > 1:
+            self.admission_inbox = AdmissionInbox(
+                admit=self.admit,
+                socket_id=self.admission_socket,
+                ctx=zmq.asyncio.Context.instance(),
+                wallet=self.wallet
+            )
+            asyncio.ensure_future(self.admission_inbox.serve())
+
+            # Sanic runs its workers as daemonic children of this process, and daemonic processes can't have
+            # children of their own. So it can't be daemonic itself and stop has to take it down
+            self.server_process = multiprocessing.Process(target=self.serve_workers, daemon=False)
+            self.server_process.start()
+            return
+
         # Start server with SSL enabled or not
         if self.ssl_enabled:
             asyncio.ensure_future(self.app.create_server(host='127.0.0.1', port=self.ssl_port, debug=self.debug,
@@ -95,49 +179,135 @@ class WebServer:
             asyncio.ensure_future(self.app.create_server(host='127.0.0.1', port=self.port, debug=self.debug,
                                   access_log=self.access_log))
 
+    def serve_workers(self):
+        # Entry point of the server process. Sanic forks the workers from here and they all share the listen socket.
+        # Newer versions of Sanic spawn their workers instead, which fails in a forked process, so it is pinned
+        self.forward_admission = True
+
+        # State keeps changing in the node process, which can't invalidate a copy of its read cache held out here
+        self.driver.disable_read_cache()
+
+        if self.ssl_enabled:
+            self.app.run(host='127.0.0.1', port=self.ssl_port, workers=self.workers, debug=self.debug,
+                         access_log=self.access_log, ssl=self.context)
+        else:
+            self.app.run(host='127.0.0.1', port=self.port, workers=self.workers, debug=self.debug,
+                         access_log=self.access_log)
+
+    def stop(self):
+        if self.admission_inbox is not None:
+            self.admission_inbox.stop()
+
+        if self.server_process is not None:
+            # Sanic stops its workers when its process gets SIGTERM
+            self.server_process.terminate()
+            self.server_process.join(timeout=SERVER_STOP_TIMEOUT)
+
+            if self.server_process.is_alive():
+                self.server_process.kill()
+                self.server_process.join()
+
+            self.server_process = None
+        else:
+            self.app.stop()
+
+    def admit(self, txs: list):
+        # Checks that need state. Returns the HTTP status and body for each transaction. Nonces and balances are read
+        # once per sender for the whole list and pending nonces are written back at the end.
+        state = PrefetchedState(self.driver)
+        state.prefetch(txs)
+
+        results = []
+
+        for tx in txs:
+            if len(self.queue) >= self.max_queue_len:
+                results.append((503, QUEUE_FULL))
+                continue
+
+            try:
+                transaction_state_is_valid(tx=tx, driver=state, strict=True)
+            except tuple(TRANSACTION_ERRORS.keys()) as e:
+                results.append((200, {'error': TRANSACTION_ERRORS[type(e)]}))
+                continue
+
+            # Put it in the rate limiter queue.
+            self.queue.append(tx)
+
+            results.append((200, {'success': 'Transaction successfully submitted to the network.',
+                                  'hash': tx.hash.hex()}))
+
+        state.flush()
+
+        return results
+
+    async def forward(self, txs: list):
+        # Contexts don't survive a fork, so each worker makes its own
+        if self.admission_ctx is None:
+            self.admission_ctx = zmq.asyncio.Context()
+
+        msg = transaction_capnp.Transactions.new_message(transactions=[tx.struct for tx in txs]).to_bytes_packed()
+        reply = await get(self.admission_socket, msg=msg, ctx=self.admission_ctx, dealer=True)
+
+        if reply is None:
+            return [(503, ADMISSION_TIMEOUT) for _ in txs]
+
+        return _json.loads(reply)
+
+    async def process(self, txs: list):
+        # Stateless checks run off the event loop. Well formed transactions are then admitted here, or by the
+        # masternode process when running in a worker. Returns the HTTP status and body for each transaction in order
+        errors = await asyncio.get_event_loop().run_in_executor(None, transactions_are_well_formed, txs,
+                                                                 self.wallet.verifying_key())
+
+        results = [(200, {'error': TRANSACTION_ERRORS[type(e)]}) if e is not None else None for e in errors]
+
+        well_formed = [tx for tx, e in zip(txs, errors) if e is None]
+
+        if len(well_formed) > 0:
+            if self.forward_admission:
+                admitted = await self.forward(well_formed)
+            else:
+                admitted = self.admit(well_formed)
+
+            admitted = iter(admitted)
+            results = [r if r is not None else next(admitted) for r in results]
+
+        return results
+
     # Main Endpoint to Submit TXs
     async def submit_transaction(self, request):
-        if len(self.queue) >= self.max_queue_len:
-            return response.json({'error': "Queue full. Resubmit shortly."}, status=503)
+        if not self.forward_admission and len(self.queue) >= self.max_queue_len:
+            return response.json(QUEUE_FULL, status=503)
+
+        if len(request.body) > MAX_TX_SIZE:
+            return response.json({'error': 'Transaction too large.'}, status=413)
 
         # Try to deserialize transaction.
         try:
-            tx = transaction_capnp.Transaction.from_bytes_packed(request.body)
+            tx = PackedTransaction.from_bytes(request.body)
 
         except Exception as e:
             return response.json({'error': 'Malformed transaction.'.format(e)}, status=400)
 
+        status, result = (await self.process([tx]))[0]
+
+        return response.json(result, status=status)
+
+    # Submit a packed Transactions struct. Each transaction is accepted or rejected on its own
+    async def submit_transactions(self, request):
         try:
-            transaction_is_valid(tx=tx,
-                                 expected_processor=self.wallet.verifying_key(),
-                                 driver=self.driver,
-                                 strict=True)
-
-        # These exceptions are tested to work in the transaction_is_valid tests
-        except TransactionNonceInvalid:
-            return response.json({'error': 'Transaction nonce is invalid.'})
-        except TransactionProcessorInvalid:
-            return response.json({'error': 'Transaction processor does not match expected processor.'})
-        except TransactionTooManyPendingException:
-            return response.json({'error': 'Too many pending transactions currently in the block.'})
-        except TransactionSenderTooFewStamps:
-            return response.json({'error': 'Transaction sender has too few stamps for this transaction.'})
-        except TransactionPOWProofInvalid:
-            return response.json({'error': 'Transaction proof of work is invalid.'})
-        except TransactionSignatureInvalid:
-            return response.json({'error': 'Transaction is not signed by the sender.'})
-        except TransactionStampsNegative:
-            return response.json({'error': 'Transaction has negative stamps supplied.'})
-
-        # Put it in the rate limiter queue.
-        self.queue.append(tx)
-
-        h = hashlib.sha3_256()
-        h.update(request.body)
-        tx_hash = h.digest()
-
-        return response.json({'success': 'Transaction successfully submitted to the network.',
-                              'hash': tx_hash.hex()})
+            txs = transaction_capnp.Transactions.from_bytes_packed(request.body).transactions
+            txs = [PackedTransaction(tx) for tx in txs]
+
+        except Exception as e:
+            return response.json({'error': 'Malformed transactions.'}, status=400)
+
+        if len(txs) > MAX_BATCH_LEN:
+            return response.json({'error': 'Too many transactions. Max is {}.'.format(MAX_BATCH_LEN)}, status=413)
+
+        results = await self.process(txs)
+
+        return response.json({'results': [result for _, result in results]})
 
     # Network Status
     async def ping(self, request):
@@ -235,7 +405,7 @@ class WebServer:
         return response.json({'values': values, 'next': values[-1][0]}, status=200)
 
     async def get_latest_block(self, request):
-        index = self.blocks.get_last_n(n=1, collection=MasterStorage.BLOCK)
+        index = await self.async_blocks.get_last_n(1, MasterStorage.BLOCK)
         return response.json(index[0])
 
     async def get_latest_block_number(self, request):
@@ -244,14 +414,27 @@ class WebServer:
     async def get_latest_block_hash(self, request):
         return response.json({'latest_block_hash': self.driver.get_latest_block_hash()})
 
+    async def get_tx(self, request, _hash):
+        try:
+            tx_hash = bytes.fromhex(_hash)
+        except ValueError:
+            return response.json({'error': 'Malformed transaction hash.'}, status=400)
+
+        receipt = await self.async_blocks.get_receipt(tx_hash)
+
+        if receipt is None:
+            return response.json({'error': 'Transaction with hash {} does not exist.'.format(_hash)}, status=404)
+
+        return response.json(_hex_bytes(receipt))
+
     async def get_block_by_number(self, request, number):
-        block = self.blocks.get_block(number)
+        block = await self.async_blocks.get_block(number)
         if block is None:
             return response.json({'error': 'Block at number {} does not exist.'.format(number)}, status=400)
         return response.json(_json.dumps(block))
 
     async def get_block_by_hash(self, request, _hash):
-        block = self.blocks.get_block(_hash)
+        block = await self.async_blocks.get_block(_hash)
         if block is None:
             return response.json({'error': 'Block with hash {} does not exist.'.format(_hash)}, status=400)
         return response.json(_json.dumps(block))
@@ -4,6 +4,7 @@ from cilantro_ee.messages import MessageType, Message
 from cilantro_ee.sockets.services import AsyncInbox
 from cilantro_ee.storage import BlockchainDriver, VKBook
 from cilantro_ee.logger.base import get_logger
+from cilantro_ee.containers.notifying_queue import NotifyingQueue
 import math
 
 
@@ -25,7 +26,7 @@ class BadConsensusBlock(BlockNotificationException):
 
 class NBNInbox(AsyncInbox):
     def __init__(self, contacts: VKBook, driver: BlockchainDriver=BlockchainDriver(), verify=True, allow_current_block_num=False, *args, **kwargs):
-        self.q = []
+        self.q = NotifyingQueue()
         self.contacts = contacts
         self.driver = driver
         self.verify = verify
@@ -56,16 +57,16 @@ class NBNInbox(AsyncInbox):
         #    raise BlockNumberMismatch
 
         # Check if signed by quorum amount
+        quorum = math.ceil(len(self.contacts.delegates) * self.quorum_ratio)
         for sub_block in msg_blob.subBlocks:
-            if len(sub_block.signatures) < math.ceil(len(self.contacts.delegates) * self.quorum_ratio):
+            if len(sub_block.signatures) < quorum:
                 raise BadConsensusBlock
 
         # Deserialize off the socket
         return msg_blob.to_dict()
 
     async def wait_for_next_nbn(self):
-        while len(self.q) <= 0:
-            await asyncio.sleep(0)
+        await self.q.wait_for_items()
 
         nbn = self.q.pop(0)
         if nbn['blockNum'] < self.driver.latest_block_num:
@@ -76,4 +77,6 @@ class NBNInbox(AsyncInbox):
         return nbn
 
     def clean(self):
-        self.q = [nbn for nbn in self.q if nbn['blockNum'] > self.driver.latest_block_num]
+        # Filter in place so that the queue keeps notifying waiters
+        latest_block_num = self.driver.latest_block_num
+        self.q[:] = [nbn for nbn in self.q if nbn['blockNum'] > latest_block_num]
@@ -1,14 +1,17 @@
 import asyncio
 import hashlib
 
-from cilantro_ee.crypto.transaction import transaction_is_valid, TransactionException
-from cilantro_ee.crypto.wallet import _verify
+from cilantro_ee.crypto.transaction import transaction_is_valid, transaction_signature, PackedTransaction, \
+    PrefetchedState, TransactionException, TransactionSignatureInvalid
+from cilantro_ee.crypto.wallet import _verify_batch
 from cilantro_ee.messages.message import Message
 from cilantro_ee.messages.message_type import MessageType
 from cilantro_ee.storage import BlockchainDriver
 from cilantro_ee.sockets.services import AsyncInbox
 from cilantro_ee.storage.vkbook import VKBook
-from cilantro_ee.crypto.transaction_batch import transaction_list_to_transaction_batch
+from cilantro_ee.crypto.transaction_batch import empty_transaction_batch
+from cilantro_ee.containers.notifying_queue import Notifier
+from cilantro_ee.constants.batcher import WORK_COLLECTION_TIMEOUT
 
 from cilantro_ee.logger.base import get_logger
 import logging
@@ -48,6 +51,9 @@ class WorkInbox(AsyncInbox):
         self.todo = []
         self.accepting_work = False
 
+        # Wakes up wait_for_next_batch_of_work when new work arrives
+        self.notifier = Notifier()
+
         self.log = get_logger('DEL WI')
 
         super().__init__(*args, **kwargs)
@@ -62,10 +68,13 @@ class WorkInbox(AsyncInbox):
             if not self.verify:
                 msg_type, msg_blob, _, _, _ = Message.unpack_message_2(msg)
                 self.work[msg_blob.sender.hex()] = msg_blob
+                self.notifier.notify()
+                return
 
             try:
                 msg_struct = self.verify_transaction_bag(msg)
                 self.work[msg_struct.sender.hex()] = msg_struct
+                self.notifier.notify()
             except DelegateWorkInboxException as e:
                 # Audit trigger
                 self.log.error(type(e))
@@ -84,44 +93,77 @@ class WorkInbox(AsyncInbox):
         if msg_blob.sender.hex() not in self.current_contacts:
             raise NotMasternode
 
-        # Set up a hasher for input hash and a list for valid txs
-        h = hashlib.sha3_256()
-
-        for tx in msg_blob.transactions:
-            # Double check to make sure all transactions are valid
-            try:
-                transaction_is_valid(tx=tx,
-                                     expected_processor=msg_blob.sender,
-                                     driver=self.driver,
-                                     strict=False)
-            except TransactionException as e:
-                raise e
+        # Each transaction is packed once and the bytes are shared by the input hash, signature and PoW checks
+        transactions = [PackedTransaction(tx) for tx in msg_blob.transactions]
 
-            h.update(tx.as_builder().to_bytes_packed())
+        # Set up a hasher for input hash
+        h = hashlib.sha3_256()
+        for tx in transactions:
+            h.update(tx.tx_bytes)
 
         h.update('{}'.format(msg_blob.timestamp).encode())
         input_hash = h.digest()
-        if input_hash != msg_blob.inputHash or \
-           not _verify(msg_blob.sender, h.digest(), msg_blob.signature):
+
+        if input_hash != msg_blob.inputHash:
             raise InvalidSignature
 
+        # Verify every transaction signature and the batch signature in one go. The batch signature is last.
+        triples = [transaction_signature(tx) for tx in transactions]
+        triples.append((msg_blob.sender, input_hash, msg_blob.signature))
+
+        valid = _verify_batch(triples)
+
+        if not all(valid[:-1]):
+            raise TransactionSignatureInvalid
+
+        if not valid[-1]:
+            raise InvalidSignature
+
+        # Validate against state in memory. One read for the whole batch and one write of the pending nonces at the end
+        state = PrefetchedState(self.driver)
+        state.prefetch(transactions)
+
+        for tx in transactions:
+            # Double check to make sure all transactions are valid
+            transaction_is_valid(tx=tx,
+                                 expected_processor=msg_blob.sender,
+                                 driver=state,
+                                 strict=False,
+                                 check_signature=False)
+
+        state.flush()
+
         return msg_blob
 
-    async def wait_for_next_batch_of_work(self, current_contacts, timeout=1000):
+    async def wait_for_next_batch_of_work(self, current_contacts, timeout=WORK_COLLECTION_TIMEOUT):
         self.accepting_work = True
         self.current_contacts = current_contacts
 
         for work in self.todo:
             await self.handle_msg(None, work)
+        self.todo.clear()
+
+        # Masternodes only send work when they have a round to run, so wait as long as it takes for the first batch
+        if len(current_contacts) > 0:
+            await self.notifier.wait_for(lambda: len(self.work) > 0)
+
+        # Then give the rest of the masternodes that are currently online until the deadline (in ms) to send theirs
+        all_work_received = await self.notifier.wait_for(
+            lambda: len(set(current_contacts) - set(self.work.keys())) == 0,
+            timeout=timeout / 1000
+        )
 
-        # Wait for work from all masternodes that are currently online
-        # start = time.time() * 1000
-        while len(set(current_contacts) - set(self.work.keys())) > 0:
-            await asyncio.sleep(0)
+        if not all_work_received:
+            self.log.error('Work deadline hit. Missing work from {}'.format(set(current_contacts) - set(self.work.keys())))
 
-        # If timeout is hit, just pad the rest of the expected amounts with empty tx batches?
+        # If timeout is hit, just pad the rest of the expected amounts with empty tx batches. They are the same on every
+        # delegate, so the round still lines up
         for masternode in set(current_contacts) - set(self.work.keys()):
-            self.work[masternode] = transaction_list_to_transaction_batch([], wallet=self.wallet)
+            self.work[masternode] = empty_transaction_batch(
+                sender=bytes.fromhex(masternode),
+                block_hash=self.driver.latest_block_hash,
+                block_num=self.driver.latest_block_num
+            )
 
         self.accepting_work = False
 
@@ -1,5 +1,6 @@
 from cilantro_ee.crypto.wallet import Wallet
 from cilantro_ee.logger.base import get_logger
+from cilantro_ee.containers.notifying_queue import NotifyingQueue
 import zmq
 import asyncio
 import json
@@ -101,7 +102,7 @@ class SubscriptionService:
         self.running = False
 
         # Async queues
-        self.received = []
+        self.received = NotifyingQueue()
         self.to_remove = []
 
     def add_subscription(self, socket_id: SocketStruct, filter=b''):
@@ -130,7 +131,11 @@ class SubscriptionService:
         self.running = True
 
         while self.running:
-            await asyncio.sleep(0)
+            # Nothing to poll. Sleep for a poll interval instead of spinning the event loop
+            if len(self.subscriptions) == 0:
+                await asyncio.sleep(self.timeout / 1000)
+            else:
+                await asyncio.sleep(0)
 
             for address, socket in self.subscriptions.items():
                 try:
@@ -278,10 +283,14 @@ class AsyncInbox:
         await self.return_msg(_id, msg)
 
     async def return_msg(self, _id, msg):
+        await self.return_msgs(_id, [msg])
+
+    async def return_msgs(self, _id, msgs: list):
+        # Several messages in one multipart reply. The requester gets them all from one recv_multipart
         sent = False
         while not sent:
             try:
-                await self.socket.send_multipart([_id, msg])
+                await self.socket.send_multipart([_id, *msgs])
                 sent = True
             except zmq.error.ZMQError:
                 self.socket.close()
@@ -301,22 +310,25 @@ async def send_out(ctx, msg, socket_id):
     socket = ctx.socket(zmq.DEALER)
     s = socket.get_monitor_socket()
 
-    # Try to connect
-    socket.connect(str(socket_id))
+    try:
+        # Try to connect
+        socket.connect(str(socket_id))
+
+        # See if the connection was successful
+        evnt = await s.recv_multipart()
+        evnt_dict = monitor.parse_monitor_message(evnt)
 
-    # See if the connection was successful
-    evnt = await s.recv_multipart()
-    evnt_dict = monitor.parse_monitor_message(evnt)
+        # If so, shoot out the message
+        if evnt_dict['event'] == 1:
+            socket.send(msg, flags=zmq.NOBLOCK)
+            return True, evnt_dict['endpoint'].decode()
 
-    # If so, shoot out the message
-    if evnt_dict['event'] == 1:
-        socket.send(msg, flags=zmq.NOBLOCK)
-        socket.close()
-        return True, evnt_dict['endpoint'].decode()
+        # Otherwise, return result for further processing / updating sockets
+        return False, evnt_dict['endpoint'].decode()
 
-    # Otherwise, close the socket. Return result and the socket for further processing / updating sockets
-    socket.close()
-    return False, evnt_dict['endpoint'].decode()
+    # Always close the socket, even if the send is cancelled by a deadline
+    finally:
+        socket.close()
 
 
 async def multicast(ctx, msg: bytes, peers: list):
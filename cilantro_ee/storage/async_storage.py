@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import asyncio
+import os
+
+# Blocking storage calls in flight at once, per process. More than this queue up instead of piling threads onto the
+# database
+STORAGE_WORKERS = 4
+
+_storage_pool = None
+
+
+def storage_pool():
+    global _storage_pool
+
+    if _storage_pool is None:
+        _storage_pool = ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix='storage')
+
+    return _storage_pool
+
+
+def _reset_storage_pool():
+    # Threads don't survive a fork, so a forked process has to start its own pool
+    global _storage_pool
+    _storage_pool = None
+
+
+os.register_at_fork(after_in_child=_reset_storage_pool)
+
+
+class AsyncStorage:
+    """
+    Awaitable front for MasterStorage. Every call runs on a bounded thread pool, so a slow database stalls the
+    coroutine that is waiting on it instead of the whole event loop.
+    """
+
+    def __init__(self, storage, pool: ThreadPoolExecutor=None):
+        self.storage = storage
+        self.pool = pool
+
+    async def run(self, f, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.pool or storage_pool(), functools.partial(f, *args, **kwargs))
+
+    async def get_block(self, v=None):
+        return await self.run(self.storage.get_block, v)
+
+    async def get_blocks(self, start, count):
+        return await self.run(self.storage.get_blocks, start, count)
+
+    async def put(self, data, collection=0):
+        return await self.run(self.storage.put, data, collection)
+
+    async def put_blocks(self, blocks):
+        return await self.run(self.storage.put_blocks, blocks)
+
+    async def get_last_n(self, n, collection=1):
+        return await self.run(self.storage.get_last_n, n, collection)
+
+    async def get_owners(self, v):
+        return await self.run(self.storage.get_owners, v)
+
+    async def get_index(self, v):
+        return await self.run(self.storage.get_index, v)
+
+    async def get_tx(self, h):
+        return await self.run(self.storage.get_tx, h)
+
+    async def get_receipt(self, tx_hash):
+        return await self.run(self.storage.get_receipt, tx_hash)
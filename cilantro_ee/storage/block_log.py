@@ -0,0 +1,300 @@
+from bson.objectid import ObjectId
+from cilantro_ee.storage.latency import QueryStats
+import bson
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+
+# One index entry per slot: segment, offset of the record in the segment, record length, digest of the record's hash
+INDEX_ENTRY = struct.Struct('<IQI32s')
+RECORD_HEADER = struct.Struct('<I')
+
+NO_HASH = b'\x00' * 32
+
+# The index file grows by this many entries at a time
+INDEX_GROWTH = 4096
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def hash_digest(h):
+    # Block hashes are stored as bytes or hex strings depending on where they came from. Fixed width keeps the index
+    # entries fixed width.
+    if isinstance(h, str):
+        h = h.encode()
+    return hashlib.sha3_256(h).digest()
+
+
+class SegmentedLog:
+    """
+    Append only log of records split over segment files of at most segment_size bytes, plus a memory mapped index file
+    that locates every record by slot (its block number, or its position in the log) and by hash.
+
+    Records are never rewritten. A record is written and flushed to its segment before the index entry pointing to it,
+    so a crash can leave unreferenced bytes at the end of a segment but never an entry pointing at a partial record.
+    Reads are memoryviews straight into the mapped segments. All access goes through one lock so the log can be used
+    from the storage thread pool.
+    """
+
+    def __init__(self, path, name, segment_size=SEGMENT_SIZE, sync=False):
+        self.path = path
+        self.name = name
+        self.segment_size = segment_size
+        self.fsync_writes = sync
+
+        self.lock = threading.RLock()
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self.index_path = os.path.join(self.path, '{}.idx'.format(self.name))
+        self.segment_pattern = re.compile(r'^{}-(\d+)\.log$'.format(re.escape(self.name)))
+
+        self.open()
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, '{}-{:06d}.log'.format(self.name, segment))
+
+    def open(self):
+        if not os.path.exists(self.index_path):
+            with open(self.index_path, 'wb') as f:
+                f.truncate(INDEX_ENTRY.size * INDEX_GROWTH)
+
+        self.index_file = open(self.index_path, 'r+b')
+        self.index = mmap.mmap(self.index_file.fileno(), 0)
+        self.capacity = len(self.index) // INDEX_ENTRY.size
+
+        # Read only maps of the segments, made on first read
+        self.maps = {}
+
+        # Rebuild the hash lookup and find the end of the log from the index
+        self.hashes = {}
+        self.top = -1
+        for slot in range(self.capacity):
+            _, _, length, digest = INDEX_ENTRY.unpack_from(self.index, slot * INDEX_ENTRY.size)
+            if length > 0:
+                if digest != NO_HASH:
+                    self.hashes[digest] = slot
+                self.top = slot
+
+        segments = [int(m.group(1)) for m in map(self.segment_pattern.match, os.listdir(self.path)) if m]
+        self.segment = max(segments) if len(segments) > 0 else 0
+
+        self.writer = open(self.segment_path(self.segment), 'ab')
+
+    def close(self):
+        self.writer.close()
+
+        # Maps that still have views handed out close themselves once the views are gone
+        for m in self.maps.values():
+            try:
+                m.close()
+            except BufferError:
+                pass
+        self.maps.clear()
+
+        self.index.close()
+        self.index_file.close()
+
+    def drop(self):
+        with self.lock:
+            self.close()
+
+            for f in os.listdir(self.path):
+                if f == os.path.basename(self.index_path) or self.segment_pattern.match(f):
+                    os.remove(os.path.join(self.path, f))
+
+            self.open()
+
+    def next_slot(self):
+        return self.top + 1
+
+    def _grow_index(self, slot):
+        capacity = self.capacity
+        while capacity <= slot:
+            capacity += INDEX_GROWTH
+
+        self.index.flush()
+        self.index.close()
+
+        self.index_file.truncate(capacity * INDEX_ENTRY.size)
+        self.index = mmap.mmap(self.index_file.fileno(), 0)
+        self.capacity = capacity
+
+    def append(self, record: bytes, slot=None, h=None):
+        with self.lock:
+            if slot is None:
+                slot = self.next_slot()
+
+            if self.writer.tell() > 0 and self.writer.tell() + RECORD_HEADER.size + len(record) > self.segment_size:
+                self.writer.close()
+                self.segment += 1
+                self.writer = open(self.segment_path(self.segment), 'ab')
+
+            offset = self.writer.tell() + RECORD_HEADER.size
+            self.writer.write(RECORD_HEADER.pack(len(record)))
+            self.writer.write(record)
+            self.writer.flush()
+
+            if self.fsync_writes:
+                os.fsync(self.writer.fileno())
+
+            if slot >= self.capacity:
+                self._grow_index(slot)
+
+            digest = hash_digest(h) if h is not None else NO_HASH
+
+            # A record stored again under the same slot replaces the old one
+            _, _, old_length, old_digest = INDEX_ENTRY.unpack_from(self.index, slot * INDEX_ENTRY.size)
+            if old_length > 0 and self.hashes.get(old_digest) == slot:
+                del self.hashes[old_digest]
+
+            INDEX_ENTRY.pack_into(self.index, slot * INDEX_ENTRY.size, self.segment, offset, len(record), digest)
+
+            if h is not None:
+                self.hashes[digest] = slot
+
+            self.top = max(self.top, slot)
+
+            return slot
+
+    def sync(self):
+        # Forces everything appended so far onto disk, records before index entries
+        with self.lock:
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+
+            self.index.flush()
+
+    def slot_for_hash(self, h):
+        with self.lock:
+            return self.hashes.get(hash_digest(h))
+
+    def _map(self, segment, end):
+        m = self.maps.get(segment)
+
+        # The segment being written keeps growing, so its map is remade once a read goes past the end of it. The old map
+        # is left to close itself, since views into it may still be held
+        if m is None or len(m) < end:
+            with open(self.segment_path(segment), 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = m
+
+        return m
+
+    def read(self, slot):
+        with self.lock:
+            if slot is None or slot < 0 or slot > self.top:
+                return None
+
+            segment, offset, length, _ = INDEX_ENTRY.unpack_from(self.index, slot * INDEX_ENTRY.size)
+            if length == 0:
+                return None
+
+            m = self._map(segment, offset + length)
+            return memoryview(m)[offset:offset + length]
+
+    def slots(self, descending=False):
+        # The index is remapped when it grows, so each entry is read under the lock rather than the whole walk
+        r = range(self.top, -1, -1) if descending else range(self.top + 1)
+        for slot in r:
+            with self.lock:
+                if slot >= self.capacity:
+                    continue
+                _, _, length, _ = INDEX_ENTRY.unpack_from(self.index, slot * INDEX_ENTRY.size)
+            if length > 0:
+                yield slot
+
+
+class LogStorageSet:
+    """
+    Drop in for StorageSet that keeps one collection in a SegmentedLog instead of MongoDB. Documents are stored as BSON.
+    Documents with a number_key are stored in the slot of that number, others one after the other, and documents
+    can be looked up by number and by hash_key.
+    """
+
+    def __init__(self, path, collection_name, number_key='blockNum', hash_key='blockHash',
+                 segment_size=SEGMENT_SIZE, sync=False):
+        self.number_key = number_key
+        self.hash_key = hash_key
+
+        self.log = SegmentedLog(path, collection_name, segment_size=segment_size, sync=sync)
+
+        self.latency = QueryStats(collection_name)
+
+    def _slot(self, q):
+        if self.number_key is not None and self.number_key in q:
+            return q[self.number_key]
+
+        if self.hash_key in q:
+            return self.log.slot_for_hash(q[self.hash_key])
+
+        return None
+
+    def find_raw(self, q):
+        # BSON of the document as a view into the log. Valid until the set is flushed
+        return self.log.read(self._slot(q))
+
+    def find_one(self, q):
+        with self.latency.timed('find_one'):
+            raw = self.find_raw(q)
+
+            if raw is None:
+                return None
+
+            return bson.BSON(raw).decode()
+
+    def insert(self, data):
+        # Like insert_one, the document is given an _id
+        if '_id' not in data:
+            data['_id'] = ObjectId()
+
+        slot = data.get(self.number_key) if self.number_key is not None else None
+
+        with self.latency.timed('insert'):
+            self.log.append(bson.BSON.encode(data), slot=slot, h=data.get(self.hash_key))
+
+        return data['_id']
+
+    def insert_many(self, docs, durable=False):
+        for doc in docs:
+            self.insert(doc)
+
+        if durable:
+            self.log.sync()
+
+        return True
+
+    def last_n(self, n):
+        docs = []
+
+        with self.latency.timed('last_n'):
+            for slot in self.log.slots(descending=True):
+                if len(docs) >= n:
+                    break
+
+                doc = bson.BSON(self.log.read(slot)).decode()
+                doc.pop('_id', None)
+                docs.append(doc)
+
+        return docs
+
+    def find_range(self, start, end):
+        docs = []
+
+        with self.latency.timed('find_range'):
+            for slot in range(start, end):
+                raw = self.log.read(slot)
+                if raw is None:
+                    continue
+
+                doc = bson.BSON(raw).decode()
+                doc.pop('_id', None)
+                docs.append(doc)
+
+        return docs
+
+    def flush(self):
+        self.log.drop()
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import struct
+
+# Root of the state commitment. Buckets are stored under this prefix, one key each
+STATE_ROOT_KEY = '__sr'
+
+# Number of buckets keys are spread over. A power of two so the tree over them is complete
+STATE_BUCKETS = 4096
+
+# Buckets are LtHash16 multiset hashes: 1024 lanes of 16 bits, added and subtracted lane by lane. Unlike a sum of hashes
+# modulo a power of two, finding a set of keys and values that adds up to a given bucket is a lattice problem, not a
+# k-sum one. Buckets are stored as LANES little endian 16 bit values
+LANES = 1024
+BUCKET_BYTES = LANES * 2
+
+# In memory each lane sits in 32 bits of one integer, so a whole bucket is added in one go and a lane never carries into
+# the next one before it is masked back to 16 bits
+_LANE_MASK = int.from_bytes(b'\xff\xff\x00\x00' * LANES, 'little')
+_LANE_ONES = int.from_bytes(b'\x01\x00\x00\x00' * LANES, 'little')
+
+_NARROW = struct.Struct('<{}H'.format(LANES))
+_WIDE = struct.Struct('<{}I'.format(LANES))
+
+
+def bucket_key(i):
+    return '{}:{}'.format(STATE_ROOT_KEY, i)
+
+
+def committed_key(key: str):
+    # Contract state. Keys the node keeps for itself, like nonces, block numbers and the commitment, start with an
+    # underscore
+    return not key.startswith('_')
+
+
+def value_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    return json.dumps(value, sort_keys=True, default=str).encode()
+
+
+def unpack_bucket(b: bytes) -> int:
+    return int.from_bytes(_WIDE.pack(*_NARROW.unpack(b)), 'little')
+
+
+def pack_bucket(acc: int) -> bytes:
+    return _NARROW.pack(*_WIDE.unpack(acc.to_bytes(LANES * 4, 'little')))
+
+
+def add(a: int, b: int) -> int:
+    return (a + b) & _LANE_MASK
+
+
+def subtract(a: int, b: int) -> int:
+    # Adds the two's complement of each lane of b
+    return (a + (b ^ _LANE_MASK) + _LANE_ONES) & _LANE_MASK
+
+
+def leaf(key: str, value) -> int:
+    h = hashlib.shake_256()
+    key = key.encode()
+    h.update(struct.pack('<I', len(key)))
+    h.update(key)
+    h.update(value_bytes(value))
+    return unpack_bucket(h.digest(BUCKET_BYTES))
+
+
+def node_hash(left: bytes, right: bytes):
+    return hashlib.sha3_256(left + right).digest()
+
+
+def bucket_hash(acc: int):
+    return hashlib.sha3_256(pack_bucket(acc)).digest()
+
+
+def build_tree(buckets):
+    level = [bucket_hash(b) for b in buckets]
+    levels = [level]
+    while len(level) > 1:
+        level = [node_hash(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+        levels.append(level)
+    return levels
+
+
+def key_name(key):
+    return key.decode() if isinstance(key, bytes) else key
+
+
+def bucket_of(name: str, size):
+    return int.from_bytes(hashlib.sha3_256(name.encode()).digest()[:4], 'big') & (size - 1)
+
+
+def fill_buckets(items, size):
+    # Buckets of a whole state, from its (key, value) pairs in any order
+    buckets = [0] * size
+
+    for key, value in items:
+        name = key_name(key)
+        if committed_key(name) and value is not None:
+            i = bucket_of(name, size)
+            buckets[i] = add(buckets[i], leaf(name, value))
+
+    return buckets
+
+
+def state_root(items, buckets=STATE_BUCKETS):
+    # Root of the state made of the (key, value) pairs, without reading or writing anything
+    return build_tree(fill_buckets(items, buckets))[-1][0]
+
+
+class StateCommitment:
+    """
+    Commitment to contract state, kept current from the deltas of each block in time proportional to the keys the
+    block changes. Keys are spread over a fixed number of buckets. A bucket holds the multiset hash of its keys and
+    values, so a changed key is taken out with its old value and added back with its new one. The root is the merkle
+    root over the hashes of the buckets, so comparing buckets narrows down where two states differ.
+
+    Buckets and root are written through the driver and so are committed together with the block that changed them.
+    State that has no root yet isn't tracked until rebuild is called.
+    """
+
+    def __init__(self, driver, buckets=STATE_BUCKETS):
+        assert buckets > 0 and buckets & (buckets - 1) == 0, 'Number of buckets must be a power of two.'
+
+        self.driver = driver
+        self.size = buckets
+
+        self.reset()
+
+    def reset(self):
+        # Dropped when state changes without the deltas going through here. Loaded again when next needed
+        self.loaded = False
+        self.buckets = None
+        self.levels = None
+        self.dirty = set()
+
+    def load(self):
+        # Returns whether state is tracked
+        if not self.loaded:
+            self.loaded = True
+
+            if self.driver.get(STATE_ROOT_KEY) is not None:
+                values = self.driver.get_many([bucket_key(i) for i in range(self.size)])
+                self.buckets = [unpack_bucket(v) if v is not None else 0 for v in values]
+                self.levels = build_tree(self.buckets)
+
+        return self.levels is not None
+
+    def bucket(self, name: str):
+        return bucket_of(name, self.size)
+
+    @staticmethod
+    def adjust(acc, name, old, new):
+        if old is not None:
+            acc = subtract(acc, leaf(name, old))
+        if new is not None:
+            acc = add(acc, leaf(name, new))
+        return acc
+
+    def update(self, key, value):
+        # Called before the key is set, so the value it replaces can still be read
+        name = key_name(key)
+        if not committed_key(name) or not self.load():
+            return
+
+        i = self.bucket(name)
+        self.buckets[i] = self.adjust(self.buckets[i], name, self.driver.get(key), value)
+        self.dirty.add(i)
+
+    def _root(self, changes: dict, write=False):
+        # Rehashes only the paths from the changed buckets up to the root
+        nodes = {i: bucket_hash(acc) for i, acc in changes.items()}
+
+        for depth, level in enumerate(self.levels):
+            if write:
+                for i, node in nodes.items():
+                    level[i] = node
+
+            if depth == len(self.levels) - 1:
+                break
+
+            nodes = {i: node_hash(nodes.get(2 * i, level[2 * i]), nodes.get(2 * i + 1, level[2 * i + 1]))
+                     for i in {i >> 1 for i in nodes}}
+
+        return nodes.get(0, self.levels[-1][0])
+
+    def root(self):
+        if not self.load():
+            return None
+        return self._root({i: self.buckets[i] for i in self.dirty})
+
+    def _adjusted(self, deltas):
+        # Buckets as they are after the (key, value) deltas are applied in order. The values the deltas replace are read
+        # in one batch
+        deltas = [(key_name(key), key, value) for key, value in deltas]
+        deltas = [delta for delta in deltas if committed_key(delta[0])]
+
+        keys = {}
+        for name, key, _ in deltas:
+            keys.setdefault(name, key)
+
+        values = dict(zip(keys, self.driver.get_many(list(keys.values()))))
+        changes = {i: self.buckets[i] for i in self.dirty}
+
+        for name, _, value in deltas:
+            i = self.bucket(name)
+            changes[i] = self.adjust(changes.get(i, self.buckets[i]), name, values[name], value)
+            values[name] = value
+
+        return changes
+
+    def root_after(self, deltas):
+        """
+        Root state would have after the (key, value) deltas are applied in order, without changing anything. None if
+        state isn't tracked.
+        """
+        if not self.load():
+            return None
+
+        return self._root(self._adjusted(deltas))
+
+    def apply(self, deltas):
+        # Takes in the deltas of a block before they are written, so the values they replace can still be read
+        if not self.load():
+            return
+
+        for i, acc in self._adjusted(deltas).items():
+            self.buckets[i] = acc
+            self.dirty.add(i)
+
+    def save(self, writes=None):
+        """
+        Writes the changed buckets and the root through the driver, or into the writes dict if given so they go out
+        with the rest of the block. Returns the root, or None if state isn't tracked.
+        """
+        if not self.load():
+            return None
+
+        root = self._root({i: self.buckets[i] for i in self.dirty}, write=True)
+
+        changes = {bucket_key(i): pack_bucket(self.buckets[i]) for i in self.dirty}
+        changes[STATE_ROOT_KEY] = root
+
+        if writes is None:
+            for key, value in changes.items():
+                self.driver.set(key, value)
+        else:
+            writes.update(changes)
+
+        self.dirty.clear()
+
+        return root
+
+    def invalidate(self):
+        # State changed without its deltas going through here. Nothing is tracked until the next rebuild
+        self.driver.delete(STATE_ROOT_KEY)
+        self.reset()
+
+    def rebuild(self):
+        """
+        Computes the commitment from every key in state and commits it along with anything else the driver has
+        pending. Needed for state written outside of blocks, like genesis or a restored snapshot. Returns the root.
+        """
+        buckets = fill_buckets(((key, self.driver.get(key)) for key in self.driver.iter('')), self.size)
+
+        root = build_tree(buckets)[-1][0]
+
+        for i, acc in enumerate(buckets):
+            self.driver.set(bucket_key(i), pack_bucket(acc))
+        self.driver.set(STATE_ROOT_KEY, root)
+
+        self.driver.commit()
+        self.reset()
+
+        return root
@@ -1,4 +1,9 @@
 from contracting.db.driver import ContractDriver
+from contracting.db.encoder import encode, decode
+from cilantro_ee.containers.lru import LRUCache
+from cilantro_ee.storage.commitment import StateCommitment, STATE_ROOT_KEY, key_name
+from decimal import Decimal
+import copy
 
 BLOCK_HASH_KEY = '_current_block_hash'
 BLOCK_NUM_KEY = '_current_block_num'
@@ -9,19 +14,134 @@ from cilantro_ee.logger.base import get_logger
 
 log = get_logger('STATE')
 
+READ_CACHE_SIZE = 100_000
+
+# Values of these types can be handed out of the read cache as they are. Anything else is copied so that a caller
+# mutating what it read can't change what the next reader sees.
+_IMMUTABLE_TYPES = (type(None), bool, int, float, str, bytes, Decimal)
+
+_MISSING = object()
+
 
 class BlockchainDriver(ContractDriver):
+    def __init__(self, *args, cache_size=0, **kwargs):
+        # Read through cache of committed state. Off unless this driver is the only one writing to the state, because
+        # writes made through other drivers or processes can't invalidate it.
+        self.read_cache = None
+
+        # Keys set or deleted since the last commit or revert. Reads of these go to the driver so that uncommitted
+        # writes are seen, and they are invalidated in the cache once committed.
+        self.staged = set()
+
+        # Root over contract state, updated from the deltas of the blocks applied through this driver
+        self.commitment = StateCommitment(self)
+
+        super().__init__(*args, **kwargs)
+
+        if cache_size > 0:
+            self.enable_read_cache(cache_size)
+
+    def enable_read_cache(self, maxsize=READ_CACHE_SIZE):
+        self.read_cache = LRUCache(maxsize=maxsize)
+
+    def disable_read_cache(self):
+        self.read_cache = None
+
+    def read_cache_stats(self):
+        if self.read_cache is None:
+            return None
+
+        stats = self.read_cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups > 0 else 0.0
+
+        return stats
+
+    def _cached(self, key, read):
+        value = self.read_cache.get(key, _MISSING)
+
+        if value is _MISSING:
+            value = read()
+            self.read_cache.set(key, value)
+
+        if isinstance(value, _IMMUTABLE_TYPES):
+            return value
+
+        return copy.deepcopy(value)
+
+    def get(self, key, *args, **kwargs):
+        if self.read_cache is None or key in self.staged:
+            return super().get(key, *args, **kwargs)
+
+        return self._cached(key, lambda: super(BlockchainDriver, self).get(key, *args, **kwargs))
+
+    def set(self, key, *args, **kwargs):
+        self.staged.add(key)
+        super().set(key, *args, **kwargs)
+
+    def delete(self, key, *args, **kwargs):
+        self.staged.add(key)
+        super().delete(key, *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        super().commit(*args, **kwargs)
+
+        if self.read_cache is not None:
+            for key in self.staged:
+                self.read_cache.pop(key)
+                self.read_cache.pop(('direct', key))
+
+        self.staged.clear()
+
+    def revert(self, *args, **kwargs):
+        super().revert(*args, **kwargs)
+
+        # The commitment is only loaded again if it took in changes that are now dropped, since loading it reads every
+        # bucket
+        if len(self.commitment.dirty) > 0 or any(key_name(key).startswith(STATE_ROOT_KEY) for key in self.staged):
+            self.commitment.reset()
+
+        # Nothing staged reached the state, so whatever is cached for those keys is still current
+        self.staged.clear()
+
+    # Direct reads and writes skip the driver's write buffer, so they are cached under their own keys
+    def get_direct(self, key, *args, **kwargs):
+        if self.read_cache is None:
+            return super().get_direct(key, *args, **kwargs)
+
+        return self._cached(('direct', key), lambda: super(BlockchainDriver, self).get_direct(key, *args, **kwargs))
+
+    def set_direct(self, key, *args, **kwargs):
+        super().set_direct(key, *args, **kwargs)
+
+        if self.read_cache is not None:
+            self.read_cache.pop(key)
+            self.read_cache.pop(('direct', key))
+
+    def flush(self, *args, **kwargs):
+        super().flush(*args, **kwargs)
+
+        self.staged.clear()
+        self.commitment.reset()
+
+        if self.read_cache is not None:
+            self.read_cache.clear()
+
     def get_latest_block_hash(self):
-        block_hash = super().get_direct(BLOCK_HASH_KEY)
+        block_hash = self.get_direct(BLOCK_HASH_KEY)
         if block_hash is None:
             return b'\x00' * 32
         return block_hash
 
-    def set_latest_block_hash(self, v: bytes):
+    @staticmethod
+    def block_hash_bytes(v):
         if type(v) == str:
             v = bytes.fromhex(v)
         assert len(v) == 32, 'Hash provided is not 32 bytes.'
-        super().set_direct(BLOCK_HASH_KEY, v)
+        return v
+
+    def set_latest_block_hash(self, v: bytes):
+        self.set_direct(BLOCK_HASH_KEY, self.block_hash_bytes(v))
 
     latest_block_hash = property(get_latest_block_hash, set_latest_block_hash)
 
@@ -48,38 +168,66 @@ class BlockchainDriver(ContractDriver):
     def set_transaction_data(self, tx):
         if tx['state'] is not None and len(tx['state']) > 0:
             for delta in tx['state']:
+                self.commitment.update(delta['key'], delta['value'])
                 self.set(delta['key'], delta['value'])
-                log.info(f"{delta['key']} -> {delta['value']}")
 
-    def update_with_block(self, block, commit_tx=True):
+    def update_with_block(self, block):
         # Capnp proto shim until we remove it completely from storage
         if type(block) != dict:
             block = block.to_dict()
 
-        self.set_latest_block_num(block['blockNum'])
-
-        # self.log.info("block {}".format(block))
-
         if self.latest_block_hash != block['prevBlockHash']:
             return
 
         # Map of tuple to nonce such that (processor, sender) => nonce
         nonces = {}
+        deltas = []
 
         for sb in block['subBlocks']:
             if type(sb) != dict:
                 sb = sb.to_dict()
             for tx in sb['transactions']:
                 self.update_nonce_hash(nonce_hash=nonces, tx_payload=tx['transaction']['payload'])
-                if commit_tx:
-                    self.set_transaction_data(tx=tx)
+                if tx['state'] is not None:
+                    deltas.extend((delta['key'], delta['value']) for delta in tx['state'])
 
-        # Commit new nonces
-        self.commit_nonces(nonce_hash=nonces)
-        self.delete_pending_nonces()
+        # Anything still buffered goes out first, so pending nonces in it are found below and it can't shadow the block
+        if len(self.staged) > 0:
+            self.commit()
 
-        # Update our block hash and block num
-        self.set_latest_block_hash(block['blockHash'])
+        # Everything the block changes is collected here and written to the database in one pipelined write, so state
+        # never holds half of a block
+        writes = dict(deltas)
+
+        self.commitment.apply(deltas)
+        self.check_state_root(block, writes=writes)
+
+        for (processor, sender), nonce in nonces.items():
+            writes[self.n_key(NONCE_KEY, processor, sender)] = nonce
+
+        # Pending nonces of every sender are dropped, not only of the ones in this block
+        for key in self.iter(PENDING_NONCE_KEY):
+            writes[key] = None
+
+        writes[BLOCK_NUM_KEY] = str(int(block['blockNum'])).encode()
+        writes[BLOCK_HASH_KEY] = self.block_hash_bytes(block['blockHash'])
+
+        self.set_many(writes)
+
+        log.debug('Applied block {} with {} deltas from {} senders'.format(block['blockNum'], len(deltas), len(nonces)))
+
+    def check_state_root(self, block, writes=None):
+        # Saves the commitment so it is written with the block. Returns False if the block commits to a different
+        # state than this node ended up with
+        state_root = self.commitment.save(writes=writes)
+
+        if state_root is None or not block.get('stateRoot') or state_root == block['stateRoot']:
+            return True
+
+        log.error('State diverged at block {}. Block has state root {}, this node has {}.'.format(
+            block['blockNum'], block['stateRoot'].hex(), state_root.hex()))
+
+        return False
 
     @staticmethod
     def update_nonce_hash(nonce_hash: dict, tx_payload):
@@ -92,6 +240,60 @@ class BlockchainDriver(ContractDriver):
         if current_nonce is None or current_nonce == tx_payload['nonce']:
             nonce_hash[k] = tx_payload['nonce'] + 1
 
+    # Batched reads and writes. Code that needs many keys at once goes through these, so they are the one place where
+    # the round trips for a batch are collapsed
+    def get_many(self, keys: list):
+        """
+        Reads keys in order with a single MGET. Keys with uncommitted writes are read through the driver so those
+        writes are seen, and keys in the read cache aren't read again.
+        """
+        values = [_MISSING] * len(keys)
+        missing = []
+
+        for i, key in enumerate(keys):
+            if key in self.staged:
+                values[i] = self.get(key)
+            elif self.read_cache is not None:
+                values[i] = self.read_cache.get(key, _MISSING)
+
+            if values[i] is _MISSING:
+                missing.append(i)
+
+        if len(missing) > 0:
+            read = self.conn.mget([keys[i] for i in missing])
+
+            for i, value in zip(missing, read):
+                value = decode(value) if value is not None else None
+                if self.read_cache is not None:
+                    self.read_cache.set(keys[i], value)
+                values[i] = value
+
+        return [v if isinstance(v, _IMMUTABLE_TYPES) else copy.deepcopy(v) for v in values]
+
+    def set_many(self, values: dict):
+        """
+        Writes straight to the database like set_direct, with one pipelined write that is applied all at once. A value
+        of None deletes the key.
+        """
+        # Uncommitted writes would shadow these, so they go out first
+        if len(self.staged) > 0:
+            self.commit()
+
+        pipe = self.conn.pipeline(transaction=True)
+
+        for key, value in values.items():
+            if value is None:
+                pipe.delete(key)
+            else:
+                pipe.set(key, encode(value))
+
+        pipe.execute()
+
+        if self.read_cache is not None:
+            for key in values:
+                self.read_cache.pop(key)
+                self.read_cache.pop(('direct', key))
+
     @staticmethod
     def n_key(key, processor, sender):
         return ':'.join([key, processor.hex(), sender.hex()])
@@ -136,11 +338,11 @@ class BlockchainDriver(ContractDriver):
         self.commit()
 
     def delete_pending_nonces(self):
-        for nonce in self.iter(PENDING_NONCE_KEY):
-            self.delete(nonce)
-
+        # Buffered pending nonces are committed first so they are found and deleted too
         self.commit()
 
+        self.set_many({key: None for key in self.iter(PENDING_NONCE_KEY)})
+
     def update_nonces_with_block(self, block):
         # Reinitialize the latest nonce. This should probably be abstracted into a seperate class at a later date
         nonces = {}
@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+from cilantro_ee.logger.base import get_logger
+import threading
+import time
+
+# Queries slower than this are logged
+SLOW_QUERY_MS = 100
+
+log = get_logger('STORAGE')
+
+
+class QueryStats:
+    """
+    Count, total and worst latency of every kind of query made against one collection, in milliseconds.
+    """
+
+    def __init__(self, name, slow_query_ms=SLOW_QUERY_MS):
+        self.name = name
+        self.slow_query_ms = slow_query_ms
+
+        self.queries = {}
+        self._lock = threading.Lock()
+
+    def record(self, op, elapsed):
+        with self._lock:
+            count, total, worst = self.queries.get(op, (0, 0.0, 0.0))
+            self.queries[op] = (count + 1, total + elapsed, max(worst, elapsed))
+
+        if elapsed > self.slow_query_ms:
+            log.warning('Slow {} on {}: {:.1f}ms'.format(op, self.name, elapsed))
+
+    @contextmanager
+    def timed(self, op):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(op, (time.perf_counter() - start) * 1000)
+
+    def stats(self):
+        with self._lock:
+            return {
+                op: {'count': count, 'mean_ms': total / count, 'max_ms': worst}
+                for op, (count, total, worst) in self.queries.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self.queries.clear()
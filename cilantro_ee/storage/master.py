@@ -1,60 +1,182 @@
 import cilantro_ee
 from cilantro_ee.crypto import wallet
-from pymongo import MongoClient, DESCENDING
+from pymongo import MongoClient, DESCENDING, ASCENDING
+from pymongo.errors import DuplicateKeyError, OperationFailure, BulkWriteError
+from pymongo.write_concern import WriteConcern
 from configparser import ConfigParser
 from cilantro_ee.logger.base import get_logger
 from bson.objectid import ObjectId
 from collections import defaultdict
 from typing import List
 from cilantro_ee.storage.vkbook import VKBook
-from cilantro_ee.core.canonical import block_from_subblocks
+from cilantro_ee.core.canonical import block_from_subblocks, block_tx_index
+from cilantro_ee.storage.block_log import LogStorageSet
+from cilantro_ee.storage.latency import QueryStats
+import threading
 import hashlib
+import os
 
 REPLICATION = 3             # TODO hard coded for now needs to change
 GENESIS_HASH = b'\x00' * 32
 OID = '5bef52cca4259d4ca5607661'
 
+POOL_SIZE = 10
+WRITE_BATCH_SIZE = 100
+DUPLICATE_KEY = 11000
+
+# Fields blocks, index entries and tx entries are looked up by, and whether they are unique. Block hashes aren't
+# enforced unique because failed blocks all share the same hash.
+BLOCK_INDEXES = (('blockNum', True), ('blockHash', False))
+TX_INDEXES = (('tx_hash', True),)
+
+log = get_logger('MasterStorage')
+
+
+class StorageIndexError(Exception):
+    pass
+
+
+# Connection pools, one per set of credentials, shared by every StorageSet in the process
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def shared_client(user, password, port, pool_size=POOL_SIZE):
+    key = (user, password, port, pool_size)
+
+    with _clients_lock:
+        client = _clients.get(key)
+
+        if client is None:
+            uri = 'mongodb://{}:{}@localhost:{}/?authSource=admin'.format(user, password, port)
+            client = MongoClient(uri, maxPoolSize=pool_size)
+            _clients[key] = client
+
+    return client
+
 
 class StorageSet:
-    def __init__(self, user, password, port, database, collection_name):
-        self.uri = 'mongodb://{}:{}@localhost:{}/{}?authSource=admin&maxPoolSize=1'.format(
-            user,
-            password,
-            port,
-            database
-        )
-
-        self.client = MongoClient(self.uri)
-        self.db = self.client.get_database()
+    def __init__(self, user, password, port, database, collection_name, indexes=(), pool_size=POOL_SIZE):
+        self.client = shared_client(user, password, port, pool_size=pool_size)
+        self.db = self.client[database]
         self.collection = self.db[collection_name]
 
+        # Fields every lookup on this collection goes through, as (field, unique)
+        self.indexes = indexes
+        self.ensure_indexes()
+
+        self.latency = QueryStats(collection_name)
+
+    def ensure_indexes(self):
+        # Creating an index that already exists is a no op, so this is safe on every start. Sparse so documents
+        # without the field don't collide on it.
+        for field, unique in self.indexes:
+            try:
+                self.collection.create_index([(field, ASCENDING)], unique=unique, sparse=True)
+            except OperationFailure as e:
+                raise StorageIndexError('Could not create index on {}.{}: {}'.format(
+                    self.collection.full_name, field, e))
+
+        self.verify_indexes()
+
+    def verify_indexes(self):
+        info = self.collection.index_information()
+
+        for field, unique in self.indexes:
+            if not any(index['key'] == [(field, ASCENDING)] and index.get('unique', False) == unique
+                       for index in info.values()):
+                raise StorageIndexError('Missing {}index on {}.{}'.format(
+                    'unique ' if unique else '', self.collection.full_name, field))
+
+    def find_one(self, q):
+        with self.latency.timed('find_one'):
+            return self.collection.find_one(q)
+
+    def insert(self, data):
+        with self.latency.timed('insert'):
+            try:
+                return self.collection.insert_one(data)
+            except DuplicateKeyError:
+                log.warning('{} already stored in {}'.format(
+                    {k: data.get(k) for k, _ in self.indexes}, self.collection.full_name))
+                return None
+
+    def insert_many(self, docs, durable=False):
+        # Unordered, so one document that is already stored doesn't stop the rest. Durable writes return once they
+        # are in the journal
+        collection = self.collection
+        if durable:
+            collection = collection.with_options(write_concern=WriteConcern(w=1, j=True))
+
+        with self.latency.timed('insert_many'):
+            try:
+                collection.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                duplicates = [err for err in e.details['writeErrors'] if err['code'] == DUPLICATE_KEY]
+                if len(duplicates) < len(e.details['writeErrors']):
+                    raise
+
+                log.warning('{} of {} documents already stored in {}'.format(
+                    len(duplicates), len(docs), self.collection.full_name))
+
+        return True
+
+    def last_n(self, n):
+        with self.latency.timed('last_n'):
+            return [doc for doc in self.collection.find({}, {'_id': False}).sort('blockNum', DESCENDING).limit(n)]
+
+    def find_range(self, start, end):
+        # Documents numbered start up to but not including end, in order
+        with self.latency.timed('find_range'):
+            return [doc for doc in self.collection.find({'blockNum': {'$gte': start, '$lt': end}},
+                                                        {'_id': False}).sort('blockNum', ASCENDING)]
+
     def flush(self):
         self.client.drop_database(self.db)
 
+        # Dropping the database drops its indexes with it
+        self.ensure_indexes()
+
 
 class MasterStorage:
     BLOCK = 0
     INDEX = 1
     TX = 2
 
-    def __init__(self, config_path=cilantro_ee.__path__[0]):
+    def __init__(self, config_path=cilantro_ee.__path__[0], backend=None, log_directory=None):
         # Setup configuration file to read constants
         self.config_path = config_path
 
         self.config = ConfigParser()
         self.config.read(self.config_path + '/config/mn_db_conf.ini')
 
-        user = self.config.get('MN_DB', 'username')
-        password = self.config.get('MN_DB', 'password')
-        port = self.config.get('MN_DB', 'port')
+        # 'mongo' keeps blocks in MongoDB, 'log' keeps them in append only files on disk and needs no database
+        self.backend = backend or self.config.get('MN_DB', 'backend', fallback='mongo')
+
+        if self.backend == 'log':
+            path = log_directory or self.config.get('MN_DB', 'log_directory', fallback='~/.cilantro_ee/blocks')
+            path = os.path.expanduser(path)
+
+            self.blocks = LogStorageSet(path, 'blocks')
+            self.indexes = LogStorageSet(path, 'index')
+            self.txs = LogStorageSet(path, 'tx', number_key=None, hash_key='tx_hash')
+        else:
+            user = self.config.get('MN_DB', 'username')
+            password = self.config.get('MN_DB', 'password')
+            port = self.config.get('MN_DB', 'port')
+
+            pool_size = self.config.getint('MN_DB', 'pool_size', fallback=POOL_SIZE)
 
-        block_database = self.config.get('MN_DB', 'mn_blk_database')
-        index_database = self.config.get('MN_DB', 'mn_index_database')
-        tx_database = self.config.get('MN_DB', 'mn_tx_database')
+            block_database = self.config.get('MN_DB', 'mn_blk_database')
+            index_database = self.config.get('MN_DB', 'mn_index_database')
+            tx_database = self.config.get('MN_DB', 'mn_tx_database')
 
-        self.blocks = StorageSet(user, password, port, block_database, 'blocks')
-        self.indexes = StorageSet(user, password, port, index_database, 'index')
-        self.txs = StorageSet(user, password, port, tx_database, 'tx')
+            self.blocks = StorageSet(user, password, port, block_database, 'blocks',
+                                     indexes=BLOCK_INDEXES, pool_size=pool_size)
+            self.indexes = StorageSet(user, password, port, index_database, 'index',
+                                      indexes=BLOCK_INDEXES, pool_size=pool_size)
+            self.txs = StorageSet(user, password, port, tx_database, 'tx',
+                                  indexes=TX_INDEXES, pool_size=pool_size)
 
         if self.get_block(0) is None:
             self.put({
@@ -69,6 +191,13 @@ class MasterStorage:
                 'blockOwners': [b'\x00' * 64]
             }, MasterStorage.INDEX)
 
+    def query_stats(self):
+        return {
+            'blocks': self.blocks.latency.stats(),
+            'index': self.indexes.latency.stats(),
+            'tx': self.txs.latency.stats()
+        }
+
     def q(self, v):
         if isinstance(v, int):
             return {'blockNum': v}
@@ -79,20 +208,28 @@ class MasterStorage:
             return None
 
         q = self.q(v)
-        block = self.blocks.collection.find_one(q)
+        block = self.blocks.find_one(q)
 
         if block is not None:
             block.pop('_id')
 
         return block
 
+    def get_blocks(self, start, count):
+        # Stored blocks numbered start to start + count - 1, in order. Blocks that aren't stored are left out
+        return self.blocks.find_range(start, start + count)
+
     def put(self, data, collection=BLOCK):
         if collection == MasterStorage.BLOCK:
-            _id = self.blocks.collection.insert_one(data)
+            _id = self.blocks.insert(data)
+
+            # Transactions are only looked up on the nodes that store their block
+            if _id is not None and data.get('subBlocks'):
+                self.put_tx_map(data)
         elif collection == MasterStorage.INDEX:
-            _id = self.indexes.collection.insert_one(data)
+            _id = self.indexes.insert(data)
         elif collection == MasterStorage.TX:
-            _id = self.txs.collection.insert_one(data)
+            _id = self.txs.insert(data)
         else:
             return False
 
@@ -106,11 +243,7 @@ class MasterStorage:
         else:
             return None
 
-        block_query = c.collection.find({}, {'_id': False}).sort(
-            'blockNum', DESCENDING
-        ).limit(n)
-
-        blocks = [block for block in block_query]
+        blocks = c.last_n(n)
 
         if len(blocks) > 1:
             first_block_num = blocks[0].get('blockNum')
@@ -122,7 +255,7 @@ class MasterStorage:
 
     def get_owners(self, v):
         q = self.q(v)
-        index = self.indexes.collection.find_one(q)
+        index = self.indexes.find_one(q)
 
         if index is None:
             return index
@@ -133,7 +266,7 @@ class MasterStorage:
 
     def get_index(self, v):
         q = self.q(v)
-        block = self.indexes.collection.find_one(q)
+        block = self.indexes.find_one(q)
 
         if block is not None:
             block.pop('_id')
@@ -141,24 +274,94 @@ class MasterStorage:
         return block
 
     def get_tx(self, h):
-        tx = self.txs.collection.find_one({'tx_hash': h})
+        tx = self.txs.find_one({'tx_hash': h})
 
         if tx is not None:
             tx.pop('_id')
 
         return tx
 
-#    def put_tx_map(self, block: BlockData):
-#        m = block.get_tx_hash_to_merkle_leaf()
-#        blk_id = block.block_num
-#
-#        for entry in m:
-#            entry['block'] = blk_id
-#            self.txs.collection.insert_one(entry)
+    def put_blocks(self, blocks):
+        # Stores the blocks with their tx and index entries, one bulk insert for each. Durable before it returns.
+        # Index entries go last so a block is never indexed as stored before it is.
+        indexes = [{'blockNum': b['blockNum'], 'blockHash': b['blockHash'], 'blockOwners': b['blockOwners']}
+                   for b in blocks if b.get('blockOwners')]
+
+        txs = []
+        for b in blocks:
+            txs.extend(block_tx_index(b))
+
+        self.blocks.insert_many(blocks, durable=True)
+
+        if len(txs) > 0:
+            self.txs.insert_many(txs, durable=True)
+
+        if len(indexes) > 0:
+            self.indexes.insert_many(indexes, durable=True)
+
+        return True
+
+    def put_tx_map(self, block):
+        # One bulk insert for all of the block's transactions
+        entries = block_tx_index(block)
+
+        if len(entries) == 0:
+            return True
+
+        return self.txs.insert_many(entries)
+
+    def get_receipt(self, tx_hash):
+        entry = self.get_tx(tx_hash)
+
+        if entry is None:
+            return None
+
+        block = self.get_block(entry['block'])
+
+        if block is None:
+            return None
+
+        return {
+            'hash': tx_hash,
+            'blockNum': block['blockNum'],
+            'blockHash': block['blockHash'],
+            'subBlockNum': block['subBlocks'][entry['sub_block']].get('subBlockNum'),
+            'transaction': block['subBlocks'][entry['sub_block']]['transactions'][entry['tx_index']]
+        }
 
     def drop_collections(self):
         self.blocks.flush()
         self.indexes.flush()
+        self.txs.flush()
+
+
+class BatchWriter:
+    """
+    Buffers blocks and stores them batch_size at a time with MasterStorage.put_blocks, instead of a round trip per
+    document. Used for catchup, where blocks come in far faster than one at a time writes can keep up with.
+    """
+
+    def __init__(self, storage, batch_size=WRITE_BATCH_SIZE):
+        self.storage = storage
+        self.batch_size = batch_size
+
+        self.blocks = []
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def put(self, block):
+        self.blocks.append(block)
+
+        if len(self.blocks) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.blocks) == 0:
+            return
+
+        self.storage.put_blocks(self.blocks)
+        self.blocks = []
 
 
 class DistributedMasterStorage(MasterStorage):
@@ -330,27 +533,9 @@ class CilantroStorageDriver(DistributedMasterStorage):
         return block_dict
 
     def get_transactions(self, tx_hash):
-        txs = self.get_tx(tx_hash)
+        receipt = self.get_receipt(tx_hash)
 
-        if txs is None:
+        if receipt is None:
             return None
 
-        block_num = txs.get('block')
-        leaf = txs.get('tx_leaf')
-
-        block = self.get_block(block_num)
-        sub_blocks = block.get('subBlocks')
-
-        for sb in sub_blocks:
-            leaves = sb.get('merkleLeaves')
-
-            try:
-                tx_idx = leaves.index(leaf)
-            except ValueError:
-                tx_idx = -1
-
-            if tx_idx >= 0:
-                tx_dump = sb.get('transactions')
-                return tx_dump[tx_idx]
-
-        return None
\ No newline at end of file
+        return receipt['transaction']
@@ -1,16 +1,45 @@
 from contracting.client import ContractingClient
+from cilantro_ee.core import canonical
 import math
 
+# Contracts whose state decides who the nodes are. A block that writes to any of them makes the snapshot stale.
+WATCHED_CONTRACTS = {'vkbook', 'election_house'}
+
 
 class VKBook:
+    """
+    Snapshot of the vkbook contract. Node lists, membership sets and quorums are read from state once and kept in
+    memory, and only read again when a block changes the vkbook or election_house state (see update_with_block).
+    """
+
     def __init__(self, client=ContractingClient()):
+        self.client = client
         self.reload(client)
 
-    def reload(self, client=ContractingClient()):
-        self.contract = client.get_contract('vkbook')
+    def reload(self, client=None):
+        if client is not None:
+            self.client = client
+
+        self.contract = self.client.get_contract('vkbook')
 
         assert self.contract is not None, 'VKBook not in state.'
 
+        self.stamps_enabled = self.contract.quick_read('stamps_enabled')
+        self.nonces_enabled = self.contract.quick_read('nonces_enabled')
+
+        self.masternodes = self.contract.quick_read('masternode_list')
+        self.delegates = self.contract.quick_read('delegate_list')
+        self.witnesses = self.contract.quick_read('witness_list')
+        self.notifiers = self.contract.quick_read('notifier_list')
+        self.schedulers = self.contract.quick_read('scheduler_list')
+
+        self.core_nodes = self.masternodes + self.delegates
+
+        # For O(1) membership checks
+        self.masternode_set = frozenset(self.masternodes)
+        self.delegate_set = frozenset(self.delegates)
+        self.core_node_set = frozenset(self.core_nodes)
+
         self.masternode_quorum_max = math.ceil(len(self.masternodes) * 2 / 3)
         self.delegate_quorum_max = math.ceil(len(self.delegates) * 2 / 3)
         self.witness_quorum_max = math.ceil(len(self.witnesses) * 2 / 3)
@@ -28,35 +57,19 @@ class VKBook:
         self.scheduler_quorum_min = min(self.scheduler_quorum_max,
                                       self.contract.get_scheduler_quorum_min())
 
+    def update_with_block(self, block):
+        # Call after the block has been applied to state. Returns True if the snapshot had to be reloaded
+        if len(canonical.block_contracts(block) & WATCHED_CONTRACTS) == 0:
+            return False
 
-    @property
-    def stamps_enabled(self):
-        return self.contract.quick_read('stamps_enabled')
-
-    @property
-    def nonces_enabled(self):
-        return self.contract.quick_read('nonces_enabled')
-
-    @property
-    def masternodes(self):
-        return self.contract.quick_read('masternode_list')
-
-    @property
-    def delegates(self):
-        return self.contract.quick_read('delegate_list')
-
-    @property
-    def witnesses(self):
-        return self.contract.quick_read('witness_list')
+        self.reload()
+        return True
 
-    @property
-    def notifiers(self):
-        return self.contract.quick_read('notifier_list')
+    def is_masternode(self, vk):
+        return vk in self.masternode_set
 
-    @property
-    def schedulers(self):
-        return self.contract.quick_read('scheduler_list')
+    def is_delegate(self, vk):
+        return vk in self.delegate_set
 
-    @property
-    def core_nodes(self):
-        return self.masternodes + self.delegates
\ No newline at end of file
+    def is_core_node(self, vk):
+        return vk in self.core_node_set
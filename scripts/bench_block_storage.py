@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compares the MongoDB and the append only log block storage backends of MasterStorage.
+
+Stores synthetic blocks with their index entries, then reads every block back by number, by hash, and the last n
+index entries, and reports operations per second for each backend.
+
+Usage: python3 scripts/bench_block_storage.py [--blocks N] [--txs N] [--backends mongo,log] [--path DIR]
+"""
+
+import argparse
+import secrets
+import shutil
+import tempfile
+import time
+
+from cilantro_ee.storage.master import MasterStorage
+
+
+def make_block(block_num, txs):
+    return {
+        'blockNum': block_num,
+        'blockHash': secrets.token_bytes(32),
+        'prevBlockHash': secrets.token_bytes(32),
+        'blockOwners': [secrets.token_hex(32)],
+        'subBlocks': [{
+            'merkleLeaves': [secrets.token_bytes(32) for _ in range(txs)],
+            'transactions': [{'payload': secrets.token_bytes(200)} for _ in range(txs)]
+        }]
+    }
+
+
+def timed(label, n, f):
+    start = time.perf_counter()
+    f()
+    elapsed = time.perf_counter() - start
+
+    print('  {:<16} {:>8} ops in {:.3f}s | {:,.0f} ops/s'.format(label, n, elapsed, n / elapsed))
+
+
+def bench(db, blocks):
+    def put():
+        for block in blocks:
+            db.put(dict(block), MasterStorage.BLOCK)
+            db.put({'blockNum': block['blockNum'], 'blockHash': block['blockHash'],
+                    'blockOwners': block['blockOwners']}, MasterStorage.INDEX)
+
+    def get_by_number():
+        for block in blocks:
+            db.get_block(block['blockNum'])
+
+    def get_by_hash():
+        for block in blocks:
+            db.get_block(block['blockHash'])
+
+    def get_last_n():
+        for _ in range(100):
+            db.get_last_n(10, MasterStorage.INDEX)
+
+    timed('put', len(blocks), put)
+    timed('get by number', len(blocks), get_by_number)
+    timed('get by hash', len(blocks), get_by_hash)
+    timed('get last 10', 100, get_last_n)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocks', type=int, default=5000)
+    parser.add_argument('--txs', type=int, default=20)
+    parser.add_argument('--backends', default='mongo,log')
+    parser.add_argument('--path', default=None, help='Directory for the log backend. A temporary one by default')
+    args = parser.parse_args()
+
+    blocks = [make_block(i + 1, args.txs) for i in range(args.blocks)]
+
+    for backend in args.backends.split(','):
+        path = args.path or tempfile.mkdtemp()
+
+        print('{} ({} blocks, {} txs each)'.format(backend, args.blocks, args.txs))
+
+        db = MasterStorage(backend=backend, log_directory=path)
+        db.drop_collections()
+
+        try:
+            bench(db, blocks)
+        finally:
+            db.drop_collections()
+            if args.path is None:
+                shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
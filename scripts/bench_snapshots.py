@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Measures the size of state snapshots and how fast they are made and restored.
+
+Fills state with synthetic balances, makes a snapshot of it, and restores it into empty state. Reports the raw and
+compressed size of the snapshot, and keys per second for making and restoring it, checks included. The dict backend
+measures the snapshot code alone. The state backend goes through BlockchainDriver and the configured state database,
+which is flushed before and after.
+
+Usage: python3 scripts/bench_snapshots.py [--keys N] [--value-bytes N] [--chunk-bytes N] [--backend dict|state]
+"""
+
+import argparse
+import secrets
+import time
+
+from cilantro_ee.core.snapshots import make_snapshot, restore_snapshot, SNAPSHOT_CHUNK_BYTES
+
+
+class DictDriver:
+    def __init__(self):
+        self.data = {}
+
+    def iter(self, prefix):
+        return [k for k in self.data if k.startswith(prefix)]
+
+    def get_direct(self, key):
+        return self.data.get(key)
+
+    def get_many(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def set_direct(self, key, value):
+        self.data[key] = value
+
+    def set_many(self, values):
+        for key, value in values.items():
+            if value is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+
+    def flush(self):
+        self.data = {}
+
+
+def get_driver(backend):
+    if backend == 'state':
+        from cilantro_ee.storage import BlockchainDriver
+        return BlockchainDriver()
+    return DictDriver()
+
+
+def timed(label, n, f):
+    start = time.perf_counter()
+    result = f()
+    elapsed = time.perf_counter() - start
+
+    print('  {:<16} {:>8} keys in {:.3f}s | {:,.0f} keys/s'.format(label, n, elapsed, n / elapsed))
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--value-bytes', type=int, default=32)
+    parser.add_argument('--chunk-bytes', type=int, default=SNAPSHOT_CHUNK_BYTES)
+    parser.add_argument('--backend', default='dict')
+    args = parser.parse_args()
+
+    source = get_driver(args.backend)
+    source.flush()
+
+    raw = 0
+    for _ in range(args.keys):
+        key = 'currency.balances:{}'.format(secrets.token_hex(32))
+        # Balances are mostly digits, so they compress like real state rather than like random bytes
+        value = str(secrets.randbelow(10 ** args.value_bytes)).zfill(args.value_bytes).encode()
+
+        source.set_direct(key, value)
+        raw += len(key) + len(value)
+
+    print('{} ({} keys, {} byte values, {} byte chunks)'.format(args.backend, args.keys, args.value_bytes,
+                                                                args.chunk_bytes))
+
+    try:
+        manifest, chunks = timed('make', args.keys,
+                                 lambda: make_snapshot(source, 1, 100, secrets.token_bytes(32), args.chunk_bytes))
+
+        compressed = sum(len(c) for c in chunks)
+        print('  {:<16} {:>8} chunks | {:,} bytes raw, {:,} compressed ({:.0%})'.format(
+            'size', len(chunks), raw, compressed, compressed / raw))
+
+        target = DictDriver() if args.backend == 'dict' else source
+        target.flush()
+
+        timed('restore', args.keys, lambda: restore_snapshot(target, manifest, chunks))
+    finally:
+        source.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Measures the cost of keeping the state commitment current, against rebuilding it from all of state.
+
+Fills an in memory state with synthetic balances and rebuilds the commitment once. Then applies blocks of random
+deltas through the commitment and reports deltas per second for the root of the next block, for applying the block,
+and keys per second for a full rebuild. Block cost should not grow with the size of state.
+
+Usage: python3 scripts/bench_state_root.py [--keys N] [--blocks N] [--deltas N]
+"""
+
+import argparse
+import random
+import time
+
+from cilantro_ee.storage.commitment import StateCommitment
+
+
+class MemoryDriver:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def get_many(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def iter(self, prefix):
+        return [k for k in self.data if k.startswith(prefix)]
+
+    def commit(self):
+        pass
+
+
+def timed(label, n, unit, f):
+    start = time.perf_counter()
+    result = f()
+    elapsed = time.perf_counter() - start
+
+    print('  {:<16} {:>8} {} in {:.3f}s | {:,.0f} {}/s'.format(label, n, unit, elapsed, n / elapsed, unit))
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--blocks', type=int, default=100)
+    parser.add_argument('--deltas', type=int, default=100)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    driver = MemoryDriver()
+
+    for i in range(args.keys):
+        driver.set('currency.balances:{}'.format(i), str(rng.randrange(10 ** 6)).encode())
+
+    commitment = StateCommitment(driver)
+
+    print('{} keys, {} blocks of {} deltas'.format(args.keys, args.blocks, args.deltas))
+
+    timed('rebuild', args.keys, 'keys', commitment.rebuild)
+
+    blocks = [[('currency.balances:{}'.format(rng.randrange(args.keys * 2)), str(rng.randrange(10 ** 6)).encode())
+               for _ in range(args.deltas)] for _ in range(args.blocks)]
+
+    def preview():
+        for deltas in blocks:
+            commitment.root_after(deltas)
+
+    def apply():
+        for deltas in blocks:
+            for key, value in deltas:
+                commitment.update(key, value)
+                driver.set(key, value)
+            commitment.save()
+
+    timed('block root', args.blocks * args.deltas, 'deltas', preview)
+    timed('apply block', args.blocks * args.deltas, 'deltas', apply)
+
+    assert commitment.root() == StateCommitment(driver).rebuild(), 'Commitment does not match state.'
+
+
+if __name__ == '__main__':
+    main()
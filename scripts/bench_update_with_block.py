@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Measures how fast BlockchainDriver.update_with_block applies blocks against the configured state backend.
+
+Builds synthetic blocks with a given number of transactions and deltas per transaction, applies them one after the
+other and reports deltas applied per second.
+
+Usage: python3 scripts/bench_update_with_block.py [--blocks N] [--txs N] [--deltas N]
+"""
+
+import argparse
+import secrets
+import time
+
+from cilantro_ee.storage import BlockchainDriver
+
+
+def make_block(block_num, prev_hash, txs, deltas, processor):
+    transactions = []
+    for _ in range(txs):
+        sender = secrets.token_bytes(32)
+        transactions.append({
+            'transaction': {
+                'payload': {
+                    'sender': sender,
+                    'processor': processor,
+                    'nonce': 0
+                }
+            },
+            'state': [
+                {'key': 'currency.balances:{}{}'.format(sender.hex(), i), 'value': b'100'} for i in range(deltas)
+            ]
+        })
+
+    return {
+        'blockHash': secrets.token_bytes(32),
+        'blockNum': block_num,
+        'prevBlockHash': prev_hash,
+        'subBlocks': [{'transactions': transactions}]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocks', type=int, default=20)
+    parser.add_argument('--txs', type=int, default=500)
+    parser.add_argument('--deltas', type=int, default=4)
+    args = parser.parse_args()
+
+    driver = BlockchainDriver()
+    driver.flush()
+
+    processor = secrets.token_bytes(32)
+
+    blocks = []
+    prev_hash = driver.latest_block_hash
+    for i in range(args.blocks):
+        block = make_block(i + 1, prev_hash, args.txs, args.deltas, processor)
+        blocks.append(block)
+        prev_hash = block['blockHash']
+
+    start = time.perf_counter()
+    for block in blocks:
+        driver.update_with_block(block)
+    elapsed = time.perf_counter() - start
+
+    total = args.blocks * args.txs * args.deltas
+
+    print('{} blocks, {} deltas in {:.3f}s | {:,.0f} deltas/s | {:.1f}ms per block'.format(
+        args.blocks, total, elapsed, total / elapsed, elapsed / args.blocks * 1000
+    ))
+
+    driver.flush()
+
+
+if __name__ == '__main__':
+    main()
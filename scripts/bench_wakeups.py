@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Compares the old asyncio.sleep(0) spin loops with the Notifier based waits used by the node inboxes.
+
+Reports:
+- CPU time burned by a waiter while nothing arrives (idle CPU)
+- Time between a producer appending a message and the waiter waking up (message-to-wakeup latency)
+
+Usage: python3 scripts/bench_wakeups.py [--idle SECONDS] [--messages N]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from cilantro_ee.containers.notifying_queue import NotifyingQueue
+
+
+async def spin_wait(q):
+    while len(q) <= 0:
+        await asyncio.sleep(0)
+
+
+async def notified_wait(q):
+    await q.wait_for_items()
+
+
+async def idle_cpu(wait, idle):
+    q = NotifyingQueue()
+
+    cpu_start = time.process_time()
+    waiter = asyncio.ensure_future(wait(q))
+
+    await asyncio.sleep(idle)
+    q.append(b'done')
+    await waiter
+
+    return time.process_time() - cpu_start
+
+
+async def wakeup_latency(wait, messages):
+    q = NotifyingQueue()
+    latencies = []
+
+    for _ in range(messages):
+        waiter = asyncio.ensure_future(wait(q))
+
+        # Let the waiter settle into its waiting state before producing
+        await asyncio.sleep(0.001)
+
+        sent = time.perf_counter()
+        q.append(b'msg')
+        await waiter
+        latencies.append(time.perf_counter() - sent)
+
+        q.clear()
+
+    return latencies
+
+
+def report(name, cpu, idle, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+
+    print('{:<10} idle cpu: {:6.1f}% of a core | wakeup latency mean {:8.1f}us p99 {:8.1f}us'.format(
+        name,
+        cpu / idle * 100,
+        statistics.mean(latencies) * 1_000_000,
+        p99 * 1_000_000
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--idle', type=float, default=2.0)
+    parser.add_argument('--messages', type=int, default=1000)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+
+    for name, wait in (('spin', spin_wait), ('notifier', notified_wait)):
+        cpu = loop.run_until_complete(idle_cpu(wait, args.idle))
+        latencies = loop.run_until_complete(wakeup_latency(wait, args.messages))
+        report(name, cpu, args.idle, latencies)
+
+
+if __name__ == '__main__':
+    main()
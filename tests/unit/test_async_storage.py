@@ -0,0 +1,86 @@
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from cilantro_ee.storage.async_storage import AsyncStorage, storage_pool, STORAGE_WORKERS
+from cilantro_ee.storage.master import MasterStorage
+import threading
+import tempfile
+import shutil
+import asyncio
+
+
+class TestAsyncStorage(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = MasterStorage(backend='log', log_directory=self.path)
+        self.storage = AsyncStorage(self.db)
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.db.drop_collections()
+        shutil.rmtree(self.path)
+        self.loop.close()
+
+    def test_put_and_get_block(self):
+        async def put_and_get():
+            await self.storage.put({'blockNum': 1, 'blockHash': b'a', 'sender': 'stu'}, MasterStorage.BLOCK)
+            return await self.storage.get_block(1), await self.storage.get_block(b'a')
+
+        by_num, by_hash = self.loop.run_until_complete(put_and_get())
+
+        self.assertEqual(by_num['sender'], 'stu')
+        self.assertEqual(by_hash['sender'], 'stu')
+
+    def test_put_blocks_and_get_last_n(self):
+        blocks = [{'blockNum': i, 'blockHash': str(i), 'blockOwners': ['stu'], 'subBlocks': []} for i in range(1, 4)]
+
+        async def put_and_get():
+            await self.storage.put_blocks(blocks)
+            return await self.storage.get_last_n(2, MasterStorage.INDEX)
+
+        last = self.loop.run_until_complete(put_and_get())
+
+        self.assertEqual([b['blockNum'] for b in last], [3, 2])
+
+    def test_missing_block_returns_none(self):
+        self.assertIsNone(self.loop.run_until_complete(self.storage.get_block(100)))
+
+    def test_calls_run_off_the_event_loop_thread(self):
+        def whoami():
+            return threading.get_ident()
+
+        ident = self.loop.run_until_complete(self.storage.run(whoami))
+
+        self.assertNotEqual(ident, threading.get_ident())
+
+    def test_exceptions_are_raised_in_the_awaiting_coroutine(self):
+        def fail():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(self.storage.run(fail))
+
+    def test_concurrent_reads_all_complete(self):
+        for i in range(1, 21):
+            self.db.put({'blockNum': i, 'blockHash': str(i)}, MasterStorage.BLOCK)
+
+        async def read_all():
+            return await asyncio.gather(*[self.storage.get_block(i) for i in range(1, 21)])
+
+        blocks = self.loop.run_until_complete(read_all())
+
+        self.assertEqual([b['blockNum'] for b in blocks], list(range(1, 21)))
+
+    def test_given_pool_is_used(self):
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='test-pool')
+        storage = AsyncStorage(self.db, pool=pool)
+
+        name = self.loop.run_until_complete(storage.run(lambda: threading.current_thread().name))
+
+        self.assertTrue(name.startswith('test-pool'))
+        pool.shutdown()
+
+    def test_shared_pool_is_bounded(self):
+        self.assertIs(storage_pool(), storage_pool())
+        self.assertEqual(storage_pool()._max_workers, STORAGE_WORKERS)
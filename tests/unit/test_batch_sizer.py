@@ -0,0 +1,50 @@
+from unittest import TestCase
+from cilantro_ee.nodes.masternode.batch_sizer import BatchSizer
+
+
+class TestBatchSizer(TestCase):
+    def test_initial_size_is_clamped(self):
+        self.assertEqual(BatchSizer(min_size=10, max_size=50, initial_size=100).next_size(), 50)
+        self.assertEqual(BatchSizer(min_size=10, max_size=50, initial_size=1).next_size(), 10)
+
+    def test_full_fast_round_grows_size(self):
+        b = BatchSizer(min_size=10, max_size=1000, initial_size=100, target_latency=1000)
+
+        b.record(batch_len=100, elapsed=100)
+
+        self.assertEqual(b.next_size(), 125)
+
+    def test_partial_fast_round_does_not_grow_size(self):
+        b = BatchSizer(min_size=10, max_size=1000, initial_size=100, target_latency=1000)
+
+        b.record(batch_len=20, elapsed=100)
+
+        self.assertEqual(b.next_size(), 100)
+
+    def test_slow_round_shrinks_size_proportionally(self):
+        b = BatchSizer(min_size=10, max_size=1000, initial_size=100, target_latency=1000)
+
+        b.record(batch_len=100, elapsed=2000)
+
+        self.assertEqual(b.next_size(), 50)
+
+    def test_size_never_leaves_bounds(self):
+        b = BatchSizer(min_size=10, max_size=200, initial_size=100, target_latency=1000)
+
+        for _ in range(20):
+            b.record(batch_len=b.next_size(), elapsed=10)
+        self.assertEqual(b.next_size(), 200)
+
+        for _ in range(20):
+            b.record(batch_len=b.next_size(), elapsed=100_000)
+        self.assertEqual(b.next_size(), 10)
+
+    def test_latency_is_smoothed(self):
+        b = BatchSizer(min_size=10, max_size=1000, initial_size=100, target_latency=1000, smoothing=0.5)
+
+        b.record(batch_len=100, elapsed=500)
+        b.record(batch_len=20, elapsed=1300)
+
+        # (500 + 1300) / 2 = 900 is still under the target, so one slow round doesn't shrink the batch
+        self.assertEqual(b.latency, 900)
+        self.assertEqual(b.next_size(), 125)
@@ -4,8 +4,11 @@ from cilantro_ee.crypto.wallet import Wallet
 
 from cilantro_ee.core.block_fetch import BlockFetcher
 from cilantro_ee.core.block_server import BlockServer
+from cilantro_ee.core.snapshots import SnapshotStore, SnapshotError, make_snapshot
+from cilantro_ee.storage.commitment import StateCommitment
 from cilantro_ee.core import canonical
 import secrets
+import hashlib
 from cilantro_ee.storage.master import CilantroStorageDriver
 from cilantro_ee.storage.vkbook import VKBook
 from cilantro_ee.core.top import TopBlockManager
@@ -16,6 +19,8 @@ import zmq
 import asyncio
 from tests import random_txs
 import os
+import tempfile
+import shutil
 
 def make_ipc(p):
     try:
@@ -61,6 +66,10 @@ class FakeBlockReciever:
     def put(self, d):
         self.blocks[d['blockNum']] = d
 
+    def put_blocks(self, blocks):
+        for d in blocks:
+            self.put(d)
+
 async def stop_server(s, timeout):
     await asyncio.sleep(timeout)
     s.stop()
@@ -403,3 +412,486 @@ class TestBlockFetcher(TestCase):
             last_hash = block_dict['blockHash']
 
             self.assertDictEqual(block_dict, got)
+
+
+class FakeState:
+    def __init__(self):
+        self.blocks = []
+
+    def update_with_block(self, block):
+        self.blocks.append(block['blockNum'])
+
+
+class FakeTop:
+    def __init__(self):
+        self.height = 0
+        self.hash_ = b'\x00' * 32
+
+    def get_latest_block_hash(self):
+        return self.hash_
+
+    def set_latest_block_hash(self, h):
+        self.hash_ = h
+
+    def get_latest_block_number(self):
+        return self.height
+
+    def set_latest_block_number(self, n):
+        self.height = n
+
+
+class FakeBlock:
+    def __init__(self, subblocks, prev_hash, block_num):
+        d = canonical.block_from_subblocks(subblocks, previous_hash=prev_hash, block_num=block_num)
+
+        self.subBlocks = subblocks
+        self.blockHash = d['blockHash']
+        self.blockNum = block_num
+        self.prevBlockHash = prev_hash
+        self.blockOwners = [secrets.token_bytes(32)]
+        self.stateRoot = b''
+
+
+def make_chain(n, prev_hash=b'\x00' * 32):
+    chain = []
+    for i in range(n):
+        block = FakeBlock([s for s in random_txs.random_block(txs=2, block_num=i).subBlocks], prev_hash, i)
+        chain.append(block)
+        prev_hash = block.blockHash
+    return chain
+
+
+class TestWindowedCatchup(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.chain = make_chain(10)
+        self.sockets = {'a': 'a', 'b': 'b', 'c': 'c'}
+
+        self.fetcher = BlockFetcher(wallet=Wallet(),
+                                    ctx=None,
+                                    contacts=None,
+                                    masternode_sockets=FakeSocketBook(None, lambda: self.sockets),
+                                    blocks=FakeBlockReciever(),
+                                    top=FakeTop(),
+                                    state=FakeState(),
+                                    window=4,
+                                    range_size=2)
+
+        self.requests = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def serve(self, serve_block):
+        async def get_block_from_master(i, socket):
+            return serve_block(i, socket)
+
+        async def get_block_range_from_master(start, count, socket):
+            self.requests.append((start, count, socket))
+            # Later ranges come back first
+            await asyncio.sleep(0.001 * (10 - start))
+
+            blocks = []
+            for i in range(start, start + count):
+                block = serve_block(i, socket)
+                if block is None:
+                    break
+                blocks.append(block)
+            return blocks
+
+        self.fetcher.get_block_from_master = get_block_from_master
+        self.fetcher.get_block_range_from_master = get_block_range_from_master
+
+    def test_blocks_arriving_out_of_order_are_stored_in_order(self):
+        self.serve(lambda i, socket: self.chain[i])
+
+        self.loop.run_until_complete(self.fetcher.fetch_blocks(latest_block_available=9))
+
+        self.assertEqual(self.fetcher.state.blocks, list(range(10)))
+        self.assertEqual(sorted(self.fetcher.blocks.blocks.keys()), list(range(10)))
+        self.assertEqual(self.fetcher.top.get_latest_block_hash(), self.chain[9].blockHash)
+        self.assertGreater(self.fetcher.catchup_rate, 0)
+
+    def test_blocks_are_requested_in_ranges_spread_over_masternodes(self):
+        self.serve(lambda i, socket: self.chain[i])
+
+        self.loop.run_until_complete(self.fetcher.fetch_blocks(latest_block_available=9))
+
+        self.assertEqual([(start, count) for start, count, _ in self.requests], [(i, 2) for i in range(0, 10, 2)])
+        self.assertEqual({socket for _, _, socket in self.requests}, {'a', 'b', 'c'})
+
+    def test_no_more_than_window_blocks_in_flight(self):
+        in_flight = []
+        most = []
+
+        async def get_block_range_from_master(start, count, socket):
+            in_flight.extend(range(start, start + count))
+            most.append(len(in_flight))
+            await asyncio.sleep(0.001)
+            for i in range(start, start + count):
+                in_flight.remove(i)
+            return self.chain[start:start + count]
+
+        self.fetcher.get_block_range_from_master = get_block_range_from_master
+
+        self.loop.run_until_complete(self.fetcher.fetch_blocks(latest_block_available=9))
+
+        self.assertLessEqual(max(most), 4)
+        self.assertEqual(self.fetcher.state.blocks, list(range(10)))
+
+    def test_rest_of_a_partial_range_is_asked_of_the_next_masternode(self):
+        # Masternode 'a' is behind and only has the first five blocks
+        self.serve(lambda i, socket: None if socket == 'a' and i >= 5 else self.chain[i])
+
+        self.loop.run_until_complete(self.fetcher.fetch_blocks(latest_block_available=9))
+
+        self.assertEqual(self.fetcher.state.blocks, list(range(10)))
+
+    def test_block_from_another_chain_is_fetched_again(self):
+        fork = make_chain(10, prev_hash=b'\x01' * 32)
+
+        # One masternode serves blocks that verify on their own but don't link onto the chain
+        self.serve(lambda i, socket: fork[i] if socket == 'a' else self.chain[i])
+
+        self.loop.run_until_complete(self.fetcher.fetch_blocks(latest_block_available=9))
+
+        for i in range(10):
+            self.assertEqual(self.fetcher.blocks.blocks[i]['blockHash'], self.chain[i].blockHash)
+
+    def test_state_is_never_ahead_of_stored_blocks(self):
+        stored_when_applied = []
+
+        class CheckingState(FakeState):
+            def update_with_block(state, block):
+                stored_when_applied.append(block['blockNum'] in self.fetcher.blocks.blocks)
+                super().update_with_block(block)
+
+        self.fetcher = BlockFetcher(wallet=Wallet(), ctx=None, contacts=None,
+                                    masternode_sockets=FakeSocketBook(None, lambda: self.sockets),
+                                    blocks=FakeBlockReciever(), top=FakeTop(), state=CheckingState(),
+                                    write_batch_size=3, window=4, range_size=2)
+        self.serve(lambda i, socket: self.chain[i])
+
+        self.loop.run_until_complete(self.fetcher.fetch_blocks(latest_block_available=9))
+
+        self.assertEqual(self.fetcher.state.blocks, list(range(10)))
+        self.assertTrue(all(stored_when_applied))
+
+    def test_stops_at_a_block_no_one_has(self):
+        self.serve(lambda i, socket: self.chain[i] if i < 5 else None)
+
+        self.loop.run_until_complete(self.fetcher.fetch_blocks(latest_block_available=9))
+
+        self.assertEqual(self.fetcher.state.blocks, list(range(5)))
+        self.assertEqual(self.fetcher.top.get_latest_block_number(), 4)
+
+
+class FakeRangeDriver:
+    def __init__(self, blocks):
+        self.blocks = {b['blockNum']: b for b in blocks}
+
+    def get_block(self, i):
+        return self.blocks.get(i)
+
+    def get_blocks(self, start, count):
+        return [self.blocks[i] for i in range(start, start + count) if i in self.blocks]
+
+
+def make_empty_chain(n):
+    # Blocks without subblocks hash to the hash of their previous hash
+    prev_hash = b'\x00' * 32
+    blocks = []
+    for i in range(n):
+        block_hash = hashlib.sha3_256(prev_hash).digest()
+        blocks.append({
+            'blockNum': i,
+            'blockHash': block_hash,
+            'prevBlockHash': prev_hash,
+            'blockOwners': [secrets.token_bytes(32)],
+            'subBlocks': []
+        })
+        prev_hash = block_hash
+    return blocks
+
+
+class TestBlockRangeStream(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.ctx = zmq.asyncio.Context()
+
+        self.chain = make_empty_chain(100)
+
+        n1 = '/tmp/n1'
+        make_ipc(n1)
+        self.server = BlockServer(socket_base=f'ipc://{n1}',
+                                  wallet=Wallet(),
+                                  ctx=self.ctx,
+                                  linger=500,
+                                  poll_timeout=50,
+                                  top=FakeTopBlockManager(101, 'abcd'),
+                                  driver=FakeRangeDriver(self.chain))
+
+        self.sockets = {'a': services._socket(f'ipc://{n1}/blocks')}
+
+    def tearDown(self):
+        self.ctx.destroy()
+        self.loop.close()
+
+    def test_get_block_range_from_master(self):
+        f = BlockFetcher(wallet=Wallet(), ctx=self.ctx, contacts=None,
+                         masternode_sockets=FakeSocketBook(None, lambda: self.sockets))
+
+        tasks = asyncio.gather(
+            self.server.serve(),
+            f.get_block_range_from_master(10, 40, self.sockets['a']),
+            stop_server(self.server, 0.5)
+        )
+
+        blocks = self.loop.run_until_complete(tasks)[1]
+
+        self.assertEqual([b.blockNum for b in blocks], list(range(10, 50)))
+        self.assertEqual([b.blockHash for b in blocks], [b['blockHash'] for b in self.chain[10:50]])
+
+    def test_fetch_blocks_over_range_streams(self):
+        f = BlockFetcher(wallet=Wallet(), ctx=self.ctx, contacts=None,
+                         masternode_sockets=FakeSocketBook(None, lambda: self.sockets),
+                         blocks=FakeBlockReciever(), top=FakeTop(), state=FakeState(),
+                         window=64, range_size=16)
+
+        tasks = asyncio.gather(
+            self.server.serve(),
+            f.fetch_blocks(latest_block_available=99),
+            stop_server(self.server, 1)
+        )
+
+        self.loop.run_until_complete(tasks)
+
+        self.assertEqual(f.state.blocks, list(range(100)))
+        self.assertEqual(f.top.get_latest_block_hash(), self.chain[99]['blockHash'])
+
+
+class FakeSnapshotState(FakeState):
+    def __init__(self, data=None):
+        super().__init__()
+        self.data = dict(data or {})
+
+        # Writes that go through the driver's buffer, like the state commitment, are kept apart from state
+        self.written = {}
+        self.commitment = StateCommitment(self)
+
+    def iter(self, prefix):
+        return [k for k in self.data if k.startswith(prefix)]
+
+    def get_direct(self, key):
+        return self.data.get(key)
+
+    def set_direct(self, key, value):
+        self.data[key] = value
+
+    def set_many(self, values):
+        for key, value in values.items():
+            if value is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+
+    def get(self, key):
+        return self.written.get(key, self.data.get(key))
+
+    def get_many(self, keys):
+        return [self.get(k) for k in keys]
+
+    def set(self, key, value):
+        self.written[key] = value
+
+    def commit(self):
+        pass
+
+
+def set_state_root(chain, i, state_root):
+    # Blocks without subblocks hash to the hash of their previous hash and state root
+    chain[i]['stateRoot'] = state_root
+
+    for block in chain[i:]:
+        if block['blockNum'] > i:
+            block['prevBlockHash'] = prev_hash
+        block['blockHash'] = hashlib.sha3_256(block['prevBlockHash'] + block.get('stateRoot', b'')).digest()
+        prev_hash = block['blockHash']
+
+
+class TestSnapshotBootstrap(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.ctx = zmq.asyncio.Context()
+
+        self.source = FakeSnapshotState({'currency.balances:{:04d}'.format(i): str(i).encode() for i in range(2000)})
+
+        self.chain = make_empty_chain(100)
+        set_state_root(self.chain, 50, FakeSnapshotState(self.source.data).commitment.rebuild())
+
+        self.paths = []
+        self.serve_snapshot(self.source)
+
+        self.fetcher = BlockFetcher(wallet=Wallet(), ctx=self.ctx, contacts=None,
+                                    masternode_sockets=FakeSocketBook(None, lambda: self.sockets),
+                                    top=FakeTop(), state=FakeSnapshotState(), window=64, range_size=16)
+
+    def tearDown(self):
+        for path in self.paths:
+            shutil.rmtree(path)
+        self.ctx.destroy()
+        self.loop.close()
+
+    def serve_snapshot(self, state):
+        self.servers = []
+        self.sockets = {}
+
+        for name in ['n1', 'n2']:
+            store = SnapshotStore(tempfile.mkdtemp())
+            manifest, chunks = make_snapshot(state, 1, 50, self.chain[50]['blockHash'], chunk_bytes=4096)
+            store.save(manifest, chunks)
+
+            ipc = '/tmp/' + name
+            make_ipc(ipc)
+
+            self.paths.append(store.path)
+            self.servers.append(BlockServer(socket_base=f'ipc://{ipc}',
+                                            wallet=Wallet(),
+                                            ctx=self.ctx,
+                                            linger=500,
+                                            poll_timeout=50,
+                                            top=FakeTopBlockManager(100, 'abcd'),
+                                            driver=FakeRangeDriver(self.chain),
+                                            snapshots=store))
+            self.sockets[name] = services._socket(f'ipc://{ipc}/blocks')
+
+        self.manifest = manifest
+
+    def run_with_servers(self, coro, timeout=1):
+        tasks = asyncio.gather(
+            *[s.serve() for s in self.servers],
+            coro,
+            *[stop_server(s, timeout) for s in self.servers]
+        )
+
+        return self.loop.run_until_complete(tasks)[len(self.servers)]
+
+    def test_find_snapshot_manifest(self):
+        manifest = self.run_with_servers(self.fetcher.find_snapshot_manifest())
+
+        self.assertEqual(manifest, self.manifest)
+
+    def test_bootstrap_restores_state_and_top(self):
+        block_num = self.run_with_servers(self.fetcher.bootstrap_from_snapshot())
+
+        self.assertEqual(block_num, 50)
+        self.assertEqual(self.fetcher.state.data, self.source.data)
+        self.assertEqual(self.fetcher.top.get_latest_block_number(), 50)
+        self.assertEqual(self.fetcher.top.get_latest_block_hash(), self.chain[50]['blockHash'])
+
+    def test_bootstrap_rebuilds_state_root(self):
+        self.run_with_servers(self.fetcher.bootstrap_from_snapshot())
+
+        self.assertEqual(self.fetcher.state.commitment.root(), self.chain[50]['stateRoot'])
+
+    def test_snapshot_not_matching_state_root_is_rejected(self):
+        tampered = FakeSnapshotState(self.source.data)
+        tampered.data['currency.balances:0001'] = b'1000000'
+        self.serve_snapshot(tampered)
+
+        with self.assertRaises(SnapshotError):
+            self.run_with_servers(self.fetcher.bootstrap_from_snapshot())
+
+        self.assertEqual(self.fetcher.top.get_latest_block_number(), 0)
+        self.assertEqual(self.fetcher.state.data, {})
+
+    def test_bootstrap_replaces_state_node_already_had(self):
+        self.fetcher.state.data['currency.balances:0001'] = b'stale'
+        self.fetcher.state.data['currency.balances:9999'] = b'gone'
+
+        self.run_with_servers(self.fetcher.bootstrap_from_snapshot())
+
+        self.assertEqual(self.fetcher.state.data, self.source.data)
+        self.assertEqual(self.fetcher.state.commitment.root(), self.chain[50]['stateRoot'])
+
+    def test_restored_state_not_matching_state_root_is_rejected(self):
+        set_many = self.fetcher.state.set_many
+
+        # Loses a key on the way to the database
+        def lossy_set_many(values):
+            values.pop('currency.balances:0001', None)
+            set_many(values)
+
+        self.fetcher.state.set_many = lossy_set_many
+
+        with self.assertRaises(SnapshotError):
+            self.run_with_servers(self.fetcher.bootstrap_from_snapshot())
+
+        self.assertEqual(self.fetcher.top.get_latest_block_number(), 0)
+
+    def test_snapshot_is_not_restored_without_its_block(self):
+        for server in self.servers:
+            del server.driver.blocks[50]
+
+        self.assertIsNone(self.run_with_servers(self.fetcher.bootstrap_from_snapshot(), timeout=2))
+        self.assertEqual(self.fetcher.state.data, {})
+        self.assertEqual(self.fetcher.top.get_latest_block_number(), 0)
+
+    def test_bad_chunk_is_fetched_from_another_masternode(self):
+        with open(os.path.join(self.paths[0], '{:010d}'.format(1), '0.chunk'), 'wb') as f:
+            f.write(b'bad')
+
+        self.run_with_servers(self.fetcher.bootstrap_from_snapshot())
+
+        self.assertEqual(self.fetcher.state.data, self.source.data)
+
+    def test_snapshot_not_ahead_is_skipped(self):
+        self.fetcher.top.set_latest_block_number(60)
+
+        self.assertIsNone(self.run_with_servers(self.fetcher.bootstrap_from_snapshot()))
+        self.assertEqual(self.fetcher.state.data, {})
+
+    async def bootstrap_and_fetch(self):
+        await self.fetcher.bootstrap_from_snapshot()
+        await self.fetcher.fetch_blocks(latest_block_available=99)
+
+    def test_only_blocks_after_snapshot_are_replayed(self):
+        self.run_with_servers(self.bootstrap_and_fetch(), timeout=2)
+
+        self.assertEqual(self.fetcher.state.blocks, list(range(51, 100)))
+        self.assertEqual(self.fetcher.top.get_latest_block_hash(), self.chain[99]['blockHash'])
+
+    def serve_height(self, height):
+        for server in self.servers:
+            server.top = FakeTopBlockManager(height, 'abcd')
+
+    def test_sync_catches_up_node_that_starts_behind(self):
+        self.serve_height(99)
+
+        top = FakeTop()
+        top.set_latest_block_number(39)
+        top.set_latest_block_hash(self.chain[39]['blockHash'])
+
+        fetcher = BlockFetcher(wallet=Wallet(), ctx=self.ctx, contacts=None,
+                               masternode_sockets=FakeSocketBook(None, lambda: self.sockets),
+                               blocks=FakeBlockReciever(), top=top, state=FakeState(), window=64, range_size=16)
+
+        self.run_with_servers(fetcher.sync(), timeout=3)
+
+        self.assertEqual(fetcher.state.blocks, list(range(40, 100)))
+        self.assertEqual(sorted(fetcher.blocks.blocks.keys()), list(range(40, 100)))
+        self.assertEqual(fetcher.top.get_latest_block_hash(), self.chain[99]['blockHash'])
+
+    def test_sync_replays_blocks_after_restored_snapshot(self):
+        self.serve_height(99)
+
+        self.run_with_servers(self.fetcher.sync(), timeout=3)
+
+        self.assertEqual(self.fetcher.state.data, self.source.data)
+        self.assertEqual(self.fetcher.state.blocks, list(range(51, 100)))
+        self.assertEqual(self.fetcher.top.get_latest_block_number(), 99)
+        self.assertEqual(self.fetcher.top.get_latest_block_hash(), self.chain[99]['blockHash'])
@@ -1,6 +1,6 @@
 from unittest import TestCase
 from cilantro_ee.crypto.wallet import Wallet
-from cilantro_ee.core.block_server import BlockServer
+from cilantro_ee.core.block_server import BlockServer, MAX_RANGE_COUNT, RANGE_CHUNK_SIZE
 
 from cilantro_ee.messages.message import Message
 from cilantro_ee.messages.message_type import MessageType
@@ -8,11 +8,14 @@ from cilantro_ee.messages.message_type import MessageType
 from cilantro_ee.storage.master import CilantroStorageDriver
 from cilantro_ee.core import canonical
 from cilantro_ee.core.top import TopBlockManager
+from cilantro_ee.core.snapshots import SnapshotStore, verify_chunk
 import time
 import zmq.asyncio
 import zmq
 import asyncio
 import secrets
+import tempfile
+import shutil
 from tests import random_txs
 
 
@@ -176,3 +179,280 @@ class TestBlockServer(TestCase):
 
         msg_type, msg, sender, timestamp, is_verified = Message.unpack_message_2(res[1])
         self.assertEqual(msg_type, MessageType.BAD_REQUEST)
+
+
+class FakeRangeDriver:
+    def __init__(self, blocks):
+        self.blocks = {b['blockNum']: b for b in blocks}
+
+    def get_block(self, i):
+        return self.blocks.get(i)
+
+    def get_blocks(self, start, count):
+        return [self.blocks[i] for i in range(start, start + count) if i in self.blocks]
+
+
+def make_blocks(n):
+    prev_hash = b'\x00' * 32
+    blocks = []
+    for i in range(n):
+        block_hash = secrets.token_bytes(32)
+        blocks.append({
+            'blockNum': i,
+            'blockHash': block_hash,
+            'prevBlockHash': prev_hash,
+            'blockOwners': [secrets.token_bytes(32)],
+            'subBlocks': []
+        })
+        prev_hash = block_hash
+    return blocks
+
+
+class TestBlockRangeRequest(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.ctx = zmq.asyncio.Context()
+        self.w = Wallet()
+
+    def tearDown(self):
+        self.ctx.destroy()
+        self.loop.close()
+
+    def stream(self, driver, start, count):
+        m = BlockServer(self.w, 'tcp://127.0.0.1', self.ctx, linger=500, poll_timeout=50, driver=driver)
+
+        async def get(msg):
+            socket = self.ctx.socket(zmq.DEALER)
+            socket.connect('tcp://127.0.0.1:10004')
+
+            await socket.send(msg)
+
+            replies = []
+            while await socket.poll(timeout=300, flags=zmq.POLLIN):
+                replies.append(await socket.recv_multipart())
+
+            socket.close()
+            return replies
+
+        message = Message.get_signed_message_packed_2(wallet=self.w,
+                                                      msg_type=MessageType.BLOCK_RANGE_REQUEST,
+                                                      start=start,
+                                                      count=count)
+
+        tasks = asyncio.gather(
+            m.serve(),
+            get(message),
+            stop_server(m, 0.5),
+        )
+
+        replies = self.loop.run_until_complete(tasks)[1]
+
+        return [[Message.unpack_message_2(frame) for frame in reply] for reply in replies]
+
+    def test_range_is_streamed_in_chunks(self):
+        blocks = make_blocks(40)
+
+        replies = self.stream(FakeRangeDriver(blocks), 0, 40)
+
+        self.assertEqual([len(r) for r in replies], [RANGE_CHUNK_SIZE, RANGE_CHUNK_SIZE, 40 - 2 * RANGE_CHUNK_SIZE])
+
+        received = [msg for reply in replies for msg_type, msg, _, _, _ in reply]
+        self.assertEqual([msg.blockNum for msg in received], list(range(40)))
+        self.assertEqual([msg.blockHash for msg in received], [b['blockHash'] for b in blocks])
+
+    def test_range_from_the_middle(self):
+        replies = self.stream(FakeRangeDriver(make_blocks(40)), 10, 5)
+
+        self.assertEqual([msg.blockNum for reply in replies for _, msg, _, _, _ in reply], list(range(10, 15)))
+
+    def test_stream_ends_with_bad_request_at_missing_block(self):
+        replies = self.stream(FakeRangeDriver(make_blocks(5)), 0, 10)
+
+        frames = [msg_type for reply in replies for msg_type, _, _, _, _ in reply]
+
+        self.assertEqual(frames, [MessageType.BLOCK_DATA] * 5 + [MessageType.BAD_REQUEST])
+
+    def test_range_is_capped(self):
+        replies = self.stream(FakeRangeDriver(make_blocks(MAX_RANGE_COUNT + 10)), 0, MAX_RANGE_COUNT + 10)
+
+        self.assertEqual(sum(len(r) for r in replies), MAX_RANGE_COUNT)
+
+
+class CountingRangeDriver(FakeRangeDriver):
+    def __init__(self, blocks):
+        super().__init__(blocks)
+        self.reads = 0
+
+    def get_block(self, i):
+        self.reads += 1
+        return super().get_block(i)
+
+    def get_blocks(self, start, count):
+        self.reads += 1
+        return super().get_blocks(start, count)
+
+
+class TestReplyCache(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.ctx = zmq.asyncio.Context()
+        self.w = Wallet()
+
+        self.blocks = make_blocks(40)
+        self.driver = CountingRangeDriver(self.blocks)
+        self.server = BlockServer(self.w, 'tcp://127.0.0.1', self.ctx, driver=self.driver, reply_cache_size=32)
+
+    def tearDown(self):
+        self.ctx.destroy()
+        self.loop.close()
+
+    def test_cache_block_stores_signed_reply(self):
+        reply = self.server.cache_block(self.blocks[3])
+
+        msg_type, msg, sender, _, _ = Message.unpack_message_2(reply)
+
+        self.assertEqual(msg_type, MessageType.BLOCK_DATA)
+        self.assertEqual(msg.blockHash, self.blocks[3]['blockHash'])
+        self.assertEqual(sender, self.w.vk.encode())
+        self.assertEqual(self.server.reply_cache.get(3), (self.blocks[3]['blockHash'], reply))
+
+    def test_cached_block_served_without_reading_storage(self):
+        reply = self.server.cache_block(self.blocks[3])
+
+        self.assertEqual(self.loop.run_until_complete(self.server.get_reply(3)), reply)
+        self.assertEqual(self.driver.reads, 0)
+
+    def test_miss_reads_storage_once(self):
+        first = self.loop.run_until_complete(self.server.get_reply(5))
+        second = self.loop.run_until_complete(self.server.get_reply(5))
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.driver.reads, 1)
+
+    def test_missing_block_is_not_cached(self):
+        self.assertIsNone(self.loop.run_until_complete(self.server.get_reply(100)))
+        self.assertEqual(len(self.server.reply_cache), 0)
+
+    def test_block_stored_again_replaces_reply(self):
+        self.server.cache_block(self.blocks[3])
+
+        replacement = dict(self.blocks[3], blockHash=secrets.token_bytes(32))
+        reply = self.server.cache_block(replacement)
+
+        self.assertEqual(self.loop.run_until_complete(self.server.get_reply(3)), reply)
+
+    def test_cache_is_bounded(self):
+        for block in self.blocks:
+            self.server.cache_block(block)
+
+        self.assertEqual(len(self.server.reply_cache), 32)
+        self.assertIsNone(self.server.reply_cache.get(0))
+        self.assertIsNotNone(self.server.reply_cache.get(39))
+
+    def test_cached_chunks_of_a_range_skip_storage(self):
+        for block in self.blocks[:RANGE_CHUNK_SIZE]:
+            self.server.cache_block(block)
+
+        sent = []
+
+        async def return_msgs(_id, msgs):
+            sent.append(msgs)
+
+        self.server.return_msgs = return_msgs
+
+        self.loop.run_until_complete(self.server.stream_blocks(b'id', 0, RANGE_CHUNK_SIZE * 2))
+
+        self.assertEqual(self.driver.reads, 1)
+        self.assertEqual(sent[0], [self.server.reply_cache.get(i)[1] for i in range(RANGE_CHUNK_SIZE)])
+        self.assertEqual(len(sent[1]), RANGE_CHUNK_SIZE)
+
+    def test_range_reads_do_not_fill_the_cache(self):
+        async def return_msgs(_id, msgs):
+            pass
+
+        self.server.return_msgs = return_msgs
+
+        self.loop.run_until_complete(self.server.stream_blocks(b'id', 0, 20))
+
+        self.assertEqual(len(self.server.reply_cache), 0)
+
+
+class FakeStateDriver:
+    def __init__(self, state):
+        self.state = state
+
+    def iter(self, prefix):
+        return [k for k in self.state if k.startswith(prefix)]
+
+    def get_direct(self, key):
+        return self.state.get(key)
+
+    def get_many(self, keys):
+        return [self.state.get(k) for k in keys]
+
+
+class TestSnapshotRequests(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.ctx = zmq.asyncio.Context()
+        self.w = Wallet()
+
+        self.path = tempfile.mkdtemp()
+        self.snapshots = SnapshotStore(self.path)
+        self.server = BlockServer(self.w, 'tcp://127.0.0.1', self.ctx, driver=FakeRangeDriver([]),
+                                  snapshots=self.snapshots)
+
+        self.sent = []
+
+        async def return_msg(_id, msg):
+            self.sent.append(msg)
+
+        self.server.return_msg = return_msg
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        self.ctx.destroy()
+        self.loop.close()
+
+    def request(self, msg_type, **kwargs):
+        message = Message.get_signed_message_packed_2(wallet=self.w, msg_type=msg_type, **kwargs)
+        self.loop.run_until_complete(self.server.handle_msg(b'id', message))
+
+        return Message.unpack_message_2(self.sent.pop())
+
+    def take_snapshot(self):
+        state = {'currency.balances:{}'.format(i): str(i).encode() for i in range(50)}
+        return self.snapshots.take(FakeStateDriver(state), 1, 100, b'\x01' * 32)
+
+    def test_latest_manifest_served(self):
+        manifest = self.take_snapshot()
+
+        msg_type, msg, _, _, _ = self.request(MessageType.SNAPSHOT_MANIFEST_REQUEST, timestamp=int(time.time()))
+
+        self.assertEqual(msg_type, MessageType.SNAPSHOT_MANIFEST)
+        self.assertEqual(msg.blockNum, 100)
+        self.assertEqual(msg.root, manifest['root'])
+        self.assertEqual([h for h in msg.chunkHashes], manifest['chunkHashes'])
+
+    def test_chunk_served(self):
+        manifest = self.take_snapshot()
+
+        msg_type, msg, _, _, _ = self.request(MessageType.SNAPSHOT_CHUNK_REQUEST, epoch=1, index=0)
+
+        self.assertEqual(msg_type, MessageType.SNAPSHOT_CHUNK)
+        self.assertTrue(verify_chunk(manifest, 0, msg.data))
+
+    def test_no_snapshot_returns_bad_request(self):
+        msg_type, _, _, _, _ = self.request(MessageType.SNAPSHOT_MANIFEST_REQUEST, timestamp=int(time.time()))
+
+        self.assertEqual(msg_type, MessageType.BAD_REQUEST)
+
+    def test_missing_chunk_returns_bad_request(self):
+        self.take_snapshot()
+
+        msg_type, _, _, _, _ = self.request(MessageType.SNAPSHOT_CHUNK_REQUEST, epoch=1, index=100)
+
+        self.assertEqual(msg_type, MessageType.BAD_REQUEST)
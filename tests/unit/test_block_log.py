@@ -0,0 +1,194 @@
+from unittest import TestCase
+from cilantro_ee.storage.block_log import SegmentedLog, LogStorageSet
+from cilantro_ee.storage.master import MasterStorage
+import tempfile
+import shutil
+import threading
+import os
+
+
+class TestSegmentedLog(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.log = SegmentedLog(self.path, 'blocks', segment_size=100)
+
+    def tearDown(self):
+        self.log.close()
+        shutil.rmtree(self.path)
+
+    def test_read_returns_appended_record(self):
+        slot = self.log.append(b'hello', slot=3, h=b'a')
+
+        self.assertEqual(slot, 3)
+        self.assertEqual(bytes(self.log.read(3)), b'hello')
+
+    def test_read_empty_slot_returns_none(self):
+        self.log.append(b'hello', slot=3)
+
+        self.assertIsNone(self.log.read(1))
+        self.assertIsNone(self.log.read(4))
+
+    def test_appends_without_slot_go_one_after_the_other(self):
+        self.assertEqual(self.log.append(b'a'), 0)
+        self.assertEqual(self.log.append(b'b'), 1)
+
+    def test_slot_for_hash(self):
+        self.log.append(b'hello', slot=1, h=b'a')
+        self.log.append(b'there', slot=2, h='b')
+
+        self.assertEqual(self.log.slot_for_hash(b'a'), 1)
+        self.assertEqual(self.log.slot_for_hash('b'), 2)
+        self.assertIsNone(self.log.slot_for_hash(b'c'))
+
+    def test_records_roll_over_into_new_segments(self):
+        for i in range(10):
+            self.log.append(b'x' * 40, slot=i)
+
+        segments = [f for f in os.listdir(self.path) if f.endswith('.log')]
+        self.assertGreater(len(segments), 1)
+
+        for i in range(10):
+            self.assertEqual(bytes(self.log.read(i)), b'x' * 40)
+
+    def test_index_grows_past_initial_capacity(self):
+        slot = self.log.capacity + 10
+
+        self.log.append(b'hello', slot=slot)
+
+        self.assertEqual(bytes(self.log.read(slot)), b'hello')
+
+    def test_reopen_keeps_records_and_hashes(self):
+        for i in range(10):
+            self.log.append(str(i).encode(), slot=i, h=str(i))
+
+        self.log.close()
+        self.log = SegmentedLog(self.path, 'blocks', segment_size=100)
+
+        self.assertEqual(bytes(self.log.read(7)), b'7')
+        self.assertEqual(self.log.slot_for_hash('7'), 7)
+        self.assertEqual(self.log.next_slot(), 10)
+
+    def test_slots_descending(self):
+        self.log.append(b'a', slot=1)
+        self.log.append(b'b', slot=4)
+
+        self.assertEqual(list(self.log.slots(descending=True)), [4, 1])
+
+    def test_sync_with_sync_writes(self):
+        log = SegmentedLog(self.path, 'synced', segment_size=100, sync=True)
+        log.append(b'hello')
+        log.sync()
+
+        self.assertEqual(bytes(log.read(0)), b'hello')
+        log.close()
+
+    def test_appends_from_many_threads(self):
+        def append(n):
+            for i in range(50):
+                self.log.append(str(n * 50 + i).encode(), slot=n * 50 + i)
+
+        threads = [threading.Thread(target=append, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for slot in range(200):
+            self.assertEqual(bytes(self.log.read(slot)), str(slot).encode())
+
+
+class TestLogStorageSet(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.blocks = LogStorageSet(self.path, 'blocks')
+
+    def tearDown(self):
+        self.blocks.log.close()
+        shutil.rmtree(self.path)
+
+    def test_find_one_by_number_and_hash(self):
+        self.blocks.insert({'blockNum': 1, 'blockHash': b'a', 'sender': 'stu'})
+
+        self.assertEqual(self.blocks.find_one({'blockNum': 1})['sender'], 'stu')
+        self.assertEqual(self.blocks.find_one({'blockHash': b'a'})['sender'], 'stu')
+
+    def test_insert_sets_id(self):
+        block = {'blockNum': 1, 'blockHash': b'a'}
+        self.blocks.insert(block)
+
+        self.assertIn('_id', block)
+
+    def test_storing_a_number_again_replaces_it(self):
+        self.blocks.insert({'blockNum': 1, 'blockHash': b'a'})
+        self.blocks.insert({'blockNum': 1, 'blockHash': b'b'})
+
+        self.assertEqual(self.blocks.find_one({'blockNum': 1})['blockHash'], b'b')
+        self.assertIsNone(self.blocks.find_one({'blockHash': b'a'}))
+
+    def test_last_n_descending_without_ids(self):
+        for i in range(5):
+            self.blocks.insert({'blockNum': i, 'blockHash': str(i)})
+
+        last = self.blocks.last_n(3)
+
+        self.assertEqual([b['blockNum'] for b in last], [4, 3, 2])
+        self.assertNotIn('_id', last[0])
+
+    def test_flush_drops_everything(self):
+        self.blocks.insert({'blockNum': 1, 'blockHash': b'a'})
+        self.blocks.flush()
+
+        self.assertIsNone(self.blocks.find_one({'blockNum': 1}))
+        self.assertEqual(self.blocks.last_n(1), [])
+
+    def test_hash_only_collection(self):
+        txs = LogStorageSet(self.path, 'tx', number_key=None, hash_key='tx_hash')
+        txs.insert({'tx_hash': 'a', 'block': 1})
+        txs.insert({'tx_hash': 'b', 'block': 2})
+
+        self.assertEqual(txs.find_one({'tx_hash': 'b'})['block'], 2)
+
+        txs.log.close()
+
+
+class TestLogMasterStorage(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = MasterStorage(backend='log', log_directory=self.path)
+
+    def tearDown(self):
+        self.db.drop_collections()
+        shutil.rmtree(self.path)
+
+    def test_genesis_block_stored(self):
+        self.assertEqual(self.db.get_block(0)['blockNum'], 0)
+
+    def test_put_and_get_block(self):
+        self.db.put({'blockNum': 1, 'blockHash': b'a', 'sender': 'stu'})
+
+        self.assertEqual(self.db.get_block(1)['sender'], 'stu')
+        self.assertEqual(self.db.get_block(b'a')['sender'], 'stu')
+        self.assertIsNone(self.db.get_block(2))
+
+    def test_get_last_n_index(self):
+        for i in range(1, 4):
+            self.db.put({'blockNum': i, 'blockHash': str(i), 'blockOwners': ['stu']}, MasterStorage.INDEX)
+
+        self.assertEqual([i['blockNum'] for i in self.db.get_last_n(2, MasterStorage.INDEX)], [3, 2])
+        self.assertEqual(self.db.get_owners(3), ['stu'])
+
+    def test_put_blocks_stores_blocks_and_index(self):
+        blocks = [{'blockNum': i, 'blockHash': str(i), 'blockOwners': ['stu'], 'subBlocks': []} for i in range(1, 4)]
+
+        self.db.put_blocks(blocks)
+
+        self.assertEqual(self.db.get_block(2)['blockHash'], '2')
+        self.assertEqual([i['blockNum'] for i in self.db.get_last_n(3, MasterStorage.INDEX)], [3, 2, 1])
+
+    def test_get_blocks_range(self):
+        for i in range(1, 6):
+            self.db.put({'blockNum': i, 'blockHash': str(i)})
+
+        self.assertEqual([b['blockNum'] for b in self.db.get_blocks(2, 3)], [2, 3, 4])
+        self.assertEqual([b['blockNum'] for b in self.db.get_blocks(4, 10)], [4, 5])
+        self.assertNotIn('_id', self.db.get_blocks(2, 1)[0])
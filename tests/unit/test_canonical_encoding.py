@@ -1,6 +1,17 @@
 from unittest import TestCase
 from cilantro_ee.core import canonical
 from tests import random_txs
+import hashlib
+
+
+class FakeCommitment:
+    def __init__(self, root):
+        self.root = root
+        self.deltas = None
+
+    def root_after(self, deltas):
+        self.deltas = list(deltas)
+        return self.root
 
 
 class TestCanonicalCoding(TestCase):
@@ -89,3 +100,71 @@ class TestCanonicalCoding(TestCase):
 
         self.assertTrue(valid)
 
+    def test_block_from_subblocks_commits_to_state_root(self):
+        sbs = random_txs.random_block().subBlocks
+        commitment = FakeCommitment(b'\x02' * 32)
+
+        block = canonical.block_from_subblocks(subblocks=sbs, previous_hash=b'\x00'*32, block_num=0,
+                                               commitment=commitment)
+
+        self.assertEqual(block['stateRoot'], b'\x02' * 32)
+        self.assertEqual(commitment.deltas, list(canonical.block_deltas(block['subBlocks'])))
+
+        self.assertTrue(canonical.verify_block(sbs, block['prevBlockHash'], block['blockHash'], block['stateRoot']))
+        self.assertFalse(canonical.verify_block(sbs, block['prevBlockHash'], block['blockHash']))
+        self.assertFalse(canonical.verify_block(sbs, block['prevBlockHash'], block['blockHash'], b'\x03' * 32))
+
+    def test_untracked_state_leaves_block_unchanged(self):
+        sbs = random_txs.random_block().subBlocks
+
+        block = canonical.block_from_subblocks(subblocks=sbs, previous_hash=b'\x00'*32, block_num=0,
+                                               commitment=FakeCommitment(None))
+
+        self.assertEqual(block, canonical.block_from_subblocks(subblocks=sbs, previous_hash=b'\x00'*32, block_num=0))
+
+    def test_block_deltas_in_order(self):
+        subblocks = [
+            {'transactions': [
+                {'state': [{'key': 'a.b', 'value': b'1'}, {'key': 'a.c', 'value': b'2'}]},
+                {'state': None}
+            ]},
+            {'transactions': [
+                {'state': [{'key': 'a.b', 'value': b'3'}]}
+            ]}
+        ]
+
+        self.assertEqual(list(canonical.block_deltas(subblocks)), [('a.b', b'1'), ('a.c', b'2'), ('a.b', b'3')])
+
+
+    def test_block_contracts_returns_written_contracts(self):
+        block = {
+            'subBlocks': [
+                {'transactions': [
+                    {'state': [{'key': b'currency.balances:stu', 'value': b'1'}]},
+                    {'state': [{'key': 'vkbook.masternode_list', 'value': b'1'}]}
+                ]},
+                {'transactions': [
+                    {'state': []}
+                ]}
+            ]
+        }
+
+        self.assertEqual(canonical.block_contracts(block), {'currency', 'vkbook'})
+
+    def test_block_tx_index_locates_every_transaction(self):
+        struct = random_txs.random_block()
+        struct = canonical.block_capnp.BlockData.from_bytes_packed(struct.to_bytes_packed())
+        block = struct.to_dict()
+
+        entries = canonical.block_tx_index(block)
+
+        self.assertEqual(len(entries), sum(len(sb['transactions']) for sb in block['subBlocks']))
+
+        for entry in entries:
+            tx = block['subBlocks'][entry['sub_block']]['transactions'][entry['tx_index']]
+            self.assertEqual(entry['tx_hash'], canonical.transaction_hash(tx['transaction']))
+            self.assertEqual(entry['block'], block['blockNum'])
+
+            # Same hash as the canonical packing of the transaction when it was submitted
+            submitted = struct.subBlocks[entry['sub_block']].transactions[entry['tx_index']].transaction
+            self.assertEqual(entry['tx_hash'], hashlib.sha3_256(submitted.as_builder().to_bytes_packed()).digest())
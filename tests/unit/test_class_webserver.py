@@ -1,14 +1,20 @@
 from unittest import TestCase
 
-from cilantro_ee.nodes.masternode.webserver import WebServer
+from cilantro_ee.nodes.masternode.webserver import WebServer, AdmissionInbox
 from cilantro_ee.crypto.wallet import Wallet
 from contracting.client import ContractingClient
 from cilantro_ee.storage import BlockchainDriver
-from cilantro_ee.crypto.transaction import TransactionBuilder
+from cilantro_ee.crypto.transaction import TransactionBuilder, PackedTransaction
+from cilantro_ee.sockets.services import get, _socket
 from contracting import config
 from cilantro_ee.messages.capnp_impl import capnp_struct as schemas
 import os
 import capnp
+import asyncio
+import json
+import zmq.asyncio
+import requests
+import time
 
 transaction_capnp = capnp.load(os.path.dirname(schemas.__file__) + '/transaction.capnp')
 
@@ -265,6 +271,39 @@ def get():
         _, response = self.ws.app.test_client.get('/latest_block')
         self.assertDictEqual(response.json, {'blockHash': 'abb', 'blockNum': 1000, 'data': 'woop2'})
 
+    def test_get_tx_returns_receipt(self):
+        tx = PackedTransaction.from_bytes(make_good_tx(self.w.verifying_key()))
+
+        block = {
+            'blockHash': b'\x01' * 32,
+            'blockNum': 1,
+            'subBlocks': [{
+                'subBlockNum': 0,
+                'merkleLeaves': [b'\x02' * 32],
+                'transactions': [{'transaction': tx.struct.to_dict(), 'status': 0, 'state': [], 'stampsUsed': 100}]
+            }]
+        }
+
+        self.ws.blocks.put(block)
+
+        _, response = self.ws.app.test_client.get('/tx/{}'.format(tx.hash.hex()))
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.json['hash'], tx.hash.hex())
+        self.assertEqual(response.json['blockNum'], 1)
+        self.assertEqual(response.json['blockHash'], (b'\x01' * 32).hex())
+        self.assertEqual(response.json['transaction']['stampsUsed'], 100)
+
+    def test_get_tx_that_doesnt_exist_returns_404(self):
+        _, response = self.ws.app.test_client.get('/tx/{}'.format('00' * 32))
+
+        self.assertEqual(response.status, 404)
+
+    def test_get_tx_malformed_hash_returns_400(self):
+        _, response = self.ws.app.test_client.get('/tx/xyz')
+
+        self.assertEqual(response.status, 400)
+
     def test_get_block_by_num_that_exists(self):
         pass
 
@@ -294,6 +333,162 @@ def get():
 
         self.assertDictEqual(response.json, {'error': 'Queue full. Resubmit shortly.'})
 
+    def test_admit_good_transaction_returns_canonical_hash(self):
+        self.ws.queue.clear()
+        tx = PackedTransaction.from_bytes(make_good_tx(self.w.verifying_key()))
+
+        status, result = self.ws.admit([tx])[0]
+
+        self.assertEqual(status, 200)
+        self.assertEqual(result['hash'], tx.hash.hex())
+        self.assertEqual(len(self.ws.queue), 1)
+
+    def test_admit_full_queue_returns_503(self):
+        self.ws.queue.clear()
+        self.ws.queue.extend(range(10_000))
+        tx = PackedTransaction.from_bytes(make_good_tx(self.w.verifying_key()))
+
+        status, result = self.ws.admit([tx])[0]
+        self.ws.queue.clear()
+
+        self.assertEqual(status, 503)
+        self.assertDictEqual(result, {'error': 'Queue full. Resubmit shortly.'})
+
+    def test_admission_inbox_replies_with_admission_result(self):
+        self.ws.queue.clear()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        ctx = zmq.asyncio.Context()
+
+        socket_id = _socket('ipc:///tmp/cil-admission-test')
+        inbox = AdmissionInbox(admit=self.ws.admit, socket_id=socket_id, ctx=ctx)
+
+        tx_bytes = make_good_tx(self.w.verifying_key())
+        tx = transaction_capnp.Transaction.from_bytes_packed(tx_bytes)
+        msg = transaction_capnp.Transactions.new_message(transactions=[tx]).to_bytes_packed()
+
+        async def submit():
+            reply = await get(socket_id, msg=msg, ctx=ctx, dealer=True)
+            inbox.stop()
+            return reply
+
+        _, reply = loop.run_until_complete(asyncio.gather(inbox.serve(), submit()))
+
+        ctx.destroy()
+        loop.close()
+
+        status, result = json.loads(reply)[0]
+
+        self.assertEqual(status, 200)
+        self.assertEqual(result['hash'], PackedTransaction.from_bytes(tx_bytes).hash.hex())
+        self.assertEqual(len(self.ws.queue), 1)
+
+    def test_submit_batch_accepts_good_and_rejects_bad_transactions(self):
+        self.ws.queue.clear()
+
+        good = transaction_capnp.Transaction.from_bytes_packed(make_good_tx(self.w.verifying_key()))
+        bad = transaction_capnp.Transaction.from_bytes_packed(make_bad_tx())
+
+        batch = transaction_capnp.Transactions.new_message(transactions=[good, bad]).to_bytes_packed()
+
+        _, response = self.ws.app.test_client.post('/batch', data=batch)
+
+        results = response.json['results']
+
+        self.assertEqual(results[0]['hash'], PackedTransaction(good).hash.hex())
+        self.assertDictEqual(results[1], {'error': 'Transaction processor does not match expected processor.'})
+        self.assertEqual(len(self.ws.queue), 1)
+
+    def test_submit_batch_tracks_nonces_of_same_sender(self):
+        self.ws.queue.clear()
+
+        w = Wallet()
+        balances_key = '{}{}{}{}{}'.format('currency',
+                                           config.INDEX_SEPARATOR,
+                                           'balances',
+                                           config.DELIMITER,
+                                           w.verifying_key().hex())
+        n.set(balances_key, 500000)
+
+        txs = []
+        for nonce in (0, 1, 1):
+            tx = TransactionBuilder(w.verifying_key(),
+                                    contract='currency',
+                                    function='transfer',
+                                    kwargs={'amount': 10, 'to': 'jeff'},
+                                    stamps=500000,
+                                    processor=self.w.verifying_key(),
+                                    nonce=nonce)
+            tx.sign(w.signing_key())
+            txs.append(transaction_capnp.Transaction.from_bytes_packed(tx.serialize()))
+
+        batch = transaction_capnp.Transactions.new_message(transactions=txs).to_bytes_packed()
+
+        _, response = self.ws.app.test_client.post('/batch', data=batch)
+
+        results = response.json['results']
+
+        self.assertIn('hash', results[0])
+        self.assertIn('hash', results[1])
+        self.assertDictEqual(results[2], {'error': 'Transaction nonce is invalid.'})
+        self.assertEqual(n.get_pending_nonce(self.w.verifying_key(), w.verifying_key()), 2)
+
+    def test_submit_batch_malformed_returns_400(self):
+        _, response = self.ws.app.test_client.post('/batch', data=b'howdy')
+
+        self.assertEqual(response.status, 400)
+
     def test_submit_transaction_error_if_tx_malformed(self):
         pass
 
+
+
+class TestWebserverWorkers(TestCase):
+    def setUp(self):
+        self.w = Wallet()
+        # Default number of workers, so HTTP is served from the server process
+        self.ws = WebServer(wallet=self.w, contracting_client=ContractingClient(), port=8181)
+        self.ws.client.flush()
+        self.ws.queue.clear()
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.ws.stop()
+        self.loop.close()
+        self.ws.client.flush()
+
+    def post(self, path, data):
+        # Retries until the workers are listening
+        for _ in range(50):
+            try:
+                return requests.post('http://127.0.0.1:8181' + path, data=data, timeout=5)
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.1)
+        raise AssertionError('Webserver workers never started.')
+
+    def test_workers_serve_and_forward_transactions_for_admission(self):
+        tx_bytes = make_good_tx(self.w.verifying_key())
+
+        async def submit():
+            await self.ws.start()
+            # Blocking request runs off the loop so the admission inbox can answer the workers
+            return await self.loop.run_in_executor(None, self.post, '/', tx_bytes)
+
+        response = self.loop.run_until_complete(submit())
+
+        self.assertGreater(self.ws.workers, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['hash'], PackedTransaction.from_bytes(tx_bytes).hash.hex())
+        self.assertEqual(len(self.ws.queue), 1)
+        self.assertTrue(self.ws.server_process.is_alive())
+
+    def test_stop_takes_down_server_process(self):
+        self.loop.run_until_complete(self.ws.start())
+        process = self.ws.server_process
+
+        self.ws.stop()
+
+        self.assertFalse(process.is_alive())
+        self.assertIsNone(self.ws.server_process)
@@ -7,6 +7,7 @@ from tests import random_txs
 
 from cilantro_ee.messages.capnp_impl import capnp_struct as schemas
 from cilantro_ee.core.nonces import PENDING_NONCE_KEY, NONCE_KEY
+from cilantro_ee.core import canonical
 
 blockdata_capnp = capnp.load(os.path.dirname(schemas.__file__) + '/blockdata.capnp')
 subblock_capnp = capnp.load(os.path.dirname(schemas.__file__) + '/subblock.capnp')
@@ -303,3 +304,252 @@ class TestCompleteDriver(TestCase):
             vals.append(self.db.get(n))
 
         self.assertEqual(sorted(vals), list(range(1, 21)))
+
+
+class TestReadCache(TestCase):
+    def setUp(self):
+        self.db = BlockchainDriver(cache_size=100)
+        self.db.flush()
+
+    def tearDown(self):
+        self.db.flush()
+
+    def test_cache_off_by_default(self):
+        self.assertIsNone(BlockchainDriver().read_cache_stats())
+
+    def test_second_read_is_a_hit(self):
+        self.db.set('hello', 'there')
+        self.db.commit()
+
+        self.assertEqual(self.db.get('hello'), 'there')
+        self.assertEqual(self.db.get('hello'), 'there')
+
+        stats = self.db.read_cache_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_missing_keys_are_cached(self):
+        self.assertIsNone(self.db.get('hello'))
+        self.assertIsNone(self.db.get('hello'))
+
+        self.assertEqual(self.db.read_cache_stats()['hits'], 1)
+
+    def test_uncommitted_write_is_read_back(self):
+        self.db.set('hello', 'there')
+        self.db.commit()
+        self.db.get('hello')
+
+        self.db.set('hello', 'world')
+
+        self.assertEqual(self.db.get('hello'), 'world')
+
+    def test_commit_invalidates_written_keys(self):
+        self.db.set('hello', 'there')
+        self.db.commit()
+        self.db.get('hello')
+
+        self.db.set('hello', 'world')
+        self.db.commit()
+
+        self.assertEqual(self.db.get('hello'), 'world')
+
+    def test_revert_keeps_committed_value(self):
+        self.db.set('hello', 'there')
+        self.db.commit()
+        self.db.get('hello')
+
+        self.db.set('hello', 'world')
+        self.db.revert()
+
+        self.assertEqual(self.db.get('hello'), 'there')
+
+    def test_deleted_key_reads_none_after_commit(self):
+        self.db.set('hello', 'there')
+        self.db.commit()
+        self.db.get('hello')
+
+        self.db.delete('hello')
+        self.db.commit()
+
+        self.assertIsNone(self.db.get('hello'))
+
+    def test_mutating_a_read_value_does_not_change_cache(self):
+        self.db.set('hello', ['a'])
+        self.db.commit()
+
+        self.db.get('hello').append('b')
+
+        self.assertEqual(self.db.get('hello'), ['a'])
+
+    def test_latest_block_hash_is_invalidated_when_set(self):
+        self.assertEqual(self.db.latest_block_hash, b'\x00' * 32)
+
+        self.db.latest_block_hash = b'\x01' * 32
+
+        self.assertEqual(self.db.latest_block_hash, b'\x01' * 32)
+
+    def test_update_with_block_invalidates_nonces_and_block_num(self):
+        processor = secrets.token_bytes(32)
+        sender = secrets.token_bytes(32)
+
+        self.assertIsNone(self.db.get_nonce(processor, sender))
+        self.assertEqual(self.db.latest_block_num, 0)
+
+        block = {
+            'blockHash': b'\x01' * 32,
+            'blockNum': 1,
+            'prevBlockHash': self.db.latest_block_hash,
+            'subBlocks': [{'transactions': [{
+                'transaction': {'payload': {'sender': sender, 'processor': processor, 'nonce': 0}},
+                'state': [{'key': 'hello', 'value': b'there'}]
+            }]}]
+        }
+
+        self.db.update_with_block(block)
+
+        self.assertEqual(self.db.get_nonce(processor, sender), 1)
+        self.assertEqual(self.db.latest_block_num, 1)
+        self.assertEqual(self.db.latest_block_hash, b'\x01' * 32)
+        self.assertEqual(self.db.get('hello'), b'there')
+
+    def count_round_trips(self):
+        calls = {'mget': 0, 'pipeline': 0}
+
+        def counted(name):
+            f = getattr(self.db.conn, name)
+
+            def call(*args, **kwargs):
+                calls[name] += 1
+                return f(*args, **kwargs)
+            return call
+
+        self.db.conn.mget = counted('mget')
+        self.db.conn.pipeline = counted('pipeline')
+
+        return calls
+
+    def test_get_many_reads_with_one_mget(self):
+        self.db.set_many({'a': b'1', 'b': [1, 2]})
+        calls = self.count_round_trips()
+
+        self.assertEqual(self.db.get_many(['a', 'b', 'c']), [b'1', [1, 2], None])
+        self.assertEqual(calls['mget'], 1)
+
+    def test_get_many_skips_cached_and_sees_staged_keys(self):
+        self.db.set_many({'a': b'1', 'b': b'2'})
+        self.db.get('a')
+        self.db.set('b', b'3')
+        calls = self.count_round_trips()
+
+        self.assertEqual(self.db.get_many(['a', 'b']), [b'1', b'3'])
+        self.assertEqual(calls['mget'], 0)
+
+    def test_set_many_writes_and_deletes_in_one_pipeline(self):
+        self.db.set_many({'a': b'1', 'b': b'2'})
+        self.db.get('a')
+        calls = self.count_round_trips()
+
+        self.db.set_many({'a': None, 'b': b'3'})
+
+        self.assertEqual(calls['pipeline'], 1)
+        self.assertIsNone(self.db.get('a'))
+        self.assertEqual(self.db.get('b'), b'3')
+
+    def test_block_is_written_with_one_pipeline(self):
+        processor = secrets.token_bytes(32)
+        self.db.set_pending_nonce(processor, b'stu', 1)
+        self.db.set_pending_nonce(processor, b'raghu', 5)
+        self.db.commit()
+
+        block = self.block_writing(1, {'currency.balances:stu': b'90', 'currency.balances:raghu': b'10'})
+        calls = self.count_round_trips()
+
+        self.db.update_with_block(block)
+
+        self.assertEqual(calls['pipeline'], 1)
+        self.assertEqual(self.db.get('currency.balances:raghu'), b'10')
+        self.assertEqual(self.db.get_nonce(b'mn', b'stu'), 2)
+        self.assertEqual(self.db.iter(PENDING_NONCE_KEY), [])
+        self.assertEqual(self.db.latest_block_num, 1)
+        self.assertEqual(self.db.latest_block_hash, block['blockHash'])
+
+    def test_cache_is_bounded(self):
+        for i in range(200):
+            self.db.get('key{}'.format(i))
+
+        self.assertEqual(self.db.read_cache_stats()['size'], 100)
+
+    def block_writing(self, block_num, state):
+        return {
+            'blockHash': bytes([block_num]) * 32,
+            'blockNum': block_num,
+            'prevBlockHash': self.db.latest_block_hash,
+            'subBlocks': [{'transactions': [{
+                'transaction': {'payload': {'sender': b'stu', 'processor': b'mn', 'nonce': block_num}},
+                'state': [{'key': k, 'value': v} for k, v in state.items()]
+            }]}]
+        }
+
+    def test_state_root_follows_blocks(self):
+        self.db.set('currency.balances:stu', b'100')
+        self.db.commit()
+        self.db.commitment.rebuild()
+
+        block = self.block_writing(1, {'currency.balances:stu': b'90', 'currency.balances:raghu': b'10'})
+        expected = self.db.commitment.root_after(canonical.block_deltas(block['subBlocks']))
+
+        self.db.update_with_block(block)
+
+        self.assertEqual(self.db.commitment.root(), expected)
+        self.assertEqual(self.db.commitment.rebuild(), expected)
+
+    def test_check_state_root_finds_divergence(self):
+        self.db.set('currency.balances:stu', b'100')
+        self.db.commit()
+        self.db.commitment.rebuild()
+
+        block = self.block_writing(1, {'currency.balances:stu': b'90'})
+        block['stateRoot'] = self.db.commitment.root_after(canonical.block_deltas(block['subBlocks']))
+
+        # Changed behind the commitment's back, so this node's state is no longer the one the block was made on
+        self.db.set('currency.balances:stu', b'50')
+        self.db.commit()
+
+        for sb in block['subBlocks']:
+            for tx in sb['transactions']:
+                self.db.set_transaction_data(tx)
+
+        self.assertFalse(self.db.check_state_root(block))
+
+    def test_executed_results_reverted_for_block_keep_state_root(self):
+        self.db.set('currency.balances:stu', b'100')
+        self.db.commit()
+        self.db.commitment.rebuild()
+
+        block = self.block_writing(1, {'currency.balances:stu': b'90'})
+        expected = self.db.commitment.root_after(canonical.block_deltas(block['subBlocks']))
+
+        # Results of executing the block's transactions, like a delegate has them before the block arrives
+        self.db.set('currency.balances:stu', b'90')
+        self.db.revert()
+        self.assertTrue(self.db.commitment.loaded)
+
+        self.db.update_with_block(block)
+
+        self.assertEqual(self.db.commitment.root(), expected)
+        self.assertEqual(self.db.commitment.rebuild(), expected)
+
+    def test_revert_drops_changes_commitment_took_in(self):
+        self.db.set('currency.balances:stu', b'100')
+        self.db.commit()
+        before = self.db.commitment.rebuild()
+
+        for sb in self.block_writing(1, {'currency.balances:stu': b'90'})['subBlocks']:
+            for tx in sb['transactions']:
+                self.db.set_transaction_data(tx)
+        self.db.commitment.save()
+
+        self.db.revert()
+
+        self.assertEqual(self.db.commitment.root(), before)
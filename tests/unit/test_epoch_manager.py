@@ -50,3 +50,13 @@ class TestEpochManager(TestCase):
         self.e.update_epoch_if_needed(block)
         self.assertEqual(self.e.get_epoch_hash(), b'x/AA' * 32)
         self.assertEqual(self.e.get_epoch_number(), 12)
+
+    def test_epoch_updates_from_block_dict(self):
+        block = {'blockNum': 200, 'blockHash': b'\x01' * 32}
+
+        self.assertTrue(self.e.update_epoch_if_needed(block))
+        self.assertEqual(self.e.get_epoch_hash(), b'\x01' * 32)
+        self.assertEqual(self.e.get_epoch_number(), 2)
+
+    def test_update_returns_false_if_not_needed(self):
+        self.assertFalse(self.e.update_epoch_if_needed({'blockNum': 201, 'blockHash': b'\x01' * 32}))
@@ -162,3 +162,35 @@ class TestLinkedHashTable(TestCase):
         self.assertEquals(lht._last.previous.previous.value, v)
         self.assertEquals(len(lht), 3)
 
+
+    def test_get_returns_value_or_default(self):
+        lht = LinkedHashTable()
+        lht.append('a', 1)
+
+        self.assertEqual(lht.get('a'), 1)
+        self.assertIsNone(lht.get('b'))
+        self.assertEqual(lht.get('b', 2), 2)
+
+    def test_peek_front_does_not_remove(self):
+        lht = LinkedHashTable()
+        self.assertEqual(lht.peek_front(), (None, None))
+
+        lht.append('a', 1)
+        lht.append('b', 2)
+
+        self.assertEqual(lht.peek_front(), ('a', 1))
+        self.assertEqual(len(lht), 2)
+
+    def test_items_front_to_back_allows_removal(self):
+        lht = LinkedHashTable()
+        for i in range(5):
+            lht.append(i, i * 10)
+
+        seen = []
+        for k, v in lht.items():
+            seen.append((k, v))
+            if k % 2 == 0:
+                lht.remove(k)
+
+        self.assertEqual(seen, [(i, i * 10) for i in range(5)])
+        self.assertEqual(list(lht.items()), [(1, 10), (3, 30)])
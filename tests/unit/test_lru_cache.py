@@ -0,0 +1,58 @@
+from unittest import TestCase
+from cilantro_ee.containers.lru import LRUCache
+
+
+class TestLRUCache(TestCase):
+    def test_get_missing_returns_default_and_counts_miss(self):
+        c = LRUCache()
+
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.get('a', 123), 123)
+        self.assertEqual(c.misses, 2)
+        self.assertEqual(c.hits, 0)
+
+    def test_set_then_get_counts_hit(self):
+        c = LRUCache()
+        c.set('a', 1)
+
+        self.assertEqual(c.get('a'), 1)
+        self.assertEqual(c.hits, 1)
+
+    def test_evicts_least_recently_used(self):
+        c = LRUCache(maxsize=2)
+        c.set('a', 1)
+        c.set('b', 2)
+
+        # Touch a so that b is the least recently used
+        c.get('a')
+        c.set('c', 3)
+
+        self.assertIn('a', c)
+        self.assertNotIn('b', c)
+        self.assertIn('c', c)
+        self.assertEqual(len(c), 2)
+
+    def test_set_existing_key_does_not_grow(self):
+        c = LRUCache(maxsize=2)
+        c.set('a', 1)
+        c.set('a', 2)
+
+        self.assertEqual(len(c), 1)
+        self.assertEqual(c.get('a'), 2)
+
+    def test_pop_removes_key(self):
+        c = LRUCache()
+        c.set('a', 1)
+
+        self.assertEqual(c.pop('a'), 1)
+        self.assertNotIn('a', c)
+
+    def test_clear_resets_counters(self):
+        c = LRUCache()
+        c.set('a', 1)
+        c.get('a')
+        c.get('b')
+
+        c.clear()
+
+        self.assertEqual(c.stats(), {'size': 0, 'maxsize': c.maxsize, 'hits': 0, 'misses': 0})
@@ -0,0 +1,80 @@
+from unittest import TestCase
+from cilantro_ee.nodes.masternode.masternode import Masternode
+from cilantro_ee.crypto.wallet import Wallet
+from contracting.client import ContractingClient
+import zmq.asyncio
+import asyncio
+
+mnw1 = Wallet()
+mnw2 = Wallet()
+
+dw1 = Wallet()
+dw2 = Wallet()
+
+constitution = {
+    "masternodes": {
+        "vk_list": [
+            mnw1.verifying_key().hex(),
+            mnw2.verifying_key().hex()
+        ],
+        "min_quorum": 1
+    },
+    "delegates": {
+        "vk_list": [
+            dw1.verifying_key().hex(),
+            dw2.verifying_key().hex()
+        ],
+        "min_quorum": 1
+    },
+    "witnesses": {},
+    "schedulers": {},
+    "notifiers": {},
+    "enable_stamps": False,
+    "enable_nonces": False
+}
+
+
+class TestMasternodeCatchup(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.ctx = zmq.asyncio.Context()
+
+        self.m = Masternode(
+            wallet=mnw1,
+            ctx=self.ctx,
+            socket_base='ipc:///tmp/n1',
+            bootnodes=['ipc:///tmp/n2'],
+            constitution=constitution,
+            webserver_port=8080,
+            overwrite=True
+        )
+
+    def tearDown(self):
+        self.ctx.destroy()
+        self.loop.close()
+        ContractingClient().flush()
+
+    def test_catchup_keeps_blocks(self):
+        self.assertIs(self.m.block_fetcher.blocks, self.m.blocks)
+
+    def test_catchup_stores_blocks_in_batches(self):
+        self.assertIsNotNone(self.m.block_fetcher.writer)
+        self.assertIs(self.m.block_fetcher.writer.storage, self.m.blocks)
+
+    def test_does_not_bootstrap_from_snapshot(self):
+        fetcher = self.m.block_fetcher
+        bootstrapped = []
+
+        async def bootstrap_from_snapshot():
+            bootstrapped.append(True)
+
+        async def find_missing_block_indexes():
+            return 0
+
+        fetcher.bootstrap_from_snapshot = bootstrap_from_snapshot
+        fetcher.find_missing_block_indexes = find_missing_block_indexes
+
+        self.loop.run_until_complete(fetcher.sync())
+
+        self.assertEqual(bootstrapped, [])
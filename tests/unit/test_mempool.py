@@ -0,0 +1,146 @@
+from unittest import TestCase
+from cilantro_ee.nodes.masternode.mempool import Mempool
+from cilantro_ee.crypto.transaction import TransactionBuilder, PackedTransaction, stamp_balance_key
+from cilantro_ee.crypto.wallet import Wallet
+from cilantro_ee.storage import BlockchainDriver
+import secrets
+
+PROCESSOR = secrets.token_bytes(32)
+
+
+def make_tx(w, nonce, stamps=0):
+    tx = TransactionBuilder(w.verifying_key(),
+                            contract='currency',
+                            function='transfer',
+                            kwargs={'amount': 10, 'to': 'jeff'},
+                            stamps=stamps,
+                            processor=PROCESSOR,
+                            nonce=nonce)
+    tx.sign(w.signing_key())
+    return PackedTransaction.from_bytes(tx.serialize())
+
+
+class TestMempool(TestCase):
+    def test_append_and_len(self):
+        m = Mempool()
+        tx = make_tx(Wallet(), 0)
+
+        self.assertTrue(m.append(tx))
+        self.assertEqual(len(m), 1)
+        self.assertIn(tx.hash, m)
+
+    def test_duplicates_are_dropped(self):
+        m = Mempool()
+        tx = make_tx(Wallet(), 0)
+
+        m.append(tx)
+
+        self.assertFalse(m.append(tx))
+        self.assertEqual(len(m), 1)
+
+    def test_append_notifies(self):
+        m = Mempool()
+        woken = []
+        m.notifier.notify = lambda: woken.append(True)
+
+        m.append(make_tx(Wallet(), 0))
+
+        self.assertEqual(woken, [True])
+
+    def test_pop_batch_keeps_sender_nonce_order(self):
+        m = Mempool()
+        w = Wallet()
+        txs = [make_tx(w, i) for i in range(5)]
+        m.extend(txs)
+
+        batch = m.pop_batch(10)
+
+        self.assertEqual([tx.payload.nonce for tx in batch], [0, 1, 2, 3, 4])
+        self.assertEqual(len(m), 0)
+        self.assertEqual(len(m.lanes), 0)
+
+    def test_pop_batch_respects_tx_per_block(self):
+        m = Mempool(tx_per_block=3)
+        w = Wallet()
+        m.extend([make_tx(w, i) for i in range(5)])
+
+        self.assertEqual(len(m.pop_batch(10)), 3)
+        self.assertEqual([tx.payload.nonce for tx in m.pop_batch(10)], [3, 4])
+
+    def test_pop_batch_round_robins_senders(self):
+        m = Mempool(tx_per_block=2)
+        a, b = Wallet(), Wallet()
+        m.extend([make_tx(a, i) for i in range(4)])
+        m.extend([make_tx(b, i) for i in range(4)])
+
+        batch = m.pop_batch(3)
+
+        senders = [tx.payload.sender for tx in batch]
+        self.assertEqual(senders, [a.verifying_key(), a.verifying_key(), b.verifying_key()])
+
+        # Both went to the back of the line after their turn, a first
+        batch = m.pop_batch(4)
+        senders = [tx.payload.sender for tx in batch]
+        self.assertEqual(senders, [a.verifying_key(), a.verifying_key(), b.verifying_key(), b.verifying_key()])
+
+    def test_remove(self):
+        m = Mempool()
+        w = Wallet()
+        txs = [make_tx(w, i) for i in range(3)]
+        m.extend(txs)
+
+        m.remove(txs[1].hash)
+
+        self.assertEqual([tx.payload.nonce for tx in m.pop_batch(10)], [0, 2])
+
+    def test_remove_last_drops_lane(self):
+        m = Mempool()
+        tx = make_tx(Wallet(), 0)
+        m.append(tx)
+
+        m.remove(tx.hash)
+
+        self.assertEqual(len(m.lanes), 0)
+        self.assertEqual(len(m.senders), 0)
+
+
+class TestMempoolEviction(TestCase):
+    def setUp(self):
+        self.driver = BlockchainDriver()
+        self.driver.flush()
+
+    def tearDown(self):
+        self.driver.flush()
+
+    def test_evicts_used_nonces(self):
+        m = Mempool()
+        w = Wallet()
+        m.extend([make_tx(w, i) for i in range(4)])
+
+        self.driver.set_nonce(PROCESSOR, w.verifying_key(), 2)
+
+        evicted = m.evict(self.driver, [w.verifying_key()])
+
+        self.assertEqual(evicted, 2)
+        self.assertEqual([tx.payload.nonce for tx in m.pop_batch(10)], [2, 3])
+
+    def test_evicts_underfunded(self):
+        m = Mempool()
+        w = Wallet()
+        m.append(make_tx(w, 0, stamps=100))
+        m.append(make_tx(w, 1, stamps=10))
+
+        self.driver.set(stamp_balance_key(w.verifying_key()), 50)
+
+        evicted = m.evict(self.driver, [w.verifying_key()])
+
+        self.assertEqual(evicted, 1)
+        self.assertEqual([tx.payload.nonce for tx in m.pop_batch(10)], [1])
+
+    def test_only_given_senders_are_checked(self):
+        m = Mempool()
+        w = Wallet()
+        m.append(make_tx(w, 0, stamps=100))
+
+        self.assertEqual(m.evict(self.driver, [Wallet().verifying_key()]), 0)
+        self.assertEqual(len(m), 1)
@@ -1,5 +1,5 @@
 from unittest import TestCase
-from cilantro_ee.storage.master import MasterStorage
+from cilantro_ee.storage.master import MasterStorage, StorageIndexError, BatchWriter
 from cilantro_ee.crypto import wallet
 
 
@@ -293,3 +293,111 @@ class TestMasterDatabase(TestCase):
         nums = [block['blockNum'] for block in blocks]
 
         self.assertEqual(nums, [5, 4, 3, 2, 1, 0])
+
+    def test_indexes_created(self):
+        keys = [index['key'] for index in self.db.blocks.collection.index_information().values()]
+
+        self.assertIn([('blockNum', 1)], keys)
+        self.assertIn([('blockHash', 1)], keys)
+
+        keys = [index['key'] for index in self.db.txs.collection.index_information().values()]
+
+        self.assertIn([('tx_hash', 1)], keys)
+
+    def test_indexes_recreated_after_drop(self):
+        self.db.drop_collections()
+
+        self.db.blocks.verify_indexes()
+        self.db.indexes.verify_indexes()
+
+    def test_verify_indexes_fails_if_index_missing(self):
+        self.db.blocks.collection.drop_indexes()
+
+        with self.assertRaises(StorageIndexError):
+            self.db.blocks.verify_indexes()
+
+    def test_storing_block_number_twice_returns_false(self):
+        block = {
+            'blockNum': 1,
+            'blockHash': 'a'
+        }
+
+        self.assertTrue(self.db.put(dict(block)))
+        self.assertFalse(self.db.put(dict(block)))
+
+    def test_storage_sets_share_one_client(self):
+        self.assertIs(self.db.blocks.client, self.db.indexes.client)
+        self.assertIs(self.db.blocks.client, self.db.txs.client)
+        self.assertIs(self.db.blocks.client, MasterStorage().blocks.client)
+
+    def test_query_stats_count_queries(self):
+        self.db.blocks.latency.reset()
+
+        self.db.get_block(0)
+        self.db.get_block(0)
+
+        stats = self.db.query_stats()['blocks']['find_one']
+
+        self.assertEqual(stats['count'], 2)
+        self.assertGreaterEqual(stats['max_ms'], stats['mean_ms'])
+
+    def test_put_blocks_stores_blocks_and_index(self):
+        blocks = [{'blockNum': i, 'blockHash': str(i), 'blockOwners': ['stu'], 'subBlocks': []} for i in range(1, 4)]
+
+        self.db.put_blocks(blocks)
+
+        self.assertEqual(self.db.get_block(2)['blockHash'], '2')
+        self.assertEqual(self.db.get_owners(3), ['stu'])
+
+    def test_put_blocks_skips_blocks_already_stored(self):
+        self.db.put({'blockNum': 1, 'blockHash': 'a'})
+
+        blocks = [{'blockNum': i, 'blockHash': str(i), 'subBlocks': []} for i in range(1, 4)]
+        self.db.put_blocks(blocks)
+
+        self.assertEqual(self.db.get_block(1)['blockHash'], 'a')
+        self.assertEqual(self.db.get_block(3)['blockHash'], '3')
+
+    def test_get_blocks_range_in_order(self):
+        for i in [3, 1, 2, 5]:
+            self.db.put({'blockNum': i, 'blockHash': str(i)})
+
+        self.assertEqual([b['blockNum'] for b in self.db.get_blocks(1, 4)], [1, 2, 3])
+        self.assertNotIn('_id', self.db.get_blocks(1, 1)[0])
+
+
+class FakeStorage:
+    def __init__(self):
+        self.batches = []
+
+    def put_blocks(self, blocks):
+        self.batches.append(blocks)
+
+
+class TestBatchWriter(TestCase):
+    def test_flushes_every_batch_size_blocks(self):
+        storage = FakeStorage()
+        writer = BatchWriter(storage, batch_size=2)
+
+        for i in range(5):
+            writer.put({'blockNum': i})
+
+        self.assertEqual([len(b) for b in storage.batches], [2, 2])
+        self.assertEqual(len(writer), 1)
+
+    def test_flush_writes_rest(self):
+        storage = FakeStorage()
+        writer = BatchWriter(storage, batch_size=2)
+
+        writer.put({'blockNum': 0})
+        writer.flush()
+
+        self.assertEqual(len(storage.batches), 1)
+        self.assertEqual(len(writer), 0)
+
+    def test_flush_with_nothing_buffered_writes_nothing(self):
+        storage = FakeStorage()
+        BatchWriter(storage).flush()
+
+        self.assertEqual(storage.batches, [])
+
@@ -0,0 +1,124 @@
+from unittest import TestCase
+from cilantro_ee.containers.notifying_queue import Notifier, NotifyingQueue
+import asyncio
+
+
+class TestNotifier(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_wait_for_returns_immediately_if_predicate_true(self):
+        n = Notifier()
+
+        res = self.loop.run_until_complete(n.wait_for(lambda: True))
+
+        self.assertTrue(res)
+
+    def test_wait_for_wakes_up_on_notify(self):
+        n = Notifier()
+        items = []
+
+        async def produce():
+            await asyncio.sleep(0.05)
+            items.append(1)
+            n.notify()
+
+        tasks = asyncio.gather(
+            n.wait_for(lambda: len(items) > 0, timeout=1),
+            produce()
+        )
+
+        res, _ = self.loop.run_until_complete(tasks)
+
+        self.assertTrue(res)
+
+    def test_wait_for_returns_false_after_timeout(self):
+        n = Notifier()
+
+        res = self.loop.run_until_complete(n.wait_for(lambda: False, timeout=0.05))
+
+        self.assertFalse(res)
+
+    def test_notify_without_predicate_change_keeps_waiting(self):
+        n = Notifier()
+        items = []
+
+        async def produce():
+            await asyncio.sleep(0.01)
+            n.notify()
+            await asyncio.sleep(0.01)
+            items.append(1)
+            n.notify()
+
+        tasks = asyncio.gather(
+            n.wait_for(lambda: len(items) > 0, timeout=1),
+            produce()
+        )
+
+        res, _ = self.loop.run_until_complete(tasks)
+
+        self.assertTrue(res)
+        self.assertEqual(len(n._waiters), 0)
+
+
+class TestNotifyingQueue(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_behaves_like_list(self):
+        q = NotifyingQueue()
+
+        q.append(1)
+        q.extend([2, 3])
+        q.insert(0, 0)
+
+        self.assertEqual(q, [0, 1, 2, 3])
+        self.assertEqual(q.pop(0), 0)
+
+        q.clear()
+        self.assertEqual(len(q), 0)
+
+    def test_append_wakes_waiter(self):
+        q = NotifyingQueue()
+
+        async def produce():
+            await asyncio.sleep(0.05)
+            q.append(b'howdy')
+
+        tasks = asyncio.gather(
+            q.wait_for_items(timeout=1),
+            produce()
+        )
+
+        res, _ = self.loop.run_until_complete(tasks)
+
+        self.assertTrue(res)
+        self.assertEqual(q.pop(0), b'howdy')
+
+    def test_shared_notifier_wakes_on_either_queue(self):
+        n = Notifier()
+        a = NotifyingQueue(notifier=n)
+        b = NotifyingQueue(notifier=n)
+
+        async def produce():
+            await asyncio.sleep(0.05)
+            b.append(1)
+
+        tasks = asyncio.gather(
+            n.wait_for(lambda: len(a) > 0 or len(b) > 0, timeout=1),
+            produce()
+        )
+
+        res, _ = self.loop.run_until_complete(tasks)
+
+        self.assertTrue(res)
+        self.assertEqual(len(a), 0)
+        self.assertEqual(len(b), 1)
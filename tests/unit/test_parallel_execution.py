@@ -0,0 +1,247 @@
+from unittest import TestCase
+from cilantro_ee.nodes.delegate import execution
+from cilantro_ee.storage import BlockchainDriver
+from cilantro_ee.crypto.wallet import Wallet
+from cilantro_ee.crypto.transaction import TransactionBuilder
+from cilantro_ee.crypto.transaction_batch import transaction_list_to_transaction_batch
+from contracting.client import ContractingClient
+from contracting.execution.executor import Executor
+import heapq
+
+test_contract = '''
+v = Variable()
+w = Variable()
+
+@construct
+def seed():
+    v.set('hello')
+    w.set('hello')
+
+@export
+def set_v(var):
+    v.set(var)
+
+@export
+def set_w(var):
+    w.set(var)
+
+@export
+def copy_v_to_w():
+    w.set(v.get())
+'''
+
+
+def tx_for(function, kwargs):
+    tx = TransactionBuilder(
+        sender='stu',
+        contract='testing',
+        function=function,
+        kwargs=kwargs,
+        stamps=100_000,
+        processor=b'\x00' * 32,
+        nonce=0
+    )
+    tx.sign(Wallet().signing_key())
+    tx.serialize()
+
+    return tx.struct
+
+
+def work_for(batches):
+    work = []
+    for b in batches:
+        heapq.heappush(work, (b.timestamp, b))
+    return work
+
+
+class TestParallelExecution(TestCase):
+    def setUp(self):
+        self.client = ContractingClient()
+        self.client.submit(test_contract, name='testing')
+
+        self.driver = BlockchainDriver()
+        self.executor = Executor(driver=self.driver)
+        self.pool = execution.make_execution_pool(2)
+
+    def tearDown(self):
+        self.pool.terminate()
+        self.client.flush()
+
+    def execute(self, batches, pool=None, speculative=False):
+        sbcs = execution.execute_work(
+            executor=self.executor,
+            driver=self.driver,
+            work=work_for(batches),
+            wallet=Wallet(seed=b'\x00' * 32),
+            previous_block_hash=b'\x00' * 32,
+            pool=pool,
+            speculative=speculative
+        )
+
+        self.driver.revert()
+
+        # Everything in the subblock, down to the state and status of each transaction
+        return [sbc.to_dict() for sbc in sbcs]
+
+    def test_conflicts_with(self):
+        self.assertTrue(execution.conflicts_with({'a', 'b'}, {'b'}))
+        self.assertFalse(execution.conflicts_with({'a', 'b'}, {'c'}))
+
+    def test_prefix_reads_conflict_with_keys_written_under_them(self):
+        self.assertTrue(execution.conflicts_with(set(), {'testing.h:stu'}, {'testing.h:'}))
+        self.assertFalse(execution.conflicts_with(set(), {'testing.v'}, {'testing.h:'}))
+
+    def test_driver_records_every_kind_of_read(self):
+        driver = execution.ReadRecordingDriver()
+
+        driver.get('testing.v')
+        driver.get_direct('testing.w')
+        driver.get_many(['testing.x', 'testing.y'])
+        driver.iter('testing.h:')
+        driver.keys('testing.k*')
+
+        for key in ['testing.v', 'testing.w', 'testing.x', 'testing.y']:
+            self.assertIn(key, driver.reads)
+
+        self.assertIn('testing.h:', driver.prefix_reads)
+        self.assertIn('testing.k', driver.prefix_reads)
+
+    def test_independent_batches_match_serial_execution(self):
+        w = Wallet()
+        batches = [
+            transaction_list_to_transaction_batch([tx_for('set_v', {'var': 'howdy'})], wallet=w),
+            transaction_list_to_transaction_batch([tx_for('set_w', {'var': 'there'})], wallet=w)
+        ]
+
+        serial = self.execute(batches)
+        parallel = self.execute(batches, pool=self.pool)
+
+        self.assertListEqual(serial, parallel)
+
+    def test_conflicting_batches_match_serial_execution(self):
+        w = Wallet()
+        batches = [
+            transaction_list_to_transaction_batch([tx_for('set_v', {'var': 'howdy'})], wallet=w),
+            transaction_list_to_transaction_batch([tx_for('copy_v_to_w', {})], wallet=w)
+        ]
+
+        serial = self.execute(batches)
+        parallel = self.execute(batches, pool=self.pool)
+
+        self.assertListEqual(serial, parallel)
+
+    def test_merged_writes_are_visible_in_driver(self):
+        w = Wallet()
+        batches = [
+            transaction_list_to_transaction_batch([tx_for('set_v', {'var': 'howdy'})], wallet=w),
+            transaction_list_to_transaction_batch([tx_for('set_w', {'var': 'there'})], wallet=w)
+        ]
+
+        execution.execute_work(
+            executor=self.executor,
+            driver=self.driver,
+            work=work_for(batches),
+            wallet=w,
+            previous_block_hash=b'\x00' * 32,
+            pool=self.pool
+        )
+
+        self.assertEqual(self.driver.get('testing.v'), 'howdy')
+        self.assertEqual(self.driver.get('testing.w'), 'there')
+
+    def test_speculative_independent_txs_match_serial_execution(self):
+        w = Wallet()
+        batches = [
+            transaction_list_to_transaction_batch([
+                tx_for('set_v', {'var': 'howdy'}),
+                tx_for('set_w', {'var': 'there'})
+            ], wallet=w)
+        ]
+
+        serial = self.execute(batches)
+        speculative = self.execute(batches, pool=self.pool, speculative=True)
+
+        self.assertListEqual(serial, speculative)
+
+    def test_speculative_conflicting_txs_match_serial_execution(self):
+        w = Wallet()
+        batches = [
+            transaction_list_to_transaction_batch([
+                tx_for('set_v', {'var': 'howdy'}),
+                tx_for('copy_v_to_w', {})
+            ], wallet=w)
+        ]
+
+        serial = self.execute(batches)
+        speculative = self.execute(batches, pool=self.pool, speculative=True)
+
+        self.assertListEqual(serial, speculative)
+
+    def test_speculative_same_chunk_dependency_is_not_executed_again(self):
+        w = Wallet()
+        batches = [
+            transaction_list_to_transaction_batch([
+                tx_for('set_v', {'var': 'howdy'}),
+                tx_for('copy_v_to_w', {})
+            ], wallet=w)
+        ]
+
+        serial = self.execute(batches)
+
+        # Transactions executed in this process rather than the pool. One chunk holds both transactions
+        executed = []
+        execute_tx = execution.execute_tx
+        execution.execute_tx = lambda *args, **kwargs: executed.append(args) or execute_tx(*args, **kwargs)
+
+        try:
+            sbcs = execution.execute_work(
+                executor=self.executor,
+                driver=self.driver,
+                work=work_for(batches),
+                wallet=Wallet(seed=b'\x00' * 32),
+                previous_block_hash=b'\x00' * 32,
+                parallelism=1,
+                pool=self.pool,
+                speculative=True
+            )
+        finally:
+            execution.execute_tx = execute_tx
+
+        self.driver.revert()
+
+        self.assertEqual(executed, [])
+        self.assertListEqual(serial, [sbc.to_dict() for sbc in sbcs])
+
+    def test_speculative_sees_writes_of_earlier_batches(self):
+        w = Wallet()
+        batches = [
+            transaction_list_to_transaction_batch([tx_for('set_v', {'var': 'howdy'})], wallet=w),
+            transaction_list_to_transaction_batch([tx_for('copy_v_to_w', {})], wallet=w)
+        ]
+
+        serial = self.execute(batches)
+        speculative = self.execute(batches, pool=self.pool, speculative=True)
+
+        self.assertListEqual(serial, speculative)
+
+    def test_speculative_writes_are_visible_in_driver(self):
+        w = Wallet()
+        batches = [
+            transaction_list_to_transaction_batch([
+                tx_for('set_v', {'var': 'howdy'}),
+                tx_for('copy_v_to_w', {})
+            ], wallet=w)
+        ]
+
+        execution.execute_work(
+            executor=self.executor,
+            driver=self.driver,
+            work=work_for(batches),
+            wallet=w,
+            previous_block_hash=b'\x00' * 32,
+            pool=self.pool,
+            speculative=True
+        )
+
+        self.assertEqual(self.driver.get('testing.v'), 'howdy')
+        self.assertEqual(self.driver.get('testing.w'), 'howdy')
@@ -21,6 +21,10 @@ class MockContacts:
         self.masternodes = masters
         self.delegates = delegates
 
+        self.masternode_set = frozenset(masters)
+        self.delegate_set = frozenset(delegates)
+        self.core_node_set = frozenset(masters + delegates)
+
 class TestParameters(TestCase):
     def setUp(self):
         self.ctx = zmq.asyncio.Context()
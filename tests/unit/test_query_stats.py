@@ -0,0 +1,40 @@
+from unittest import TestCase
+from cilantro_ee.storage.latency import QueryStats
+
+
+class TestQueryStats(TestCase):
+    def test_record_aggregates_per_op(self):
+        stats = QueryStats('blocks')
+
+        stats.record('find_one', 2)
+        stats.record('find_one', 4)
+        stats.record('insert', 1)
+
+        s = stats.stats()
+
+        self.assertEqual(s['find_one'], {'count': 2, 'mean_ms': 3, 'max_ms': 4})
+        self.assertEqual(s['insert']['count'], 1)
+
+    def test_timed_records_op(self):
+        stats = QueryStats('blocks')
+
+        with stats.timed('find_one'):
+            pass
+
+        self.assertEqual(stats.stats()['find_one']['count'], 1)
+
+    def test_timed_records_op_that_raises(self):
+        stats = QueryStats('blocks')
+
+        with self.assertRaises(ValueError):
+            with stats.timed('insert'):
+                raise ValueError
+
+        self.assertEqual(stats.stats()['insert']['count'], 1)
+
+    def test_reset(self):
+        stats = QueryStats('blocks')
+        stats.record('find_one', 1)
+        stats.reset()
+
+        self.assertEqual(stats.stats(), {})
@@ -0,0 +1,76 @@
+from unittest import TestCase
+from cilantro_ee.core.rounds import RoundScheduler, Stage, DEFAULT_DEADLINES
+import asyncio
+
+
+class TestRoundScheduler(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_default_deadlines_used(self):
+        r = RoundScheduler()
+
+        for stage in Stage.ALL:
+            self.assertEqual(r.deadline(stage), DEFAULT_DEADLINES[stage])
+
+    def test_deadlines_can_be_overridden(self):
+        r = RoundScheduler(deadlines={Stage.WORK: 123})
+
+        self.assertEqual(r.deadline(Stage.WORK), 123)
+        self.assertEqual(r.timeout(Stage.WORK), 0.123)
+        self.assertEqual(r.deadline(Stage.NBN), DEFAULT_DEADLINES[Stage.NBN])
+
+    def test_measure_records_timing(self):
+        r = RoundScheduler()
+
+        with r.measure(Stage.EXECUTION):
+            pass
+
+        self.assertEqual(len(r.timings[Stage.EXECUTION]), 1)
+        self.assertEqual(r.overruns[Stage.EXECUTION], 0)
+
+    def test_record_over_deadline_counts_overrun(self):
+        r = RoundScheduler(deadlines={Stage.EXECUTION: 10})
+
+        r.record(Stage.EXECUTION, 11)
+
+        self.assertEqual(r.overruns[Stage.EXECUTION], 1)
+
+    def test_run_with_deadline_returns_result(self):
+        r = RoundScheduler()
+
+        async def work():
+            return 'howdy'
+
+        res = self.loop.run_until_complete(r.run_with_deadline(Stage.NBN, work()))
+
+        self.assertEqual(res, 'howdy')
+
+    def test_run_with_deadline_returns_default_on_timeout(self):
+        r = RoundScheduler(deadlines={Stage.NBN: 10})
+
+        async def work():
+            await asyncio.sleep(1)
+            return 'howdy'
+
+        res = self.loop.run_until_complete(r.run_with_deadline(Stage.NBN, work(), default=[]))
+
+        self.assertEqual(res, [])
+        self.assertEqual(r.overruns[Stage.NBN], 1)
+
+    def test_stats_only_has_measured_stages(self):
+        r = RoundScheduler()
+
+        r.record(Stage.WORK, 5)
+        r.record(Stage.WORK, 15)
+
+        stats = r.stats()
+
+        self.assertEqual(list(stats.keys()), [Stage.WORK])
+        self.assertEqual(stats[Stage.WORK]['last'], 15)
+        self.assertEqual(stats[Stage.WORK]['mean'], 10)
+        self.assertEqual(stats[Stage.WORK]['max'], 15)
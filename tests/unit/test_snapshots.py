@@ -0,0 +1,221 @@
+from unittest import TestCase
+from cilantro_ee.core.snapshots import make_snapshot, make_snapshot_from, copy_state, restore_snapshot, \
+    verify_manifest, verify_chunk, decode_chunk, SnapshotStore, SnapshotError
+from cilantro_ee.storage.contract import PENDING_NONCE_KEY, NONCE_KEY
+from cilantro_ee.storage.commitment import STATE_ROOT_KEY, state_root
+from cilantro_ee.core.top import BLOCK_HASH_KEY as TOP_HASH_KEY
+import tempfile
+import shutil
+import os
+
+
+class DictDriver:
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+
+    def iter(self, prefix):
+        return [k for k in self.data if k.startswith(prefix)]
+
+    def get_direct(self, key):
+        return self.data.get(key)
+
+    def get_many(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def set_direct(self, key, value):
+        self.data[key] = value
+
+    def set_many(self, values):
+        for key, value in values.items():
+            if value is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+
+
+def make_state(n):
+    return {'currency.balances:{:06d}'.format(i): str(i * 10).encode() for i in range(n)}
+
+
+class TestMakeSnapshot(TestCase):
+    def test_snapshot_restores_to_same_state(self):
+        source = DictDriver(make_state(1000))
+        manifest, chunks = make_snapshot(source, 1, 100, b'\x01' * 32, chunk_bytes=1024)
+
+        target = DictDriver()
+        restored = restore_snapshot(target, manifest, chunks)
+
+        self.assertEqual(restored, 1000)
+        self.assertEqual(target.data, source.data)
+
+    def test_restore_replaces_existing_state(self):
+        source = DictDriver(make_state(100))
+        manifest, chunks = make_snapshot(source, 1, 100, b'\x01' * 32)
+
+        target = DictDriver({'currency.balances:000001': b'stale', 'currency.balances:999999': b'gone',
+                             PENDING_NONCE_KEY + ':aa:bb': b'1'})
+        restore_snapshot(target, manifest, chunks)
+
+        expected = dict(source.data)
+        expected[PENDING_NONCE_KEY + ':aa:bb'] = b'1'
+
+        self.assertEqual(target.data, expected)
+
+    def test_restore_is_written_in_batches(self):
+        manifest, chunks = make_snapshot(DictDriver(make_state(1000)), 1, 100, b'\x01' * 32)
+
+        target = DictDriver()
+        writes = []
+
+        set_many = target.set_many
+        target.set_many = lambda values: writes.append(len(values)) or set_many(values)
+
+        restore_snapshot(target, manifest, chunks, batch=300)
+
+        self.assertEqual(writes, [300, 300, 300, 100])
+        self.assertEqual(target.data, make_state(1000))
+
+    def test_state_is_split_into_chunks(self):
+        manifest, chunks = make_snapshot(DictDriver(make_state(1000)), 1, 100, b'\x01' * 32, chunk_bytes=1024)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(len(manifest['chunkHashes']), len(chunks))
+        self.assertEqual(manifest['entries'], 1000)
+
+    def test_chunks_are_sorted_by_key(self):
+        _, chunks = make_snapshot(DictDriver(make_state(100)), 1, 100, b'\x01' * 32, chunk_bytes=256)
+
+        keys = [k for chunk in chunks for k, _ in decode_chunk(chunk)]
+
+        self.assertEqual(keys, sorted(keys))
+
+    def test_same_state_makes_same_root(self):
+        a, _ = make_snapshot(DictDriver(make_state(100)), 1, 100, b'\x01' * 32)
+        b, _ = make_snapshot(DictDriver(dict(reversed(list(make_state(100).items())))), 1, 100, b'\x01' * 32)
+
+        self.assertEqual(a['root'], b['root'])
+
+    def test_root_commits_to_block(self):
+        a, _ = make_snapshot(DictDriver(make_state(100)), 1, 100, b'\x01' * 32)
+        b, _ = make_snapshot(DictDriver(make_state(100)), 1, 101, b'\x01' * 32)
+
+        self.assertNotEqual(a['root'], b['root'])
+
+    def test_node_local_keys_are_left_out(self):
+        state = make_state(10)
+        state[PENDING_NONCE_KEY + ':aa:bb'] = b'1'
+        state[TOP_HASH_KEY] = b'\x02' * 32
+        state[NONCE_KEY + ':aa:bb'] = b'3'
+        state[STATE_ROOT_KEY + ':1'] = b'\x04' * 32
+
+        _, chunks = make_snapshot(DictDriver(state), 1, 100, b'\x01' * 32)
+        keys = {k for chunk in chunks for k, _ in decode_chunk(chunk)}
+
+        self.assertNotIn(PENDING_NONCE_KEY + ':aa:bb', keys)
+        self.assertNotIn(TOP_HASH_KEY, keys)
+        self.assertNotIn(STATE_ROOT_KEY + ':1', keys)
+        self.assertIn(NONCE_KEY + ':aa:bb', keys)
+
+
+class TestCopyState(TestCase):
+    def test_copy_is_read_in_batches(self):
+        driver = DictDriver(make_state(1000))
+        reads = []
+
+        get_many = driver.get_many
+        driver.get_many = lambda keys: reads.append(len(keys)) or get_many(keys)
+
+        entries = copy_state(driver, batch=300)
+
+        self.assertEqual(reads, [300, 300, 300, 100])
+        self.assertEqual(entries, [[k, v] for k, v in sorted(make_state(1000).items())])
+
+    def test_snapshot_from_copy_ignores_later_changes(self):
+        driver = DictDriver(make_state(100))
+        entries = copy_state(driver)
+
+        driver.data['currency.balances:000001'] = b'changed'
+        driver.data['currency.balances:999999'] = b'new'
+
+        manifest, chunks = make_snapshot_from(entries, 1, 100, b'\x01' * 32, chunk_bytes=256)
+
+        target = DictDriver()
+        restore_snapshot(target, manifest, chunks)
+
+        self.assertEqual(target.data, make_state(100))
+
+
+class TestVerifySnapshot(TestCase):
+    def setUp(self):
+        self.manifest, self.chunks = make_snapshot(DictDriver(make_state(500)), 1, 100, b'\x01' * 32,
+                                                   chunk_bytes=1024)
+
+    def test_verify_manifest(self):
+        self.assertTrue(verify_manifest(self.manifest))
+
+        self.manifest['blockNum'] = 99
+        self.assertFalse(verify_manifest(self.manifest))
+
+    def test_verify_chunk(self):
+        self.assertTrue(verify_chunk(self.manifest, 0, self.chunks[0]))
+        self.assertFalse(verify_chunk(self.manifest, 1, self.chunks[0]))
+        self.assertFalse(verify_chunk(self.manifest, len(self.chunks), self.chunks[0]))
+
+    def test_tampered_chunk_is_not_restored(self):
+        self.chunks[1] = self.chunks[1][:-1] + b'\x00'
+        target = DictDriver()
+
+        with self.assertRaises(SnapshotError):
+            restore_snapshot(target, self.manifest, self.chunks)
+
+        self.assertEqual(target.data, {})
+
+    def test_restore_checks_state_root(self):
+        target = DictDriver()
+        restored = restore_snapshot(target, self.manifest, self.chunks, state_root=state_root(make_state(500).items()))
+
+        self.assertEqual(restored, 500)
+
+    def test_state_not_matching_state_root_is_not_restored(self):
+        target = DictDriver()
+
+        with self.assertRaises(SnapshotError):
+            restore_snapshot(target, self.manifest, self.chunks, state_root=state_root(make_state(499).items()))
+
+        self.assertEqual(target.data, {})
+
+    def test_missing_chunk_is_not_restored(self):
+        with self.assertRaises(SnapshotError):
+            restore_snapshot(DictDriver(), self.manifest, self.chunks[:-1])
+
+
+class TestSnapshotStore(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = SnapshotStore(self.path, kept=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_no_snapshot(self):
+        self.assertIsNone(self.store.latest())
+        self.assertIsNone(self.store.chunk(1, 0))
+
+    def test_take_and_read_back(self):
+        manifest = self.store.take(DictDriver(make_state(100)), 3, 300, b'\x01' * 32)
+
+        self.assertEqual(self.store.latest(), manifest)
+        self.assertTrue(verify_chunk(manifest, 0, self.store.chunk(3, 0)))
+
+    def test_old_snapshots_are_deleted(self):
+        for epoch in range(1, 5):
+            self.store.take(DictDriver(make_state(10)), epoch, epoch * 100, b'\x01' * 32)
+
+        self.assertEqual(self.store.epochs(), [3, 4])
+        self.assertEqual(self.store.latest()['epoch'], 4)
+
+    def test_unfinished_snapshot_is_ignored(self):
+        self.store.take(DictDriver(make_state(10)), 1, 100, b'\x01' * 32)
+        os.makedirs(self.store.epoch_path(2) + '.tmp')
+
+        self.assertEqual(self.store.latest()['epoch'], 1)
@@ -0,0 +1,237 @@
+from unittest import TestCase
+from cilantro_ee.storage.commitment import StateCommitment, STATE_ROOT_KEY, BUCKET_BYTES, bucket_key, leaf, add, \
+    subtract, pack_bucket, unpack_bucket
+import random
+
+_DELETED = object()
+
+
+class MemoryDriver:
+    # Writes are buffered until commit, like the contract driver's
+    def __init__(self):
+        self.data = {}
+        self.pending = {}
+
+    def get(self, key):
+        value = self.pending.get(key, self.data.get(key))
+        return None if value is _DELETED else value
+
+    def get_many(self, keys):
+        return [self.get(k) for k in keys]
+
+    def set(self, key, value):
+        self.pending[key] = value
+
+    def delete(self, key):
+        self.pending[key] = _DELETED
+
+    def iter(self, prefix):
+        keys = set(self.data) | set(self.pending)
+        return sorted(k for k in keys if k.startswith(prefix) and self.get(k) is not None)
+
+    def commit(self):
+        for key, value in self.pending.items():
+            if value is _DELETED:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+        self.pending = {}
+
+    def revert(self):
+        self.pending = {}
+
+
+def make_state(n):
+    return {'currency.balances:{}'.format(i): str(i).encode() for i in range(n)}
+
+
+def tracked_driver(state, buckets=64):
+    driver = MemoryDriver()
+    for k, v in state.items():
+        driver.set(k, v)
+    driver.commit()
+
+    StateCommitment(driver, buckets=buckets).rebuild()
+
+    return driver
+
+
+def rebuilt_root(state, buckets=64):
+    driver = tracked_driver(state, buckets)
+    return driver.get(STATE_ROOT_KEY)
+
+
+class TestBucketHash(TestCase):
+    def test_leaves_come_out_in_any_order(self):
+        leaves = [leaf('currency.balances:{}'.format(i), b'1') for i in range(10)]
+
+        acc = 0
+        for l in leaves:
+            acc = add(acc, l)
+
+        self.assertNotEqual(acc, 0)
+
+        for l in reversed(leaves):
+            acc = subtract(acc, l)
+
+        self.assertEqual(acc, 0)
+
+    def test_lanes_wrap_around_on_their_own(self):
+        a = unpack_bucket(b'\xff\xff' * (BUCKET_BYTES // 2))
+        b = unpack_bucket(b'\x01\x00' * (BUCKET_BYTES // 2))
+
+        self.assertEqual(pack_bucket(add(a, b)), bytes(BUCKET_BYTES))
+        self.assertEqual(pack_bucket(subtract(0, b)), b'\xff\xff' * (BUCKET_BYTES // 2))
+
+    def test_pack_round_trips(self):
+        acc = leaf('currency.balances:stu', b'100')
+
+        self.assertEqual(len(pack_bucket(acc)), BUCKET_BYTES)
+        self.assertEqual(unpack_bucket(pack_bucket(acc)), acc)
+
+
+class TestStateCommitment(TestCase):
+    def test_untracked_state_has_no_root(self):
+        c = StateCommitment(MemoryDriver(), buckets=64)
+
+        c.update('currency.balances:stu', b'1')
+
+        self.assertIsNone(c.root())
+        self.assertIsNone(c.root_after([('currency.balances:stu', b'1')]))
+        self.assertIsNone(c.save())
+
+    def test_rebuild_does_not_depend_on_order(self):
+        state = make_state(100)
+
+        self.assertEqual(rebuilt_root(state), rebuilt_root(dict(reversed(list(state.items())))))
+
+    def test_different_state_different_root(self):
+        state = make_state(100)
+        other = dict(state)
+        other['currency.balances:5'] = b'6'
+
+        self.assertNotEqual(rebuilt_root(state), rebuilt_root(other))
+
+    def test_internal_keys_are_not_committed_to(self):
+        state = make_state(10)
+        other = dict(state)
+        other['__n:aa:bb'] = b'1'
+        other['_current_block_num'] = b'5'
+
+        self.assertEqual(rebuilt_root(state), rebuilt_root(other))
+
+    def test_updates_match_rebuild(self):
+        state = make_state(200)
+        driver = tracked_driver(state)
+        c = StateCommitment(driver, buckets=64)
+
+        rng = random.Random(0)
+        for _ in range(50):
+            key = 'currency.balances:{}'.format(rng.randrange(300))
+            value = str(rng.randrange(1000)).encode()
+
+            c.update(key, value)
+            driver.set(key, value)
+            state[key] = value
+
+            self.assertEqual(c.root(), rebuilt_root(state))
+
+    def test_deleted_key_is_taken_out(self):
+        state = make_state(20)
+        driver = tracked_driver(state)
+        c = StateCommitment(driver, buckets=64)
+
+        c.update('currency.balances:3', None)
+        driver.delete('currency.balances:3')
+        del state['currency.balances:3']
+
+        self.assertEqual(c.root(), rebuilt_root(state))
+
+    def test_root_after_changes_nothing(self):
+        state = make_state(20)
+        driver = tracked_driver(state)
+        c = StateCommitment(driver, buckets=64)
+        before = c.root()
+
+        deltas = [('currency.balances:1', b'5'), (b'currency.balances:100', b'6'), ('currency.balances:1', b'7')]
+        after = c.root_after(deltas)
+
+        self.assertEqual(c.root(), before)
+        self.assertEqual(driver.pending, {})
+
+        state['currency.balances:1'] = b'7'
+        state['currency.balances:100'] = b'6'
+
+        self.assertEqual(after, rebuilt_root(state))
+
+    def test_root_after_matches_applying_deltas(self):
+        driver = tracked_driver(make_state(20))
+        c = StateCommitment(driver, buckets=64)
+
+        deltas = [('currency.balances:1', b'5'), ('currency.balances:100', b'6'), ('currency.balances:1', b'7')]
+        expected = c.root_after(deltas)
+
+        for key, value in deltas:
+            c.update(key, value)
+            driver.set(key, value)
+
+        self.assertEqual(c.save(), expected)
+
+    def test_apply_reads_values_before_they_are_written(self):
+        driver = tracked_driver(make_state(20))
+        c = StateCommitment(driver, buckets=64)
+
+        deltas = [('currency.balances:1', b'5'), ('currency.balances:100', b'6'), ('currency.balances:1', b'7')]
+        expected = c.root_after(deltas)
+
+        c.apply(deltas)
+        writes = dict(deltas)
+
+        self.assertEqual(c.save(writes=writes), expected)
+        self.assertEqual(driver.pending, {})
+        self.assertEqual(writes[STATE_ROOT_KEY], expected)
+
+        for key, value in writes.items():
+            driver.set(key, value)
+        driver.commit()
+
+        self.assertEqual(StateCommitment(driver, buckets=64).root(), expected)
+
+    def test_save_writes_buckets_with_driver(self):
+        driver = tracked_driver(make_state(20))
+        c = StateCommitment(driver, buckets=64)
+
+        c.update('currency.balances:1', b'5')
+        driver.set('currency.balances:1', b'5')
+        root = c.save()
+
+        self.assertEqual(driver.pending[STATE_ROOT_KEY], root)
+        self.assertEqual(len([k for k in driver.pending if k.startswith(bucket_key(''))]), 1)
+
+        driver.commit()
+
+        self.assertEqual(StateCommitment(driver, buckets=64).root(), root)
+
+    def test_reverted_changes_are_dropped_on_reset(self):
+        driver = tracked_driver(make_state(20))
+        c = StateCommitment(driver, buckets=64)
+        before = c.root()
+
+        c.update('currency.balances:1', b'5')
+        driver.set('currency.balances:1', b'5')
+        c.save()
+
+        driver.revert()
+        c.reset()
+
+        self.assertEqual(c.root(), before)
+
+    def test_invalidate_stops_tracking(self):
+        driver = tracked_driver(make_state(20))
+        c = StateCommitment(driver, buckets=64)
+
+        c.invalidate()
+        driver.commit()
+
+        self.assertIsNone(c.root())
+        self.assertIsNotNone(c.rebuild())
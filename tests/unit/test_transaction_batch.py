@@ -0,0 +1,20 @@
+from unittest import TestCase
+from cilantro_ee.crypto.transaction_batch import empty_transaction_batch
+
+
+class TestEmptyTransactionBatch(TestCase):
+    def test_same_masternode_and_round_make_same_batch(self):
+        a = empty_transaction_batch(sender=b'\x01' * 32, block_hash=b'\x02' * 32, block_num=5)
+        b = empty_transaction_batch(sender=b'\x01' * 32, block_hash=b'\x02' * 32, block_num=5)
+
+        self.assertEqual(a.to_bytes_packed(), b.to_bytes_packed())
+        self.assertEqual(len(a.transactions), 0)
+        self.assertEqual(a.sender, b'\x01' * 32)
+
+    def test_different_masternode_or_round_make_different_batches(self):
+        a = empty_transaction_batch(sender=b'\x01' * 32, block_hash=b'\x02' * 32, block_num=5)
+        b = empty_transaction_batch(sender=b'\x03' * 32, block_hash=b'\x02' * 32, block_num=5)
+        c = empty_transaction_batch(sender=b'\x01' * 32, block_hash=b'\x02' * 32, block_num=6)
+
+        self.assertNotEqual(a.inputHash, b.inputHash)
+        self.assertNotEqual(a.inputHash, c.inputHash)
@@ -3,8 +3,10 @@ from cilantro_ee.core.nonces import NonceManager
 from cilantro_ee.crypto.transaction import TransactionBuilder, transaction_is_valid
 from cilantro_ee.crypto import transaction
 from cilantro_ee.crypto.wallet import Wallet
+from cilantro_ee.storage import BlockchainDriver
 from cilantro_ee.messages.capnp_impl import capnp_struct as schemas
 from contracting import config
+import hashlib
 import secrets
 import os
 import capnp
@@ -603,3 +605,157 @@ class TestTXValidity(TestCase):
 
         with self.assertRaises(transaction.TransactionTooManyPendingException):
             transaction_is_valid(tx=tx_struct, expected_processor=expected_processor, driver=self.nonce_manager)
+
+
+class TestPackedTransaction(TestCase):
+    def setUp(self):
+        self.nonce_manager = NonceManager()
+        self.nonce_manager.driver.flush()
+
+    def tearDown(self):
+        self.nonce_manager.driver.flush()
+
+    def tx_bytes(self, w, processor):
+        tx = TransactionBuilder(w.verifying_key(),
+                                contract='currency',
+                                function='transfer',
+                                kwargs={'amount': 10, 'to': 'jeff'},
+                                stamps=0,
+                                processor=processor,
+                                nonce=0)
+
+        tx.sign(w.signing_key())
+        return tx.serialize()
+
+    def test_from_bytes_keeps_raw_bytes(self):
+        raw = self.tx_bytes(Wallet(), secrets.token_bytes(32))
+
+        tx = transaction.PackedTransaction.from_bytes(raw)
+
+        self.assertEqual(tx.raw, raw)
+
+    def test_payload_bytes_are_what_was_signed(self):
+        w = Wallet()
+        raw = self.tx_bytes(w, secrets.token_bytes(32))
+
+        tx = transaction.PackedTransaction.from_bytes(raw)
+
+        self.assertTrue(w.verify(tx.payload_bytes, tx.metadata.signature))
+
+    def test_tx_bytes_and_hash_match_repacked_struct(self):
+        raw = self.tx_bytes(Wallet(), secrets.token_bytes(32))
+
+        struct = transaction_capnp.Transaction.from_bytes_packed(raw)
+        tx = transaction.PackedTransaction(struct)
+
+        expected = struct.as_builder().to_bytes_packed()
+
+        self.assertEqual(tx.tx_bytes, expected)
+        self.assertEqual(tx.hash, hashlib.sha3_256(expected).digest())
+
+    def test_packed_bytes_are_only_built_once(self):
+        raw = self.tx_bytes(Wallet(), secrets.token_bytes(32))
+
+        tx = transaction.PackedTransaction.from_bytes(raw)
+
+        self.assertIs(tx.payload_bytes, tx.payload_bytes)
+        self.assertIs(tx.tx_bytes, tx.tx_bytes)
+
+    def test_transaction_is_valid_accepts_packed_transaction(self):
+        w = Wallet()
+        processor = secrets.token_bytes(32)
+        tx = transaction.PackedTransaction.from_bytes(self.tx_bytes(w, processor))
+
+        transaction_is_valid(tx=tx, expected_processor=processor, driver=self.nonce_manager)
+
+        self.assertEqual(self.nonce_manager.get_pending_nonce(processor, w.verifying_key()), 1)
+
+
+class CountingDriver(BlockchainDriver):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gets = 0
+        self.get_manys = 0
+
+    def get(self, key):
+        self.gets += 1
+        return super().get(key)
+
+    def get_many(self, keys):
+        self.get_manys += 1
+        return super().get_many(keys)
+
+
+class TestPrefetchedState(TestCase):
+    def setUp(self):
+        self.driver = CountingDriver()
+        self.driver.flush()
+
+    def tearDown(self):
+        self.driver.flush()
+
+    def make_tx(self, w, processor, nonce):
+        tx = TransactionBuilder(w.verifying_key(),
+                                contract='currency',
+                                function='transfer',
+                                kwargs={'amount': 10, 'to': 'jeff'},
+                                stamps=0,
+                                processor=processor,
+                                nonce=nonce)
+
+        tx.sign(w.signing_key())
+        return transaction.PackedTransaction.from_bytes(tx.serialize())
+
+    def test_batch_is_validated_with_one_read_and_tracks_pending_nonces(self):
+        processor = secrets.token_bytes(32)
+        a, b = Wallet(), Wallet()
+
+        txs = [self.make_tx(a, processor, 0), self.make_tx(a, processor, 1), self.make_tx(b, processor, 0)]
+
+        state = transaction.PrefetchedState(self.driver)
+        state.prefetch(txs)
+
+        reads = self.driver.gets
+
+        for tx in txs:
+            transaction.transaction_state_is_valid(tx, driver=state, strict=True)
+
+        self.assertEqual(self.driver.get_manys, 1)
+        self.assertEqual(self.driver.gets, reads)
+
+        # Nothing is written until flush
+        self.assertIsNone(self.driver.get_pending_nonce(processor, a.verifying_key()))
+
+        state.flush()
+
+        self.assertEqual(self.driver.get_pending_nonce(processor, a.verifying_key()), 2)
+        self.assertEqual(self.driver.get_pending_nonce(processor, b.verifying_key()), 1)
+
+    def test_flushed_pending_nonces_are_dropped_on_revert(self):
+        processor = secrets.token_bytes(32)
+        w = Wallet()
+
+        state = transaction.PrefetchedState(self.driver)
+        state.prefetch([self.make_tx(w, processor, 0)])
+        transaction.transaction_state_is_valid(self.make_tx(w, processor, 0), driver=state, strict=True)
+        state.flush()
+
+        self.assertEqual(self.driver.get_pending_nonce(processor, w.verifying_key()), 1)
+
+        self.driver.revert()
+
+        self.assertIsNone(self.driver.get_pending_nonce(processor, w.verifying_key()))
+
+    def test_same_nonce_twice_in_batch_is_invalid(self):
+        processor = secrets.token_bytes(32)
+        w = Wallet()
+
+        txs = [self.make_tx(w, processor, 0), self.make_tx(w, processor, 0)]
+
+        state = transaction.PrefetchedState(self.driver)
+        state.prefetch(txs)
+
+        transaction.transaction_state_is_valid(txs[0], driver=state, strict=True)
+
+        with self.assertRaises(transaction.TransactionNonceInvalid):
+            transaction.transaction_state_is_valid(txs[1], driver=state, strict=True)
@@ -220,3 +220,67 @@ class TestVKBook(TestCase):
 
 
 
+
+    def submit(self, masternodes, delegates):
+        sync.submit_vkbook({
+            'masternodes': masternodes,
+            'delegates': delegates,
+            'masternode_min_quorum': 1,
+            'enable_stamps': False,
+            'enable_nonces': False
+        }, overwrite=True)
+
+    def block_writing(self, key):
+        return {
+            'subBlocks': [{'transactions': [{'state': [{'key': key, 'value': b'x'}]}]}]
+        }
+
+    def test_membership_sets(self):
+        self.submit(['a', 'b', 'c'], ['d', 'e', 'f'])
+
+        v = VKBook()
+
+        self.assertTrue(v.is_masternode('a'))
+        self.assertFalse(v.is_masternode('d'))
+        self.assertTrue(v.is_delegate('d'))
+        self.assertTrue(v.is_core_node('a'))
+        self.assertTrue(v.is_core_node('f'))
+        self.assertFalse(v.is_core_node('x'))
+
+    def test_snapshot_is_not_read_again_on_access(self):
+        self.submit(['a', 'b', 'c'], ['d', 'e', 'f'])
+
+        v = VKBook()
+
+        self.submit(['x', 'y', 'z'], ['d', 'e', 'f'])
+
+        self.assertEqual(v.masternodes, ['a', 'b', 'c'])
+
+    def test_block_not_touching_vkbook_does_not_reload(self):
+        self.submit(['a', 'b', 'c'], ['d', 'e', 'f'])
+
+        v = VKBook()
+
+        self.submit(['x', 'y', 'z'], ['d', 'e', 'f'])
+
+        self.assertFalse(v.update_with_block(self.block_writing(b'currency.balances:stu')))
+        self.assertEqual(v.masternodes, ['a', 'b', 'c'])
+
+    def test_block_touching_vkbook_reloads(self):
+        self.submit(['a', 'b', 'c'], ['d', 'e', 'f'])
+
+        v = VKBook()
+
+        self.submit(['x', 'y', 'z'], ['d', 'e', 'f'])
+
+        self.assertTrue(v.update_with_block(self.block_writing(b'vkbook.masternode_list')))
+        self.assertEqual(v.masternodes, ['x', 'y', 'z'])
+        self.assertTrue(v.is_masternode('x'))
+        self.assertFalse(v.is_masternode('a'))
+
+    def test_block_touching_election_house_reloads(self):
+        self.submit(['a', 'b', 'c'], ['d', 'e', 'f'])
+
+        v = VKBook()
+
+        self.assertTrue(v.update_with_block(self.block_writing('election_house.policies:masternodes')))
@@ -1,5 +1,6 @@
 from unittest import TestCase
-from cilantro_ee.crypto.wallet import Wallet
+from cilantro_ee.crypto.wallet import Wallet, _verify, _verify_batch, BATCH_VERIFY_THRESHOLD, signature_cache
+import nacl.signing
 
 
 class TestWallet(TestCase):
@@ -83,3 +84,101 @@ class TestWallet(TestCase):
         a = Wallet()
 
         self.assertFalse(a.verify(message, signature))
+
+
+class TestVerifyBatch(TestCase):
+    def triples(self, n):
+        triples = []
+        for i in range(n):
+            w = Wallet()
+            message = 'howdy {}'.format(i).encode()
+            triples.append((w.verifying_key(), message, w.sign(message)))
+        return triples
+
+    def test_empty_batch(self):
+        self.assertListEqual(_verify_batch([]), [])
+
+    def test_small_batch_all_valid(self):
+        self.assertListEqual(_verify_batch(self.triples(5)), [True] * 5)
+
+    def test_large_batch_all_valid(self):
+        n = BATCH_VERIFY_THRESHOLD * 2 + 1
+
+        self.assertListEqual(_verify_batch(self.triples(n)), [True] * n)
+
+    def test_large_batch_reports_invalid_in_place(self):
+        n = BATCH_VERIFY_THRESHOLD * 2
+        triples = self.triples(n)
+
+        vk, _, sig = triples[10]
+        triples[10] = (vk, b'not what was signed', sig)
+
+        results = _verify_batch(triples)
+
+        self.assertFalse(results[10])
+        self.assertEqual(results.count(True), n - 1)
+
+    def test_key_is_parsed_once_per_sender(self):
+        w = Wallet()
+        triples = [(w.verifying_key(), 'howdy {}'.format(i).encode(), w.sign('howdy {}'.format(i).encode()))
+                   for i in range(10)]
+
+        parsed = []
+        verify_key = nacl.signing.VerifyKey
+        nacl.signing.VerifyKey = lambda vk: parsed.append(vk) or verify_key(vk)
+
+        try:
+            results = _verify_batch(triples)
+        finally:
+            nacl.signing.VerifyKey = verify_key
+
+        self.assertListEqual(results, [True] * 10)
+        self.assertEqual(len(parsed), 1)
+
+    def test_malformed_signature_is_invalid(self):
+        vk, message, _ = self.triples(1)[0]
+
+        self.assertListEqual(_verify_batch([(vk, message, b'\x00' * 5)]), [False])
+
+
+class TestSignatureCache(TestCase):
+    def setUp(self):
+        signature_cache.clear()
+
+    def test_valid_signature_is_cached(self):
+        w = Wallet()
+        signature = w.sign(b'howdy')
+
+        self.assertTrue(_verify(w.verifying_key(), b'howdy', signature))
+        self.assertEqual(signature_cache.misses, 1)
+
+        self.assertTrue(_verify(w.verifying_key(), b'howdy', signature))
+        self.assertEqual(signature_cache.hits, 1)
+
+    def test_invalid_signature_is_not_cached(self):
+        w = Wallet()
+        signature = w.sign(b'howdy')
+
+        self.assertFalse(_verify(w.verifying_key(), b'hello', signature))
+        self.assertFalse(_verify(w.verifying_key(), b'hello', signature))
+
+        self.assertEqual(len(signature_cache), 0)
+        self.assertEqual(signature_cache.hits, 0)
+
+    def test_cached_signature_does_not_verify_other_message(self):
+        w = Wallet()
+        signature = w.sign(b'howdy')
+
+        _verify(w.verifying_key(), b'howdy', signature)
+
+        self.assertFalse(_verify(w.verifying_key(), b'hello', signature))
+        self.assertFalse(_verify(Wallet().verifying_key(), b'howdy', signature))
+
+    def test_batch_uses_cache(self):
+        w = Wallet()
+        signature = w.sign(b'howdy')
+
+        _verify_batch([(w.verifying_key(), b'howdy', signature)])
+        _verify_batch([(w.verifying_key(), b'howdy', signature)])
+
+        self.assertEqual(signature_cache.hits, 1)